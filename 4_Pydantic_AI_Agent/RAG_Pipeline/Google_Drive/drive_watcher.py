@@ -1,4 +1,5 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from collections import deque
 from datetime import datetime, timedelta, timezone
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
@@ -6,6 +7,9 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
+import threading
+import tempfile
 import random
 import time
 import json
@@ -15,13 +19,30 @@ import io
 from pathlib import Path
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from common.text_processor import extract_text_from_file, chunk_text, create_embeddings
-from common.db_handler import process_file_for_rag, delete_document_by_file_id
+from common.text_processor import iter_text_from_file, peek_segments, chunk_text, create_embeddings
+from common.db_handler import process_file_for_rag, delete_document_by_file_id, get_file_filter_metadata
+from common.checkpoint_store import CheckpointStore, get_checkpoint_path
+from common.ingestion_pipeline import run_ingestion_pipeline
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly',
           'https://www.googleapis.com/auth/drive.readonly']
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# File metadata requested from the changes feed
+FILE_FIELDS = "id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed, parents"
+
+# File metadata requested when listing files
+# (parents gives every chunk its folder, which retrieval can filter on)
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed, parents)"
+
+# Largest page size files().list allows
+LIST_PAGE_SIZE = 1000
+
+# HTTP statuses worth retrying a download chunk for
+TRANSIENT_HTTP_STATUSES = (408, 429, 500, 502, 503, 504)
+
 class GoogleDriveWatcher:
     def __init__(self, credentials_path: str = 'credentials.json', token_path: str = 'token.json', folder_id: str = None, config_path: str = None):
         """
@@ -36,8 +57,15 @@ class GoogleDriveWatcher:
         self.token_path = token_path
         self.folder_id = folder_id
         self.service = None
+        self.credentials = None
+        self.thread_local = threading.local()  # Per-thread Drive services for concurrent downloads
         self.known_files = {}  # Store file IDs and their last modified time
         self.initialized = False  # Flag to track if we've done the initial scan
+        self.folder_parents = {}  # Folders inside the watched folder and their parents
+        self.removed_file_ids = []  # Known files the changes feed reported as removed
+        self.api_calls = {}  # Drive API calls made in the current cycle by method
+        self.api_calls_lock = threading.Lock()
+        self.last_deletion_check = None  # When check_for_deleted_files last ran (time.monotonic)
         
         # Load configuration
         self.config = {}
@@ -48,6 +76,14 @@ class GoogleDriveWatcher:
             self.config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
         self.load_config()
         
+        # Mutable state like the last check time lives in a checkpoint file, not in config.json
+        self.checkpoint_source = f"drive:{self.folder_id or 'root'}"
+        self.checkpoints = CheckpointStore(
+            get_checkpoint_path(self.config, self.config_path),
+            self.config.get('checkpoint_flush_interval_seconds', 30)
+        )
+        self.restore_checkpoint()
+        
     def load_config(self) -> None:
         """
         Load configuration from JSON file.
@@ -96,18 +132,31 @@ class GoogleDriveWatcher:
             self.last_check_time = datetime.strptime('1970-01-01T00:00:00.000Z', '%Y-%m-%dT%H:%M:%S.%fZ')
             print("Using default configuration")          
             
+    def restore_checkpoint(self) -> None:
+        """
+        Resume from the last check time in the checkpoint (config.json's last_check_time is only used
+        when there is no checkpoint yet).
+        """
+        last_check_time_str = self.checkpoints.get(self.checkpoint_source, 'last_check_time')
+        if not last_check_time_str:
+            return
+        
+        try:
+            self.last_check_time = datetime.strptime(last_check_time_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+            print(f"Resuming from checkpointed last check time: {self.last_check_time}")
+        except ValueError:
+            print("Invalid last check time format in checkpoint, ignoring it")
+    
     def save_last_check_time(self) -> None:
         """
-        Save the last check time to the config file.
+        Save the last check time to the checkpoint file (written in batches, see CheckpointStore).
         """
         try:
-            # Update the last_check_time in the config
-            self.config['last_check_time'] = self.last_check_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            
-            # Write the updated config back to the file
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
-                
+            self.checkpoints.set(
+                self.checkpoint_source,
+                'last_check_time',
+                self.last_check_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            )
             print(f"Saved last check time: {self.last_check_time}")
         except Exception as e:
             print(f"Error saving last check time: {e}")
@@ -143,8 +192,199 @@ class GoogleDriveWatcher:
                 token.write(creds.to_json())
         
         # Build the Drive API service
+        self.credentials = creds
         self.service = build('drive', 'v3', credentials=creds)
     
+    def get_service(self):
+        """
+        Get a Drive API service for the current thread. The underlying HTTP client isn't thread-safe,
+        so download workers each build their own service from the shared credentials.
+        
+        Returns:
+            The Drive API service
+        """
+        if threading.current_thread() is threading.main_thread() or self.credentials is None:
+            return self.service
+        
+        if getattr(self.thread_local, 'service', None) is None:
+            self.thread_local.service = build('drive', 'v3', credentials=self.credentials, cache_discovery=False)
+        return self.thread_local.service
+    
+    def count_api_call(self, method: str, count: int = 1) -> None:
+        """
+        Count Drive API calls for the per-cycle quota report.
+        
+        Args:
+            method: The API method, e.g. files.list
+            count: Number of calls made
+        """
+        with self.api_calls_lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + count
+    
+    def reset_api_calls(self) -> Dict[str, int]:
+        """
+        Start counting API calls for a new cycle.
+        
+        Returns:
+            Dict with the number of API calls made in the previous cycle by method
+        """
+        with self.api_calls_lock:
+            api_calls, self.api_calls = self.api_calls, {}
+        return api_calls
+    
+    def report_api_calls(self) -> Dict[str, int]:
+        """
+        Print the number of Drive API calls since the last report and start a new count.
+        
+        Returns:
+            Dict with the number of API calls by method
+        """
+        api_calls = self.reset_api_calls()
+        
+        # Batch round trips aren't extra quota, the calls inside them are counted by method
+        batches = api_calls.get('batch', 0)
+        calls = {method: count for method, count in api_calls.items() if method != 'batch'}
+        details = ", ".join(f"{method}: {count}" for method, count in sorted(calls.items()))
+        print(f"Drive API calls this cycle: {sum(calls.values())} ({details or 'none'}) in {batches} batch requests")
+        
+        return api_calls
+    
+    def list_files(self, query: str = None, fields: str = LIST_FIELDS) -> List[Dict[str, Any]]:
+        """
+        List all files matching a query, following page tokens.
+        
+        Args:
+            query: The files().list query (None for all files)
+            fields: The fields to request
+            
+        Returns:
+            List of files with their metadata
+        """
+        files = []
+        page_token = None
+        while True:
+            kwargs = {'pageSize': LIST_PAGE_SIZE, 'fields': fields}
+            if query:
+                kwargs['q'] = query
+            if page_token:
+                kwargs['pageToken'] = page_token
+            
+            results = self.service.files().list(**kwargs).execute()
+            self.count_api_call('files.list')
+            files.extend(results.get('files', []))
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+    
+    def execute_batch(self, requests: List[Tuple[Any, Any]], method: str) -> Dict[Any, Any]:
+        """
+        Execute Drive API requests in batch HTTP requests (config['list_batch_size'] requests per batch, max 100).
+        
+        Args:
+            requests: (key, request) pairs
+            method: The API method of the requests, for counting API calls
+            
+        Returns:
+            Dict mapping each key to its response, or to the exception if the request failed
+        """
+        batch_size = max(1, min(self.config.get('list_batch_size', 50), 100))
+        results = {}
+        
+        for start in range(0, len(requests), batch_size):
+            chunk = requests[start:start + batch_size]
+            keys = {str(i): key for i, (key, _) in enumerate(chunk)}
+            
+            def callback(request_id, response, exception):
+                results[keys[request_id]] = exception if exception is not None else response
+            
+            batch = self.service.new_batch_http_request(callback=callback)
+            for i, (_, request) in enumerate(chunk):
+                batch.add(request, request_id=str(i))
+            batch.execute()
+            
+            # Every request in a batch still counts against the quota
+            self.count_api_call(method, len(chunk))
+            self.count_api_call('batch')
+        
+        return results
+    
+    def crawl_folder(self, folder_id: str, time_str: str = None, include_files: bool = True,
+                     max_depth: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+        """
+        Crawl a folder tree breadth first. Every listing follows its page tokens, and the listings of a
+        whole level of folders are sent together in Drive batch requests.
+        
+        Args:
+            folder_id: The ID of the root folder
+            time_str: Only return files modified or created after this time (RFC 3339, None for all files)
+            include_files: Whether to list files, or only the folder tree
+            max_depth: How many levels of subfolders to descend into (None for config['max_folder_depth'], unlimited if unset)
+            
+        Returns:
+            Tuple of the files found and a dict mapping each subfolder ID to its parent folder IDs
+        """
+        if max_depth is None:
+            max_depth = self.config.get('max_folder_depth')
+        
+        files = []
+        folder_parents = {}
+        
+        def list_request(kind: str, parent_id: str, page_token: str = None):
+            if kind == 'files':
+                query = f"'{parent_id}' in parents"
+                if time_str:
+                    query = f"(modifiedTime > '{time_str}' or createdTime > '{time_str}') and {query}"
+                kwargs = {'q': query, 'pageSize': LIST_PAGE_SIZE, 'fields': LIST_FIELDS}
+            else:
+                kwargs = {
+                    'q': f"'{parent_id}' in parents and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false",
+                    'pageSize': LIST_PAGE_SIZE,
+                    'fields': "nextPageToken, files(id, parents)"
+                }
+            if page_token:
+                kwargs['pageToken'] = page_token
+            return self.service.files().list(**kwargs)
+        
+        def enqueue_folder(parent_id: str, depth: int) -> None:
+            if include_files:
+                pending.append(('files', parent_id, depth, None))
+            # Only look for subfolders if we're allowed to descend into them
+            if max_depth is None or depth < max_depth:
+                pending.append(('folders', parent_id, depth, None))
+        
+        pending = deque()
+        enqueue_folder(folder_id, 0)
+        
+        while pending:
+            # Send everything that's queued (one level of the tree plus continuation pages) together
+            level = list(pending)
+            pending.clear()
+            
+            responses = self.execute_batch([
+                ((kind, parent_id, depth, page_token), list_request(kind, parent_id, page_token))
+                for kind, parent_id, depth, page_token in level
+            ], 'files.list')
+            
+            for (kind, parent_id, depth, page_token), response in responses.items():
+                if isinstance(response, Exception):
+                    print(f"Error listing folder {parent_id}: {response}")
+                    continue
+                
+                if kind == 'files':
+                    files.extend(response.get('files', []))
+                else:
+                    for subfolder in response.get('files', []):
+                        if subfolder['id'] in folder_parents:
+                            continue
+                        folder_parents[subfolder['id']] = subfolder.get('parents', [parent_id])
+                        enqueue_folder(subfolder['id'], depth + 1)
+                
+                if response.get('nextPageToken'):
+                    pending.append((kind, parent_id, depth, response['nextPageToken']))
+        
+        return files, folder_parents
+    
     def get_folder_contents(self, folder_id: str, time_str: str) -> List[Dict[str, Any]]:
         """
         Get all files and subfolders in a folder that have been modified or created after the specified time.
@@ -156,33 +396,56 @@ class GoogleDriveWatcher:
         Returns:
             List of files and folders with their metadata
         """
-        # Query for files in this folder that were modified OR created after the specified time
-        query = f"(modifiedTime > '{time_str}' or createdTime > '{time_str}') and '{folder_id}' in parents"
-        
-        results = self.service.files().list(
-            q=query,
-            pageSize=100,
-            fields="nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed)"
-        ).execute()
-        
-        items = results.get('files', [])
-        
-        # Find all subfolders in this folder (regardless of modification time)
-        folder_query = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-        folder_results = self.service.files().list(
-            q=folder_query,
-            pageSize=100,
-            fields="files(id)"
-        ).execute()
+        files, folder_parents = self.crawl_folder(folder_id, time_str)
+        # Every crawl lists the whole folder tree, keep it to record the folders each file is in
+        self.folder_parents.update(folder_parents)
+        return files
+    
+    def list_files_in_folders(self, folder_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        List the files directly inside each of the given folders (including trashed ones), batching the listings.
         
-        subfolders = folder_results.get('files', [])
+        Args:
+            folder_ids: The IDs of the folders
+            
+        Returns:
+            List of the files with their IDs and parents
+        """
+        files = []
+        pending = [(folder_id, None) for folder_id in folder_ids]
+        
+        while pending:
+            requests = []
+            for folder_id, page_token in pending:
+                kwargs = {'q': f"'{folder_id}' in parents", 'pageSize': LIST_PAGE_SIZE,
+                          'fields': "nextPageToken, files(id, parents)"}
+                if page_token:
+                    kwargs['pageToken'] = page_token
+                requests.append(((folder_id, page_token), self.service.files().list(**kwargs)))
+            pending = []
+            
+            for (folder_id, _), response in self.execute_batch(requests, 'files.list').items():
+                if isinstance(response, Exception):
+                    print(f"Error listing folder {folder_id}: {response}")
+                    continue
+                files.extend(response.get('files', []))
+                if response.get('nextPageToken'):
+                    pending.append((folder_id, response['nextPageToken']))
         
-        # Recursively get contents of each subfolder
-        for subfolder in subfolders:
-            subfolder_items = self.get_folder_contents(subfolder['id'], time_str)
-            items.extend(subfolder_items)
+        return files
+    
+    def get_folder_tree(self, folder_id: str) -> Dict[str, List[str]]:
+        """
+        Get all folders below a folder.
         
-        return items
+        Args:
+            folder_id: The ID of the root folder
+            
+        Returns:
+            Dict mapping each subfolder ID to its parent folder IDs
+        """
+        _, folder_parents = self.crawl_folder(folder_id, include_files=False)
+        return folder_parents
     
     def get_changes(self) -> List[Dict[str, Any]]:
         """
@@ -191,6 +454,10 @@ class GoogleDriveWatcher:
         Returns:
             List of changed files with their metadata
         """
+        # Use the changes feed cursor instead of modifiedTime queries when configured
+        if self.config.get('change_mode', 'query') == 'changes':
+            return self.get_changes_from_feed()
+        
         if not self.service:
             self.authenticate()
         
@@ -205,13 +472,7 @@ class GoogleDriveWatcher:
         else:
             # If no folder is specified, get all files in the drive that were modified OR created after the specified time
             query = f"modifiedTime > '{time_str}' or createdTime > '{time_str}'"
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed)"
-            ).execute()
-            
-            files = results.get('files', [])
+            files = self.list_files(query)
         
         # Update the last check time
         self.last_check_time = datetime.now(timezone.utc)
@@ -221,49 +482,254 @@ class GoogleDriveWatcher:
         
         return files
     
-    def download_file(self, file_id: str, mime_type: str) -> Optional[bytes]:
+    def is_in_watched_folder(self, parents: List[str]) -> bool:
+        """
+        Check if a file with the given parents is inside the watched folder, using the local parent map
+        instead of API calls.
+        
+        Args:
+            parents: The parent folder IDs of the file
+            
+        Returns:
+            bool: True if the file is inside the watched folder (always True when watching all of Drive)
+        """
+        if not self.folder_id:
+            return True
+        
+        pending = list(parents or [])
+        seen = set()
+        while pending:
+            parent_id = pending.pop()
+            if parent_id == self.folder_id:
+                return True
+            if parent_id in seen or parent_id not in self.folder_parents:
+                continue
+            seen.add(parent_id)
+            pending.extend(self.folder_parents[parent_id])
+        
+        return False
+    
+    def start_change_feed(self) -> None:
+        """
+        Prepare the changes feed: get a start page token if there is none in the checkpoint yet and
+        load (or build) the parent map of the watched folder.
+        """
+        if not self.service:
+            self.authenticate()
+        
+        if not self.checkpoints.get(self.checkpoint_source, 'page_token'):
+            response = self.service.changes().getStartPageToken().execute()
+            self.count_api_call('changes.getStartPageToken')
+            self.checkpoints.set(self.checkpoint_source, 'page_token', response.get('startPageToken'))
+        
+        folder_parents = self.checkpoints.get(self.checkpoint_source, 'folder_parents')
+        if folder_parents is None:
+            print("Building folder map of the watched folder...")
+            folder_parents = self.get_folder_tree(self.folder_id) if self.folder_id else {}
+            self.checkpoints.set(self.checkpoint_source, 'folder_parents', folder_parents)
+        self.folder_parents = folder_parents
+        
+        self.checkpoints.flush()
+    
+    def get_changes_from_feed(self) -> List[Dict[str, Any]]:
+        """
+        Get changes since the last check from the Drive changes feed, starting at the page token saved
+        in the checkpoint. Only the deltas are fetched, so the cost doesn't grow with the folder tree.
+        Known files that were removed or moved out of the watched folder are collected in removed_file_ids.
+        
+        Returns:
+            List of changed files in the watched folder with their metadata
+        """
+        if not self.service:
+            self.authenticate()
+        
+        self.removed_file_ids = []
+        page_token = self.checkpoints.get(self.checkpoint_source, 'page_token')
+        if not page_token:
+            # Nothing to compare against yet, start watching from now
+            self.start_change_feed()
+            return []
+        
+        changes = []
+        new_start_page_token = None
+        while page_token:
+            response = self.service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                includeRemoved=True,
+                pageSize=1000,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+            ).execute()
+            self.count_api_call('changes.list')
+            changes.extend(response.get('changes', []))
+            page_token = response.get('nextPageToken')
+            new_start_page_token = response.get('newStartPageToken', new_start_page_token)
+        
+        files = []
+        removed_file_ids = []
+        removed_folder_ids = []
+        
+        # Update the folder map first so files in new folders are recognized
+        for change in changes:
+            file = change.get('file')
+            if change.get('removed') or not file:
+                if self.folder_parents.pop(change.get('fileId'), None) is not None:
+                    removed_folder_ids.append(change.get('fileId'))
+                continue
+            if file.get('mimeType') != FOLDER_MIME_TYPE or not self.folder_id:
+                continue
+            
+            folder_id = file['id']
+            was_watched = folder_id in self.folder_parents
+            if not file.get('trashed', False) and self.is_in_watched_folder(file.get('parents', [])):
+                self.folder_parents[folder_id] = file.get('parents', [])
+                if not was_watched:
+                    # A folder created in or moved into the watched folder brings its existing contents along
+                    self.folder_parents.update(self.get_folder_tree(folder_id))
+                    files.extend(self.get_folder_contents(folder_id, '1970-01-01T00:00:00.000Z'))
+            elif was_watched:
+                del self.folder_parents[folder_id]
+                removed_folder_ids.append(folder_id)
+        
+        if removed_folder_ids:
+            # The feed only reports the folder that left the watched folder (moved, trashed or deleted),
+            # not its subfolders and files, so prune its whole subtree and remove the files known in it
+            orphaned = [folder_id for folder_id, parents in self.folder_parents.items()
+                        if not self.is_in_watched_folder(parents)]
+            for folder_id in orphaned:
+                del self.folder_parents[folder_id]
+            
+            for file in self.list_files_in_folders(removed_folder_ids + orphaned):
+                if file['id'] in self.known_files and not self.is_in_watched_folder(file.get('parents', [])):
+                    removed_file_ids.append(file['id'])
+        
+        for change in changes:
+            file = change.get('file')
+            file_id = change.get('fileId')
+            if change.get('removed') or not file:
+                if file_id in self.known_files:
+                    removed_file_ids.append(file_id)
+                continue
+            if file.get('mimeType') == FOLDER_MIME_TYPE:
+                continue
+            
+            if self.is_in_watched_folder(file.get('parents', [])):
+                files.append(file)
+            elif file_id in self.known_files:
+                # Moved out of the watched folder
+                removed_file_ids.append(file_id)
+        
+        self.removed_file_ids = list(dict.fromkeys(removed_file_ids))
+        
+        # Save the new cursor together with the folder map it belongs to
+        self.checkpoints.set(self.checkpoint_source, 'folder_parents', self.folder_parents)
+        if new_start_page_token:
+            self.checkpoints.set(self.checkpoint_source, 'page_token', new_start_page_token)
+        
+        # Skip duplicates of files that changed several times
+        unique_files = {}
+        for file in files:
+            unique_files[file['id']] = file
+        return list(unique_files.values())
+    
+    def is_transient_error(self, error: Exception) -> bool:
         """
-        Download a file from Google Drive.
+        Check if a download error is worth retrying (rate limits, server errors, dropped connections).
+        
+        Args:
+            error: The exception raised while downloading
+            
+        Returns:
+            bool: True if the download should be retried
+        """
+        if isinstance(error, HttpError):
+            return error.resp.status in TRANSIENT_HTTP_STATUSES
+        # Connection resets, timeouts and other socket errors
+        return isinstance(error, OSError)
+    
+    def download_file_to_buffer(self, file_id: str, mime_type: str) -> Optional[tempfile.SpooledTemporaryFile]:
+        """
+        Stream a file from Google Drive into a spooled temporary file. Small files stay in memory,
+        larger ones roll over to disk (config['download_spool_max_bytes']) so they don't sit in the heap.
+        Chunks that fail with a transient error are retried and the download resumes where it stopped.
         
         Args:
             file_id: The ID of the file to download
             mime_type: The MIME type of the file
             
         Returns:
-            The file content as bytes, or None if download failed
+            The spooled file positioned at the start, or None if download failed
         """
         if not self.service:
             self.authenticate()
         
+        service = self.get_service()
+        buffer = tempfile.SpooledTemporaryFile(max_size=self.config.get('download_spool_max_bytes', 16 * 1024 * 1024))
+        
         try:
-            file_content = io.BytesIO()
-            
             # Check if this is a Google Workspace file that needs to be exported
             export_mime_types = self.config.get('export_mime_types', {})
             if mime_type in export_mime_types:
                 # Export the file in the appropriate format
-                request = self.service.files().export_media(
+                request = service.files().export_media(
                     fileId=file_id, 
                     mimeType=export_mime_types[mime_type]
                 )
             else:
                 # For regular files, download directly
-                request = self.service.files().get_media(fileId=file_id)
+                request = service.files().get_media(fileId=file_id)
             
-            # Download the file
-            downloader = MediaIoBaseDownload(file_content, request)
+            # Download the file chunk by chunk
+            downloader = MediaIoBaseDownload(buffer, request, chunksize=self.config.get('download_chunk_size', 10 * 1024 * 1024))
+            max_retries = self.config.get('download_max_retries', 5)
+            retries = 0
             done = False
             while not done:
-                status, done = downloader.next_chunk()
+                try:
+                    status, done = downloader.next_chunk()
+                    self.count_api_call('files.download')
+                except Exception as e:
+                    if retries >= max_retries or not self.is_transient_error(e):
+                        raise
+                    # The downloader only advances after a chunk is written, so the retry resumes at the same offset
+                    retries += 1
+                    delay = min(2 ** retries, 30) + random.uniform(0, 1)
+                    print(f"Retrying download of file {file_id} in {delay:.1f}s after error: {e}")
+                    time.sleep(delay)
             
             # Reset the pointer to the beginning of the file
-            file_content.seek(0)
-            return file_content.read()
+            buffer.seek(0)
+            return buffer
         
         except Exception as e:
+            buffer.close()
             print(f"Error downloading file {file_id}: {e}")
             return None
     
+    def download_file(self, file_id: str, mime_type: str) -> Optional[bytes]:
+        """
+        Download a file from Google Drive into memory.
+        
+        The download itself streams chunk by chunk into a spooled file (see download_file_to_buffer), but
+        the whole file is still read into one bytes object here: text extraction, the PDF process pool,
+        tabular parsing and image storage all take the file content as bytes. Use download_file_to_buffer
+        directly to work on the file without loading it.
+        
+        Args:
+            file_id: The ID of the file to download
+            mime_type: The MIME type of the file
+            
+        Returns:
+            The file content as bytes, or None if download failed
+        """
+        buffer = self.download_file_to_buffer(file_id, mime_type)
+        if buffer is None:
+            return None
+        
+        # Read the spooled file once, straight into the bytes the extractor works on
+        with buffer:
+            return buffer.read()
+    
     def process_file(self, file: Dict[str, Any]) -> None:
         """
         Process a file for the RAG pipeline.
@@ -297,14 +763,15 @@ class GoogleDriveWatcher:
             print(f"Failed to download file '{file_name}' (ID: {file_id})")
             return
         
-        # Extract text from the file
-        text = extract_text_from_file(file_content, mime_type, file_name, self.config)
+        # Extract text from the file, streaming it (e.g. page by page) into chunking
+        text = peek_segments(iter_text_from_file(file_content, mime_type, file_name, self.config))
         if not text:
             print(f"No text could be extracted from file '{file_name}' (ID: {file_id})")
             return
         
         # Process the file for RAG
-        success = process_file_for_rag(file_content, text, file_id, web_view_link, file_name, mime_type, self.config)
+        success = process_file_for_rag(file_content, text, file_id, web_view_link, file_name, mime_type, self.config,
+                                       get_file_filter_metadata(file, self.folder_parents))
         
         # Update the known files dictionary
         self.known_files[file_id] = file.get('modifiedTime')
@@ -314,9 +781,55 @@ class GoogleDriveWatcher:
         else:
             print(f"Failed to process file '{file_name}' (ID: {file_id})")
     
+    def process_files(self, files: List[Dict[str, Any]]) -> None:
+        """
+        Process a batch of changed files for the RAG pipeline.
+        
+        Multiple files go through the pipelined ingestion engine, whose read stage downloads
+        config['ingestion']['read_concurrency'] files at a time.
+        
+        Args:
+            files: The file metadata from Google Drive
+        """
+        if len(files) <= 1 or not self.config.get('ingestion', {}).get('enabled', True):
+            for file in files:
+                self.process_file(file)
+                # Update known_files with just the modifiedTime
+                if not file.get('trashed', False):
+                    self.known_files[file['id']] = file.get('modifiedTime')
+            return
+        
+        supported_mime_types = self.config.get('supported_mime_types', [])
+        supported_files = []
+        for file in files:
+            # Trashed and unsupported files don't need downloading
+            if file.get('trashed', False) or not any(file['mimeType'].startswith(t) for t in supported_mime_types):
+                self.process_file(file)
+                if not file.get('trashed', False):
+                    self.known_files[file['id']] = file.get('modifiedTime')
+                continue
+            supported_files.append(file)
+        
+        if not supported_files:
+            return
+        
+        results = run_ingestion_pipeline(
+            supported_files,
+            lambda file: self.download_file(file['id'], file['mimeType']),
+            self.config,
+            self.folder_parents
+        )
+        
+        # Update known_files with just the modifiedTime
+        for file in supported_files:
+            self.known_files[file['id']] = file.get('modifiedTime')
+        
+        print(f"Processed {sum(results.values())} of {len(supported_files)} files successfully.")
+    
     def check_for_deleted_files(self) -> List[str]:
         """
-        Check for files that have been deleted from Google Drive.
+        Check for files that have been deleted from Google Drive. The known files are looked up
+        in Drive batch requests instead of one request each.
         
         Returns:
             List of IDs of deleted files
@@ -330,29 +843,43 @@ class GoogleDriveWatcher:
         # Only check if we have known files
         if not self.known_files:
             return deleted_files
-            
+        
+        responses = self.execute_batch([
+            (file_id, self.service.files().get(fileId=file_id, fields="id, trashed, name"))
+            for file_id in self.known_files
+        ], 'files.get')
+        
         # Check each known file to see if it still exists or has been trashed
-        for file_id in list(self.known_files.keys()):
-            try:
-                # Get the file metadata
-                file = self.service.files().get(
-                    fileId=file_id,
-                    fields="trashed,name"
-                ).execute()
-                
-                # If the file is in the trash, consider it deleted
-                if file.get('trashed', False):
-                    print(f"File '{file.get('name', 'Unknown')}' (ID: {file_id}) is in trash")
-                    deleted_files.append(file_id)
-            except Exception as e:
+        for file_id, response in responses.items():
+            if isinstance(response, Exception):
                 # If we get an error (like file not found), the file is deleted
-                if 'File not found' in str(e) or '404' in str(e):
+                status = getattr(getattr(response, 'resp', None), 'status', None)
+                if status == 404 or 'File not found' in str(response) or '404' in str(response):
                     deleted_files.append(file_id)
                 else:
-                    print(f"Error checking file {file_id}: {e}")
+                    print(f"Error checking file {file_id}: {response}")
+            elif response.get('trashed', False):
+                # If the file is in the trash, consider it deleted
+                print(f"File '{response.get('name', 'Unknown')}' (ID: {file_id}) is in trash")
+                deleted_files.append(file_id)
         
         return deleted_files
     
+    def is_deletion_check_due(self) -> bool:
+        """
+        Check if it's time to look for deleted files. Deletion checks cost one API call per known file,
+        so they run every config['deletion_check_interval_seconds'] instead of every cycle.
+        
+        Returns:
+            bool: True if check_for_deleted_files should run this cycle
+        """
+        interval = self.config.get('deletion_check_interval_seconds', 0)
+        if self.last_deletion_check is not None and time.monotonic() - self.last_deletion_check < interval:
+            return False
+        
+        self.last_deletion_check = time.monotonic()
+        return True
+    
     def watch_for_changes(self, interval_seconds: int = 60) -> None:
         """
         Watch for changes in Google Drive at regular intervals.
@@ -368,8 +895,14 @@ class GoogleDriveWatcher:
             if not self.service:
                 self.authenticate()
             
+            change_mode = self.config.get('change_mode', 'query')
+            
             # Initial scan to build the known_files dictionary
             if not self.initialized:
+                # Get the changes feed cursor before scanning so no changes are missed in between
+                if change_mode == 'changes':
+                    self.start_change_feed()
+                
                 print("Performing initial scan of files...")
                 # Get all files in the watched folder
                 # Use the last check time from config or default to 1970-01-01
@@ -378,11 +911,7 @@ class GoogleDriveWatcher:
                     files = self.get_folder_contents(self.folder_id, time_str)  # Get all files
                 else:
                     # If watching all of Drive, get all files
-                    results = self.service.files().list(
-                        pageSize=1000,
-                        fields="nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, trashed)"
-                    ).execute()
-                    files = results.get('files', [])
+                    files = self.list_files()
                 
                 # Build the known_files dictionary - only store the modifiedTime
                 for file in files:
@@ -391,29 +920,27 @@ class GoogleDriveWatcher:
                         self.known_files[file['id']] = file.get('modifiedTime')
                 
                 print(f"Found {len(self.known_files)} files in initial scan.")
+                self.report_api_calls()
                 self.initialized = True
             
             while True:
                 # Get changes since the last check
                 changed_files = self.get_changes()
                 
-                # Check for deleted files (every 5 cycles to reduce API calls)
+                # Check for deleted files
                 deleted_file_ids = []
-
-                # Uncomment this code and delete the line below it if you want to check for deleted files less often (for performance gains with many files)
-                # if random.random() < 0.2:  # ~20% chance each cycle, or about once every 5 cycles
-                #    print("Checking for deleted files...")
-                #     deleted_file_ids = self.check_for_deleted_files()
-                deleted_file_ids = self.check_for_deleted_files()
+                if change_mode == 'changes':
+                    # The changes feed already reports removed files
+                    deleted_file_ids = self.removed_file_ids
+                elif self.is_deletion_check_due():
+                    # Only every deletion_check_interval_seconds to reduce API calls
+                    print("Checking for deleted files...")
+                    deleted_file_ids = self.check_for_deleted_files()
                 
                 # Process changed files
                 if changed_files:
                     print(f"Found {len(changed_files)} changed files.")
-                    for file in changed_files:
-                        print(file)
-                        self.process_file(file)
-                        # Update known_files with just the modifiedTime
-                        self.known_files[file['id']] = file.get('modifiedTime')
+                    self.process_files(changed_files)
                 
                 # Process deleted files
                 if deleted_file_ids:
@@ -424,6 +951,9 @@ class GoogleDriveWatcher:
                         # Remove from known_files
                         del self.known_files[file_id]
                 
+                # Report the Drive API quota this cycle used
+                self.report_api_calls()
+                
                 # Wait for the next check
                 print(f"Waiting {interval_seconds} seconds until next check...")
                 time.sleep(interval_seconds)
@@ -433,3 +963,6 @@ class GoogleDriveWatcher:
         except Exception as e:
             print(f"Error in watcher: {e}")
             raise
+        finally:
+            # Write the latest checkpoint before exiting
+            self.checkpoints.flush()
@@ -85,16 +85,16 @@ def mock_file_data():
 @pytest.fixture
 def mock_text_processor():
     """Fixture to mock text_processor functions"""
-    with patch('Google_Drive.drive_watcher.extract_text_from_file') as mock_extract, \
+    with patch('Google_Drive.drive_watcher.iter_text_from_file') as mock_extract, \
          patch('Google_Drive.drive_watcher.chunk_text') as mock_chunk, \
          patch('Google_Drive.drive_watcher.create_embeddings') as mock_embeddings:
         
-        mock_extract.return_value = "Extracted text content"
+        mock_extract.return_value = iter(["Extracted text content"])
         mock_chunk.return_value = ["Chunk 1", "Chunk 2"]
         mock_embeddings.return_value = [[0.1, 0.2], [0.3, 0.4]]
         
         yield {
-            'extract_text_from_file': mock_extract,
+            'iter_text_from_file': mock_extract,
             'chunk_text': mock_chunk,
             'create_embeddings': mock_embeddings
         }
@@ -1,9 +1,11 @@
 import pytest
 from unittest import mock
-from unittest.mock import patch, MagicMock, mock_open, call
+from unittest.mock import patch, MagicMock, mock_open, call, ANY
 import os
 import sys
 import json
+import re
+import threading
 import io
 import random
 from datetime import datetime, timedelta
@@ -32,6 +34,50 @@ with patch.dict(os.environ, {
         sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
         from Google_Drive.drive_watcher import GoogleDriveWatcher, SCOPES
 
+def make_drive_service(tree, page_size=1000, failing=()):
+    """
+    Build a fake Drive service for folder crawls. tree maps folder IDs to their 'files' and 'folders',
+    listings are split into pages of page_size and batch requests are executed in order.
+    """
+    service = MagicMock()
+    service.list_calls = []
+    service.batch_sizes = []
+    
+    def list_files(**kwargs):
+        service.list_calls.append(kwargs)
+        folder_id = re.search(r"'([^']+)' in parents", kwargs['q']).group(1)
+        kind = 'folders' if 'mimeType' in kwargs['q'] else 'files'
+        items = [dict(item, parents=[folder_id]) if kind == 'folders' else item for item in tree.get(folder_id, {}).get(kind, [])]
+        start = int(kwargs.get('pageToken', 0))
+        
+        def execute():
+            if folder_id in failing:
+                raise Exception("HttpError 500")
+            response = {'files': items[start:start + page_size]}
+            if start + page_size < len(items):
+                response['nextPageToken'] = str(start + page_size)
+            return response
+        return MagicMock(execute=execute)
+    
+    def new_batch_http_request(callback):
+        requests = []
+        batch = MagicMock()
+        batch.add.side_effect = lambda request, request_id: requests.append((request_id, request))
+        
+        def execute():
+            service.batch_sizes.append(len(requests))
+            for request_id, request in requests:
+                try:
+                    callback(request_id, request.execute(), None)
+                except Exception as e:
+                    callback(request_id, None, e)
+        batch.execute.side_effect = execute
+        return batch
+    
+    service.files().list.side_effect = list_files
+    service.new_batch_http_request.side_effect = new_batch_http_request
+    return service
+
 class TestGoogleDriveWatcher:
     @pytest.fixture
     def mock_config(self):
@@ -125,10 +171,10 @@ class TestGoogleDriveWatcher:
         captured = capfd.readouterr()
         assert "Invalid last check time format" in captured.out
     
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('json.dump')
-    def test_save_last_check_time(self, mock_json_dump, mock_file_open, watcher):
-        """Test saving last check time to config file"""
+    def test_save_last_check_time(self, watcher):
+        """Test saving last check time to the checkpoint file"""
+        watcher.checkpoints.flush_interval_seconds = 0
+        
         # Set a specific last check time
         test_time = datetime(2023, 5, 15, 10, 30, 0)
         watcher.last_check_time = test_time
@@ -136,17 +182,44 @@ class TestGoogleDriveWatcher:
         # Call the method
         watcher.save_last_check_time()
         
-        # Verify the config was updated and written to file
-        assert watcher.config['last_check_time'] == test_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-        mock_json_dump.assert_called_once()
-        mock_file_open.assert_called_once_with(watcher.config_path, 'w')
+        # Verify the checkpoint was written
+        with open(watcher.checkpoints.path) as f:
+            checkpoint = json.load(f)
+        assert checkpoint['version'] == 1
+        assert checkpoint['sources'][watcher.checkpoint_source]['last_check_time'] == test_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        
+        # config.json is no longer rewritten
+        with open(watcher.config_path) as f:
+            assert json.load(f)['last_check_time'] == '2023-01-01T00:00:00.000Z'
     
-    @patch('builtins.open')
-    @patch('json.dump')
-    def test_save_last_check_time_error(self, mock_json_dump, mock_open, watcher, capfd):
+    def test_save_last_check_time_batched(self, watcher):
+        """Test that checkpoint writes are batched until the flush interval passes or flush is called"""
+        watcher.checkpoints.flush_interval_seconds = 3600
+        watcher.last_check_time = datetime(2023, 5, 15, 10, 30, 0)
+        
+        watcher.save_last_check_time()
+        assert not os.path.exists(watcher.checkpoints.path)
+        
+        watcher.checkpoints.flush()
+        assert os.path.exists(watcher.checkpoints.path)
+    
+    def test_resume_from_checkpoint(self, watcher):
+        """Test that a new watcher resumes from the checkpointed last check time"""
+        test_time = datetime(2023, 5, 15, 10, 30, 0)
+        watcher.last_check_time = test_time
+        watcher.save_last_check_time()
+        watcher.checkpoints.flush()
+        
+        restarted = GoogleDriveWatcher(credentials_path='fake_credentials.json', token_path='fake_token.json', config_path=watcher.config_path)
+        
+        assert restarted.last_check_time == test_time
+    
+    @patch('os.replace')
+    def test_save_last_check_time_error(self, mock_replace, watcher, capfd):
         """Test error handling when saving last check time"""
         # Setup mock to raise an exception
-        mock_open.side_effect = Exception("Write error")
+        mock_replace.side_effect = OSError("Write error")
+        watcher.checkpoints.flush_interval_seconds = 0
         
         # Set a specific last check time
         test_time = datetime(2023, 5, 15, 10, 30, 0)
@@ -157,47 +230,28 @@ class TestGoogleDriveWatcher:
         
         # Check that error was printed
         captured = capfd.readouterr()
-        assert "Error saving last check time" in captured.out
+        assert "Error saving checkpoint" in captured.out
+        assert "Write error" in captured.out
     
     @patch.object(GoogleDriveWatcher, 'authenticate')
     def test_get_folder_contents(self, mock_authenticate, watcher):
         """Test getting folder contents"""
         # Setup mock service
-        mock_service = MagicMock()
+        mock_service = make_drive_service({
+            'test_folder': {
+                'files': [
+                    {'id': 'file1', 'name': 'File 1', 'mimeType': 'text/plain'},
+                    {'id': 'file2', 'name': 'File 2', 'mimeType': 'application/pdf'}
+                ],
+                'folders': [{'id': 'subfolder1'}, {'id': 'subfolder2'}]
+            },
+            'subfolder1': {'files': [{'id': 'file3', 'name': 'File 3', 'mimeType': 'text/csv'}]},
+            'subfolder2': {'files': [{'id': 'file4', 'name': 'File 4', 'mimeType': 'text/plain'}]}
+        })
         watcher.service = mock_service
         
-        # Mock files list response for the folder
-        mock_files_response = {
-            'files': [
-                {'id': 'file1', 'name': 'File 1', 'mimeType': 'text/plain'},
-                {'id': 'file2', 'name': 'File 2', 'mimeType': 'application/pdf'}
-            ]
-        }
-        mock_service.files().list().execute.return_value = mock_files_response
-        
-        # Mock folders list response
-        mock_folders_response = {
-            'files': [
-                {'id': 'subfolder1'},
-                {'id': 'subfolder2'}
-            ]
-        }
-        # First call returns files, second call returns folders
-        mock_service.files().list.side_effect = lambda **kwargs: MagicMock(
-            execute=lambda: mock_files_response if 'mimeType' not in kwargs.get('q', '') 
-                           else mock_folders_response
-        )
-        
-        # Mock recursive calls for subfolders
-        watcher.get_folder_contents = MagicMock()
-        watcher.get_folder_contents.side_effect = [
-            [{'id': 'file3', 'name': 'File 3', 'mimeType': 'text/csv'}],
-            [{'id': 'file4', 'name': 'File 4', 'mimeType': 'text/plain'}]
-        ]
-        
-        # Call the original method
-        original_method = GoogleDriveWatcher.get_folder_contents
-        result = original_method(watcher, 'test_folder', '2023-01-01T00:00:00Z')
+        # Call the method
+        result = watcher.get_folder_contents('test_folder', '2023-01-01T00:00:00Z')
         
         # Verify the result combines files from the folder and subfolders
         assert len(result) == 4
@@ -205,6 +259,71 @@ class TestGoogleDriveWatcher:
         assert {'id': 'file2', 'name': 'File 2', 'mimeType': 'application/pdf'} in result
         assert {'id': 'file3', 'name': 'File 3', 'mimeType': 'text/csv'} in result
         assert {'id': 'file4', 'name': 'File 4', 'mimeType': 'text/plain'} in result
+        
+        # The folder tree is kept to record every folder a file is in
+        assert watcher.folder_parents == {'subfolder1': ['test_folder'], 'subfolder2': ['test_folder']}
+        
+        # Only changed files are listed, with the subfolders listed separately
+        queries = [kwargs['q'] for kwargs in mock_service.list_calls]
+        assert "(modifiedTime > '2023-01-01T00:00:00Z' or createdTime > '2023-01-01T00:00:00Z') and 'test_folder' in parents" in queries
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    def test_get_folder_contents_follows_pages(self, mock_authenticate, watcher):
+        """Test listings beyond the first page aren't lost"""
+        watcher.service = make_drive_service({
+            'test_folder': {
+                'files': [{'id': f'file{i}'} for i in range(5)],
+                'folders': [{'id': 'subfolder1'}, {'id': 'subfolder2'}, {'id': 'subfolder3'}]
+            },
+            'subfolder3': {'files': [{'id': 'file5'}, {'id': 'file6'}]}
+        }, page_size=2)
+        
+        result = watcher.get_folder_contents('test_folder', '2023-01-01T00:00:00Z')
+        
+        assert sorted(file['id'] for file in result) == [f'file{i}' for i in range(7)]
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    def test_get_folder_contents_batches_levels(self, mock_authenticate, watcher):
+        """Test the listings of a whole level of folders go out in batch requests"""
+        watcher.config['list_batch_size'] = 4
+        watcher.service = make_drive_service({
+            'test_folder': {'folders': [{'id': f'sub{i}'} for i in range(5)]},
+            **{f'sub{i}': {'files': [{'id': f'file{i}'}]} for i in range(5)}
+        })
+        
+        result = watcher.get_folder_contents('test_folder', '2023-01-01T00:00:00Z')
+        
+        assert len(result) == 5
+        # Root level: one batch of 2 requests. Second level: 10 requests in batches of 4
+        assert watcher.service.batch_sizes == [2, 4, 4, 2]
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    def test_crawl_folder_max_depth(self, mock_authenticate, watcher):
+        """Test the crawl stops descending at the configured max depth"""
+        watcher.config['max_folder_depth'] = 1
+        watcher.service = make_drive_service({
+            'test_folder': {'files': [{'id': 'file0'}], 'folders': [{'id': 'sub1'}]},
+            'sub1': {'files': [{'id': 'file1'}], 'folders': [{'id': 'sub2'}]},
+            'sub2': {'files': [{'id': 'file2'}]}
+        })
+        
+        files, folder_parents = watcher.crawl_folder('test_folder')
+        
+        assert sorted(file['id'] for file in files) == ['file0', 'file1']
+        assert folder_parents == {'sub1': ['test_folder']}
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    def test_crawl_folder_listing_error(self, mock_authenticate, watcher, capfd):
+        """Test a failed listing is reported without losing the rest of the crawl"""
+        watcher.service = make_drive_service({
+            'test_folder': {'files': [{'id': 'file0'}], 'folders': [{'id': 'sub1'}, {'id': 'broken'}]},
+            'sub1': {'files': [{'id': 'file1'}]}
+        }, failing={'broken'})
+        
+        files, _ = watcher.crawl_folder('test_folder')
+        
+        assert sorted(file['id'] for file in files) == ['file0', 'file1']
+        assert "Error listing folder broken" in capfd.readouterr().out
     
     @patch.object(GoogleDriveWatcher, 'authenticate')
     @patch.object(GoogleDriveWatcher, 'get_folder_contents')
@@ -253,11 +372,26 @@ class TestGoogleDriveWatcher:
         # Instead of checking call count, check that it was called with the right parameters
         watcher.service.files().list.assert_called_with(
             q=mock.ANY,  # We don't need to check the exact query string
-            pageSize=100,
-            fields='nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed)'
+            pageSize=1000,
+            fields='nextPageToken, files(id, name, mimeType, webViewLink, modifiedTime, createdTime, trashed, parents)'
         )
         mock_save.assert_called_once()
     
+    def test_list_files_follows_pages(self, watcher):
+        """Test listing all of Drive reads every page"""
+        watcher.service = MagicMock()
+        pages = {
+            None: {'files': [{'id': 'file1'}], 'nextPageToken': 'page2'},
+            'page2': {'files': [{'id': 'file2'}]}
+        }
+        watcher.service.files().list.side_effect = lambda **kwargs: MagicMock(
+            execute=lambda: pages[kwargs.get('pageToken')]
+        )
+        
+        result = watcher.list_files("modifiedTime > '2023-01-01T00:00:00Z'")
+        
+        assert result == [{'id': 'file1'}, {'id': 'file2'}]
+    
     def test_download_file_regular(self):
         """Test downloading a regular file"""
         # Create a watcher instance with a mocked download_file method
@@ -340,8 +474,117 @@ class TestGoogleDriveWatcher:
         captured = capfd.readouterr()
         assert "Error downloading file" in captured.out
     
+    def make_downloader(self, chunks, errors=None):
+        """Fake MediaIoBaseDownload writing one chunk per next_chunk call, raising errors[i] before chunk i"""
+        errors = dict(errors or {})
+        
+        def downloader_class(buffer, request, chunksize):
+            downloader = MagicMock()
+            progress = {'chunk': 0}
+            
+            def next_chunk():
+                index = progress['chunk']
+                if index in errors:
+                    raise errors.pop(index)
+                buffer.write(chunks[index])
+                progress['chunk'] += 1
+                return MagicMock(), progress['chunk'] == len(chunks)
+            downloader.next_chunk.side_effect = next_chunk
+            return downloader
+        return downloader_class
+    
+    @patch('time.sleep')
+    def test_download_file_to_buffer_resumes_after_transient_error(self, mock_sleep, watcher):
+        """Test a dropped connection is retried from the chunk that failed"""
+        watcher.service = MagicMock()
+        downloader_class = self.make_downloader([b'part1-', b'part2-', b'part3'], {1: ConnectionResetError("reset")})
+        
+        with patch('Google_Drive.drive_watcher.MediaIoBaseDownload', side_effect=downloader_class):
+            buffer = watcher.download_file_to_buffer('file1', 'application/pdf')
+        
+        assert buffer.read() == b'part1-part2-part3'
+        mock_sleep.assert_called_once()
+        assert watcher.api_calls['files.download'] == 3
+    
+    @patch('time.sleep')
+    def test_download_file_non_transient_error(self, mock_sleep, watcher, capfd):
+        """Test errors that won't go away on a retry fail the download right away"""
+        watcher.service = MagicMock()
+        downloader_class = self.make_downloader([b'part1'], {0: ValueError("bad request")})
+        
+        with patch('Google_Drive.drive_watcher.MediaIoBaseDownload', side_effect=downloader_class):
+            assert watcher.download_file('file1', 'application/pdf') is None
+        
+        mock_sleep.assert_not_called()
+        assert "Error downloading file file1: bad request" in capfd.readouterr().out
+    
+    def test_download_file_spools_large_files_to_disk(self, watcher):
+        """Test large downloads roll over from memory to a temporary file"""
+        watcher.service = MagicMock()
+        watcher.config['download_spool_max_bytes'] = 8
+        downloader_class = self.make_downloader([b'0123456789', b'abcdef'])
+        
+        with patch('Google_Drive.drive_watcher.MediaIoBaseDownload', side_effect=downloader_class):
+            buffer = watcher.download_file_to_buffer('file1', 'application/pdf')
+        
+        assert buffer._rolled
+        assert buffer.read() == b'0123456789abcdef'
+        buffer.close()
+        
+        with patch('Google_Drive.drive_watcher.MediaIoBaseDownload', side_effect=downloader_class):
+            assert watcher.download_file('file1', 'application/pdf') == b'0123456789abcdef'
+    
+    @patch('Google_Drive.drive_watcher.build')
+    def test_get_service_per_thread(self, mock_build, watcher):
+        """Test download workers get their own Drive service"""
+        watcher.service = MagicMock()
+        watcher.credentials = MagicMock()
+        mock_build.side_effect = lambda *args, **kwargs: MagicMock()
+        services = []
+        
+        def worker():
+            services.append(watcher.get_service())
+            services.append(watcher.get_service())
+        
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert watcher.get_service() is watcher.service
+        assert services[0] is services[1] and services[2] is services[3]
+        assert services[0] is not services[2]
+        assert mock_build.call_count == 2
+    
+    @patch.object(GoogleDriveWatcher, 'process_file')
+    @patch('Google_Drive.drive_watcher.run_ingestion_pipeline')
+    def test_process_files_uses_pipeline(self, mock_pipeline, mock_process_file, watcher):
+        """Test supported files are downloaded and ingested through the pipeline"""
+        files = [
+            {'id': 'file1', 'name': 'a.txt', 'mimeType': 'text/plain', 'modifiedTime': 't1'},
+            {'id': 'file2', 'name': 'b.pdf', 'mimeType': 'application/pdf', 'modifiedTime': 't2'},
+            {'id': 'file3', 'name': 'c.txt', 'mimeType': 'text/plain', 'modifiedTime': 't3', 'trashed': True},
+            {'id': 'file4', 'name': 'd.zip', 'mimeType': 'application/zip', 'modifiedTime': 't4'}
+        ]
+        mock_pipeline.return_value = {'file1': True, 'file2': True}
+        
+        with patch.object(GoogleDriveWatcher, 'download_file', return_value=b'content') as mock_download:
+            watcher.process_files(files)
+            
+            # Downloads happen in the pipeline's read stage
+            pipeline_files, read_file, config, folder_parents = mock_pipeline.call_args.args
+            assert folder_parents is watcher.folder_parents
+            assert [file['id'] for file in pipeline_files] == ['file1', 'file2']
+            assert read_file(files[1]) == b'content'
+            mock_download.assert_called_once_with('file2', 'application/pdf')
+        
+        # Trashed and unsupported files are handled without downloading
+        assert [c.args[0]['id'] for c in mock_process_file.call_args_list] == ['file3', 'file4']
+        assert watcher.known_files == {'file1': 't1', 'file2': 't2', 'file4': 't4'}
+    
     @patch.object(GoogleDriveWatcher, 'download_file')
-    @patch('Google_Drive.drive_watcher.extract_text_from_file')
+    @patch('Google_Drive.drive_watcher.iter_text_from_file')
     @patch('Google_Drive.drive_watcher.process_file_for_rag')
     def test_process_file_success(self, mock_process_rag, mock_extract_text, mock_download, watcher):
         """Test successfully processing a file"""
@@ -354,7 +597,7 @@ class TestGoogleDriveWatcher:
             'modifiedTime': '2023-01-01T00:00:00Z'
         }
         mock_download.return_value = b'file content'
-        mock_extract_text.return_value = 'extracted text'
+        mock_extract_text.return_value = iter(['extracted ', 'text'])
         
         # Call the method
         watcher.process_file(file_data)
@@ -363,13 +606,37 @@ class TestGoogleDriveWatcher:
         mock_download.assert_called_once_with('file1', 'text/plain')
         mock_extract_text.assert_called_once_with(b'file content', 'text/plain', 'test.txt', watcher.config)
         mock_process_rag.assert_called_once_with(
-            b'file content', 'extracted text', 'file1', 'https://example.com/file1', 
-            'test.txt', 'text/plain', watcher.config
+            b'file content', ANY, 'file1', 'https://example.com/file1', 
+            'test.txt', 'text/plain', watcher.config, {'modified_time': '2023-01-01T00:00:00Z'}
         )
+        # The extracted segments are streamed into processing instead of being joined first
+        assert list(mock_process_rag.call_args.args[1]) == ['extracted ', 'text']
         
         # Verify known files was updated
         assert watcher.known_files['file1'] == '2023-01-01T00:00:00Z'
     
+    @patch.object(GoogleDriveWatcher, 'download_file')
+    @patch('Google_Drive.drive_watcher.iter_text_from_file')
+    @patch('Google_Drive.drive_watcher.process_file_for_rag')
+    def test_listed_file_gets_folder_metadata(self, mock_process_rag, mock_extract_text, mock_download, watcher):
+        """Test that files found by listing carry their parent folders into the chunk metadata"""
+        watcher.service = MagicMock()
+        watcher.folder_parents = {'folder1': ['root']}
+        listed = {
+            'id': 'file1', 'name': 'test.txt', 'mimeType': 'text/plain', 'webViewLink': 'https://example.com/file1',
+            'modifiedTime': '2023-01-01T00:00:00Z', 'parents': ['folder1']
+        }
+        watcher.service.files().list.return_value.execute.return_value = {'files': [listed]}
+        mock_download.return_value = b'file content'
+        mock_extract_text.return_value = iter(['extracted ', 'text'])
+        
+        files = watcher.list_files()
+        watcher.process_file(files[0])
+        
+        assert 'parents' in watcher.service.files().list.call_args.kwargs['fields']
+        assert mock_process_rag.call_args.args[-1] == {'folder': 'folder1', 'folders': ['folder1', 'root'],
+                                                       'modified_time': '2023-01-01T00:00:00Z'}
+    
     @patch('Google_Drive.drive_watcher.delete_document_by_file_id')
     def test_process_file_trashed(self, mock_delete, watcher, capfd):
         """Test processing a file that has been trashed"""
@@ -428,7 +695,7 @@ class TestGoogleDriveWatcher:
         assert "Failed to download file" in captured.out
     
     @patch.object(GoogleDriveWatcher, 'download_file')
-    @patch('Google_Drive.drive_watcher.extract_text_from_file')
+    @patch('Google_Drive.drive_watcher.iter_text_from_file')
     def test_process_file_no_text_extracted(self, mock_extract_text, mock_download, watcher, capfd):
         """Test processing a file when no text can be extracted"""
         # Setup
@@ -438,7 +705,7 @@ class TestGoogleDriveWatcher:
             'mimeType': 'text/plain'
         }
         mock_download.return_value = b'file content'
-        mock_extract_text.return_value = ''  # No text extracted
+        mock_extract_text.return_value = iter(['', ''])  # No text extracted
         
         # Call the method
         watcher.process_file(file_data)
@@ -451,7 +718,7 @@ class TestGoogleDriveWatcher:
     def test_check_for_deleted_files(self, mock_authenticate, watcher):
         """Test checking for deleted files"""
         # Setup
-        watcher.service = MagicMock()
+        watcher.service = make_drive_service({})
         watcher.known_files = {
             'file1': '2023-01-01T00:00:00Z',  # Not trashed
             'file2': '2023-01-01T00:00:00Z',  # Trashed
@@ -461,14 +728,16 @@ class TestGoogleDriveWatcher:
         
         # Mock get file responses
         def mock_get_file(fileId, fields):
-            if fileId == 'file1':
-                return MagicMock(execute=lambda: {'trashed': False, 'name': 'File 1'})
-            elif fileId == 'file2':
-                return MagicMock(execute=lambda: {'trashed': True, 'name': 'File 2'})
-            elif fileId == 'file3':
-                raise Exception("File not found: 404")
-            else:
-                raise Exception("Other error")
+            def execute():
+                if fileId == 'file1':
+                    return {'trashed': False, 'name': 'File 1'}
+                elif fileId == 'file2':
+                    return {'trashed': True, 'name': 'File 2'}
+                elif fileId == 'file3':
+                    raise Exception("File not found: 404")
+                else:
+                    raise Exception("Other error")
+            return MagicMock(execute=execute)
         
         watcher.service.files().get = mock_get_file
         
@@ -480,4 +749,196 @@ class TestGoogleDriveWatcher:
         assert 'file3' in result  # Not found (404)
         assert 'file1' not in result  # Not trashed
         assert 'file4' not in result  # Other error
-        
\ No newline at end of file
+        
+        # The lookups went out in a single batch request
+        assert watcher.service.batch_sizes == [4]
+        assert watcher.api_calls == {'files.get': 4, 'batch': 1}
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    def test_check_for_deleted_files_in_batches(self, mock_authenticate, watcher):
+        """Test lookups of many known files are split into batches of list_batch_size"""
+        watcher.config['list_batch_size'] = 100
+        watcher.service = make_drive_service({})
+        watcher.service.files().get = lambda fileId, fields: MagicMock(execute=lambda: {'trashed': False})
+        watcher.known_files = {f'file{i}': 't' for i in range(250)}
+        
+        assert watcher.check_for_deleted_files() == []
+        assert watcher.service.batch_sizes == [100, 100, 50]
+    
+    @patch('time.monotonic')
+    def test_deletion_check_cadence(self, mock_monotonic, watcher):
+        """Test deletion checks only run every deletion_check_interval_seconds"""
+        watcher.config['deletion_check_interval_seconds'] = 300
+        
+        mock_monotonic.return_value = 1000
+        assert watcher.is_deletion_check_due()
+        mock_monotonic.return_value = 1200
+        assert not watcher.is_deletion_check_due()
+        mock_monotonic.return_value = 1300
+        assert watcher.is_deletion_check_due()
+    
+    def test_report_api_calls(self, watcher, capfd):
+        """Test the API call report covers one cycle"""
+        watcher.count_api_call('files.list', 3)
+        watcher.count_api_call('files.get', 100)
+        watcher.count_api_call('batch')
+        
+        api_calls = watcher.report_api_calls()
+        
+        assert api_calls == {'files.list': 3, 'files.get': 100, 'batch': 1}
+        assert "Drive API calls this cycle: 103 (files.get: 100, files.list: 3) in 1 batch requests" in capfd.readouterr().out
+        assert watcher.api_calls == {}
+            
+    def test_is_in_watched_folder(self, watcher):
+        """Test folder ancestry is resolved through the local parent map"""
+        watcher.folder_id = 'root_folder'
+        watcher.folder_parents = {'sub1': ['root_folder'], 'sub2': ['sub1'], 'loop': ['loop']}
+        
+        assert watcher.is_in_watched_folder(['root_folder'])
+        assert watcher.is_in_watched_folder(['sub2'])
+        assert watcher.is_in_watched_folder(['elsewhere', 'sub1'])
+        assert not watcher.is_in_watched_folder(['elsewhere'])
+        assert not watcher.is_in_watched_folder(['loop'])
+        assert not watcher.is_in_watched_folder([])
+        
+        # Everything is in scope when watching all of Drive
+        watcher.folder_id = None
+        assert watcher.is_in_watched_folder(['elsewhere'])
+    
+    def test_get_folder_tree(self, watcher):
+        """Test the folder tree crawl only lists folders"""
+        watcher.service = make_drive_service({
+            'root_folder': {'files': [{'id': 'file1'}], 'folders': [{'id': 'sub1'}, {'id': 'sub2'}]},
+            'sub1': {'folders': [{'id': 'sub3'}]}
+        }, page_size=1)
+        
+        tree = watcher.get_folder_tree('root_folder')
+        
+        assert tree == {'sub1': ['root_folder'], 'sub2': ['root_folder'], 'sub3': ['sub1']}
+        assert all('mimeType' in kwargs['q'] for kwargs in watcher.service.list_calls)
+    
+    @patch.object(GoogleDriveWatcher, 'get_folder_tree')
+    def test_start_change_feed(self, mock_get_folder_tree, watcher):
+        """Test the changes feed starts from the current page token and builds the folder map once"""
+        watcher.service = MagicMock()
+        watcher.service.changes().getStartPageToken().execute.return_value = {'startPageToken': '100'}
+        mock_get_folder_tree.return_value = {'sub1': ['test_folder_id']}
+        
+        watcher.start_change_feed()
+        
+        assert watcher.checkpoints.get(watcher.checkpoint_source, 'page_token') == '100'
+        assert watcher.folder_parents == {'sub1': ['test_folder_id']}
+        
+        # The page token and folder map are persisted, so a restart doesn't need to crawl again
+        with open(watcher.checkpoints.path) as f:
+            checkpoint = json.load(f)
+        assert checkpoint['sources'][watcher.checkpoint_source]['folder_parents'] == {'sub1': ['test_folder_id']}
+        
+        restarted = GoogleDriveWatcher(credentials_path='fake_credentials.json', token_path='fake_token.json', config_path=watcher.config_path)
+        restarted.service = MagicMock()
+        restarted.start_change_feed()
+        mock_get_folder_tree.assert_called_once()
+        restarted.service.changes().getStartPageToken.assert_not_called()
+        assert restarted.folder_parents == {'sub1': ['test_folder_id']}
+    
+    @patch.object(GoogleDriveWatcher, 'get_folder_contents')
+    @patch.object(GoogleDriveWatcher, 'get_folder_tree')
+    def test_get_changes_from_feed(self, mock_get_folder_tree, mock_get_folder_contents, watcher):
+        """Test only in-scope deltas are returned and removals are collected"""
+        watcher.config['change_mode'] = 'changes'
+        watcher.service = MagicMock()
+        watcher.folder_parents = {'sub1': ['test_folder_id']}
+        watcher.known_files = {'deleted': 't', 'moved_out': 't', 'in_folder': 't'}
+        watcher.checkpoints.set(watcher.checkpoint_source, 'page_token', '100')
+        
+        pages = {
+            '100': {
+                'changes': [
+                    {'fileId': 'in_folder', 'file': {'id': 'in_folder', 'name': 'a.txt', 'mimeType': 'text/plain', 'parents': ['test_folder_id']}},
+                    {'fileId': 'in_new_folder', 'file': {'id': 'in_new_folder', 'name': 'b.txt', 'mimeType': 'text/plain', 'parents': ['new_folder']}},
+                    {'fileId': 'deleted', 'removed': True},
+                ],
+                'nextPageToken': '101'
+            },
+            '101': {
+                'changes': [
+                    {'fileId': 'in_subfolder', 'file': {'id': 'in_subfolder', 'name': 'c.txt', 'mimeType': 'text/plain', 'parents': ['sub1']}},
+                    {'fileId': 'outside', 'file': {'id': 'outside', 'name': 'd.txt', 'mimeType': 'text/plain', 'parents': ['other']}},
+                    {'fileId': 'moved_out', 'file': {'id': 'moved_out', 'name': 'e.txt', 'mimeType': 'text/plain', 'parents': ['other']}},
+                    {'fileId': 'new_folder', 'file': {'id': 'new_folder', 'name': 'New', 'mimeType': 'application/vnd.google-apps.folder', 'parents': ['sub1']}},
+                ],
+                'newStartPageToken': '102'
+            }
+        }
+        watcher.service.changes().list.side_effect = lambda **kwargs: MagicMock(execute=lambda: pages[kwargs['pageToken']])
+        mock_get_folder_tree.return_value = {'nested': ['new_folder']}
+        mock_get_folder_contents.return_value = [{'id': 'existing_in_new_folder', 'name': 'f.txt', 'mimeType': 'text/plain'}]
+        
+        result = watcher.get_changes()
+        
+        assert sorted(file['id'] for file in result) == ['existing_in_new_folder', 'in_folder', 'in_new_folder', 'in_subfolder']
+        assert sorted(watcher.removed_file_ids) == ['deleted', 'moved_out']
+        assert watcher.folder_parents == {'sub1': ['test_folder_id'], 'new_folder': ['sub1'], 'nested': ['new_folder']}
+        mock_get_folder_tree.assert_called_once_with('new_folder')
+        assert watcher.checkpoints.get(watcher.checkpoint_source, 'page_token') == '102'
+        
+        # The files().list queries of the query mode aren't used
+        watcher.service.files().list.assert_not_called()
+    
+    @pytest.mark.parametrize("moved_folder", [
+        {'id': 'projects', 'name': 'Projects', 'mimeType': 'application/vnd.google-apps.folder', 'parents': ['other']},
+        {'id': 'projects', 'name': 'Projects', 'mimeType': 'application/vnd.google-apps.folder', 'parents': ['test_folder_id'], 'trashed': True}
+    ])
+    def test_get_changes_from_feed_folder_leaves_tree(self, moved_folder, watcher):
+        """Test that a folder moved out of (or trashed in) the watched folder takes its subfolders and known files along"""
+        watcher.config['change_mode'] = 'changes'
+        watcher.service = make_drive_service({
+            'projects': {'files': [{'id': 'top_file', 'parents': ['projects']}]},
+            'nested': {'files': [{'id': 'report', 'parents': ['nested']}, {'id': 'unknown', 'parents': ['nested']}]},
+            'deeper': {'files': [{'id': 'deep_file', 'parents': ['deeper']}, {'id': 'shared', 'parents': ['deeper', 'keep']}]}
+        })
+        watcher.folder_parents = {
+            'projects': ['test_folder_id'], 'nested': ['projects'], 'deeper': ['nested'], 'keep': ['test_folder_id']
+        }
+        watcher.known_files = {'top_file': 't', 'report': 't', 'deep_file': 't', 'shared': 't', 'kept': 't'}
+        watcher.checkpoints.set(watcher.checkpoint_source, 'page_token', '100')
+        watcher.service.changes().list.return_value.execute.return_value = {
+            'changes': [{'fileId': 'projects', 'file': moved_folder}],
+            'newStartPageToken': '101'
+        }
+        
+        result = watcher.get_changes()
+        
+        assert result == []
+        # The whole subtree is pruned from the folder map, without crawling it again
+        assert watcher.folder_parents == {'keep': ['test_folder_id']}
+        assert watcher.checkpoints.get(watcher.checkpoint_source, 'folder_parents') == {'keep': ['test_folder_id']}
+        # Known files in the subtree are removed, unless they also have a parent that's still watched
+        assert sorted(watcher.removed_file_ids) == ['deep_file', 'report', 'top_file']
+        assert sorted(re.search(r"'([^']+)'", kwargs['q']).group(1) for kwargs in watcher.service.list_calls) == ['deeper', 'nested', 'projects']
+    
+    @patch.object(GoogleDriveWatcher, 'authenticate')
+    @patch.object(GoogleDriveWatcher, 'start_change_feed')
+    @patch.object(GoogleDriveWatcher, 'get_changes')
+    @patch.object(GoogleDriveWatcher, 'check_for_deleted_files')
+    @patch.object(GoogleDriveWatcher, 'process_file')
+    @patch('Google_Drive.drive_watcher.delete_document_by_file_id')
+    @patch('time.sleep')
+    def test_watch_for_changes_with_change_feed(self, mock_sleep, mock_delete, mock_process, mock_check_deleted,
+                                                mock_get_changes, mock_start_feed, mock_authenticate, watcher):
+        """Test the watcher uses the removals from the changes feed instead of checking every known file"""
+        watcher.config['change_mode'] = 'changes'
+        watcher.initialized = True
+        watcher.known_files = {'file1': 't'}
+        
+        def get_changes():
+            watcher.removed_file_ids = ['file1']
+            return []
+        mock_get_changes.side_effect = get_changes
+        mock_sleep.side_effect = KeyboardInterrupt()
+        
+        watcher.watch_for_changes(interval_seconds=1)
+        
+        mock_check_deleted.assert_not_called()
+        mock_delete.assert_called_once_with('file1')
+        assert watcher.known_files == {}
@@ -8,10 +8,47 @@ import sys
 import os
 import io
 import shutil
+import threading
+
+# watchdog is optional - without it the watcher can only poll
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from common.text_processor import extract_text_from_file, chunk_text, create_embeddings
-from common.db_handler import process_file_for_rag, delete_document_by_file_id
+from common.text_processor import iter_text_from_file, peek_segments, chunk_text, create_embeddings
+from common.db_handler import process_file_for_rag, delete_document_by_file_id, get_file_filter_metadata
+from common.checkpoint_store import CheckpointStore, get_checkpoint_path
+from common.ingestion_pipeline import run_ingestion_pipeline
+from common.file_manifest import FileManifest, hash_file_content
+
+class LocalFileEventHandler:
+    """
+    watchdog event handler that queues created, modified, moved and deleted files on the watcher.
+    """
+    def __init__(self, watcher: 'LocalFileWatcher'):
+        self.watcher = watcher
+    
+    def dispatch(self, event) -> None:
+        """
+        Handle a file system event from the watchdog observer.
+        
+        Args:
+            event: The watchdog FileSystemEvent
+        """
+        if event.event_type not in ('created', 'modified', 'moved', 'deleted', 'closed'):
+            return
+        
+        # Moving or deleting a directory doesn't produce events for the files inside it
+        if event.is_directory:
+            if event.event_type in ('moved', 'deleted'):
+                self.watcher.request_reconciliation()
+            return
+        
+        self.watcher.queue_event(event.src_path)
+        if event.event_type == 'moved':
+            self.watcher.queue_event(event.dest_path)
 
 class LocalFileWatcher:
     def __init__(self, watch_directory: str = None, config_path: str = None):
@@ -43,8 +80,26 @@ class LocalFileWatcher:
         # Create the watch directory if it doesn't exist
         os.makedirs(self.watch_directory, exist_ok=True)
         
-        self.known_files = {}  # Store file paths and their last modified time
-        self.initialized = False  # Flag to track if we've done the initial scan
+        # Mutable state like the last check time lives in a checkpoint file, not in config.json
+        self.checkpoint_source = f"local:{self.watch_directory}"
+        self.checkpoints = CheckpointStore(
+            get_checkpoint_path(self.config, self.config_path),
+            self.config.get('checkpoint_flush_interval_seconds', 30)
+        )
+        self.restore_checkpoint()
+        
+        # Persistent manifest of ingested files (path, modified time, size, inode and content hash)
+        manifest_path = self.config.get('manifest_path') or os.path.join(os.path.dirname(os.path.abspath(self.config_path)), 'file_manifest.sqlite')
+        self.manifest = FileManifest(manifest_path)
+        
+        self.known_files = self.manifest.modified_times()  # Store file paths and their last modified time
+        # With a manifest from a previous run, the first check reconciles against it instead of a blind rescan
+        self.initialized = len(self.known_files) > 0  # Flag to track if we've done the initial scan
+        
+        # Paths with pending file system events (event mode) and when their last event arrived
+        self.pending_events: Dict[str, float] = {}
+        self.pending_lock = threading.Lock()
+        self.reconcile_requested = False
         
         # Initialize mimetypes
         mimetypes.init()
@@ -92,18 +147,31 @@ class LocalFileWatcher:
             self.last_check_time = datetime.strptime('1970-01-01T00:00:00.000Z', '%Y-%m-%dT%H:%M:%S.%fZ')
             print("Using default configuration")
             
+    def restore_checkpoint(self) -> None:
+        """
+        Resume from the last check time in the checkpoint (config.json's last_check_time is only used
+        when there is no checkpoint yet).
+        """
+        last_check_time_str = self.checkpoints.get(self.checkpoint_source, 'last_check_time')
+        if not last_check_time_str:
+            return
+        
+        try:
+            self.last_check_time = datetime.strptime(last_check_time_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+            print(f"Resuming from checkpointed last check time: {self.last_check_time}")
+        except ValueError:
+            print("Invalid last check time format in checkpoint, ignoring it")
+    
     def save_last_check_time(self) -> None:
         """
-        Save the last check time to the config file.
+        Save the last check time to the checkpoint file (written in batches, see CheckpointStore).
         """
         try:
-            # Update the last_check_time in the config
-            self.config['last_check_time'] = self.last_check_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            
-            # Write the updated config back to the file
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
-                
+            self.checkpoints.set(
+                self.checkpoint_source,
+                'last_check_time',
+                self.last_check_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            )
             print(f"Saved last check time: {self.last_check_time}")
         except Exception as e:
             print(f"Error saving last check time: {e}")
@@ -161,6 +229,89 @@ class LocalFileWatcher:
             print(f"Error reading file {file_path}: {e}")
             return None
     
+    def get_file_info(self, file_path: str, file_stat: os.stat_result = None) -> Dict[str, Any]:
+        """
+        Build the file information dictionary for a local file.
+        
+        Args:
+            file_path: Path to the file
+            file_stat: Result of os.stat for the file (looked up if not given)
+            
+        Returns:
+            Dict[str, Any]: File information dictionary in the same shape as Google Drive files
+        """
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+        
+        # Convert to datetime
+        mod_time = datetime.fromtimestamp(file_stat.st_mtime)
+        create_time = datetime.fromtimestamp(file_stat.st_ctime)
+        
+        # Create a file info dictionary similar to Google Drive
+        return {
+            'id': file_path,  # Use file path as ID
+            'name': os.path.basename(file_path),
+            'mimeType': self.get_mime_type(file_path),
+            'webViewLink': f"file://{file_path}",  # Local file URL
+            'modifiedTime': mod_time.isoformat(),
+            'createdTime': create_time.isoformat(),
+            'size': file_stat.st_size,
+            'inode': file_stat.st_ino,
+            'trashed': False
+        }
+    
+    def is_unchanged(self, file_path: str, file_stat: os.stat_result) -> bool:
+        """
+        Check a file against its manifest entry. A file whose modified time changed but whose size
+        and content hash match (e.g. it was only touched) is unchanged and its entry is refreshed.
+        
+        Args:
+            file_path: Path to the file
+            file_stat: Result of os.stat for the file
+            
+        Returns:
+            bool: True if the file matches its manifest entry
+        """
+        entry = self.manifest.get(file_path)
+        if entry is None:
+            return False
+        
+        mod_time = datetime.fromtimestamp(file_stat.st_mtime).isoformat()
+        if entry['modified_time'] == mod_time and entry['size'] == file_stat.st_size and entry['inode'] == file_stat.st_ino:
+            return True
+        
+        # Only hash the file when the size didn't change and there's a hash to compare with
+        if entry['content_hash'] is None or entry['size'] != file_stat.st_size:
+            return False
+        
+        file_content = self.get_file_content(file_path)
+        if file_content is None or hash_file_content(file_content) != entry['content_hash']:
+            return False
+        
+        self.manifest.upsert_many({file_path: dict(entry, modified_time=mod_time, inode=file_stat.st_ino)})
+        self.known_files[file_path] = mod_time
+        return True
+    
+    def record_files(self, files: List[Dict[str, Any]], content_hashes: Dict[str, str] = None) -> None:
+        """
+        Record files as ingested in the known_files dictionary and the manifest.
+        
+        Args:
+            files: File information dictionaries
+            content_hashes: Content hashes of the files by path, where known
+        """
+        content_hashes = content_hashes or {}
+        entries = {}
+        for file in files:
+            self.known_files[file['id']] = file.get('modifiedTime')
+            entries[file['id']] = {
+                'modified_time': file.get('modifiedTime'),
+                'size': file.get('size'),
+                'inode': file.get('inode'),
+                'content_hash': content_hashes.get(file['id'])
+            }
+        self.manifest.upsert_many(entries)
+    
     def get_changes(self) -> List[Dict[str, Any]]:
         """
         Get files that have been created or modified since the last check.
@@ -180,29 +331,18 @@ class LocalFileWatcher:
                 mod_time = datetime.fromtimestamp(file_stat.st_mtime)
                 create_time = datetime.fromtimestamp(file_stat.st_ctime)
                 
+                # Files in the manifest are compared against their entry
+                if file_path in self.manifest:
+                    if not self.is_unchanged(file_path, file_stat):
+                        changed_files.append(self.get_file_info(file_path, file_stat))
+                    continue
+                
                 # Check if the file is new or modified
                 if file_path not in self.known_files or \
                    mod_time > self.last_check_time or \
                    create_time > self.last_check_time:
                     
-                    # Get relative path for display
-                    rel_path = os.path.relpath(file_path, self.watch_directory)
-                    
-                    # Get MIME type
-                    mime_type = self.get_mime_type(file_path)
-                    
-                    # Create a file info dictionary similar to Google Drive
-                    file_info = {
-                        'id': file_path,  # Use file path as ID
-                        'name': file_name,
-                        'mimeType': mime_type,
-                        'webViewLink': f"file://{file_path}",  # Local file URL
-                        'modifiedTime': mod_time.isoformat(),
-                        'createdTime': create_time.isoformat(),
-                        'trashed': False
-                    }
-                    
-                    changed_files.append(file_info)
+                    changed_files.append(self.get_file_info(file_path, file_stat))
         
         # Update the last check time
         self.last_check_time = datetime.now()
@@ -246,6 +386,8 @@ class LocalFileWatcher:
         supported_mime_types = self.config.get('supported_mime_types', [])
         if not any(mime_type.startswith(t) for t in supported_mime_types):
             print(f"Skipping unsupported file type: {mime_type}")
+            # Record the file so it isn't picked up again until it changes
+            self.record_files([file])
             return
         
         # Get the file content
@@ -254,23 +396,222 @@ class LocalFileWatcher:
             print(f"Failed to read file '{file_name}' (Path: {file_path})")
             return
         
-        # Extract text from the file
-        text = extract_text_from_file(file_content, mime_type, file['name'], self.config)
+        content_hashes = {file_path: hash_file_content(file_content)}
+        
+        # Extract text from the file, streaming it (e.g. page by page) into chunking
+        text = peek_segments(iter_text_from_file(file_content, mime_type, file['name'], self.config))
         if not text:
             print(f"No text could be extracted from file '{file_name}' (Path: {file_path})")
+            self.record_files([file], content_hashes)
             return
         
         # Process the file for RAG
-        success = process_file_for_rag(file_content, text, file_path, web_view_link, file_name, mime_type, self.config)
-        
-        # Update the known files dictionary
-        self.known_files[file_path] = file.get('modifiedTime')
+        success = process_file_for_rag(file_content, text, file_path, web_view_link, file_name, mime_type, self.config,
+                                       get_file_filter_metadata(file))
         
         if success:
+            # Update the known files dictionary and the manifest (failed files are retried on the next check)
+            self.record_files([file], content_hashes)
             print(f"Successfully processed file '{file_name}' (Path: {file_path})")
         else:
             print(f"Failed to process file '{file_name}' (Path: {file_path})")
     
+    def process_files(self, files: List[Dict[str, Any]]) -> None:
+        """
+        Process a batch of changed files for the RAG pipeline.
+        
+        Multiple files go through the pipelined ingestion engine so reading, extraction, embedding
+        and database writes overlap across files (tuned with the 'ingestion' config section).
+        
+        Args:
+            files: File information dictionaries
+        """
+        if len(files) <= 1 or not self.config.get('ingestion', {}).get('enabled', True):
+            for file in files:
+                self.process_file(file)
+            return
+        
+        # Skip unsupported file types
+        supported_mime_types = self.config.get('supported_mime_types', [])
+        supported_files = []
+        unsupported_files = []
+        for file in files:
+            if not any(file['mimeType'].startswith(t) for t in supported_mime_types):
+                print(f"Skipping unsupported file type: {file['mimeType']} ({file['name']})")
+                unsupported_files.append(file)
+                continue
+            # Local files are titled without their extension
+            supported_files.append(dict(file, title=os.path.splitext(file['name'])[0]))
+        self.record_files(unsupported_files)
+        
+        # Hash the files as the pipeline reads them for the manifest
+        content_hashes = {}
+        def read_file(file: Dict[str, Any]) -> Optional[bytes]:
+            file_content = self.get_file_content(file['id'])
+            if file_content:
+                content_hashes[file['id']] = hash_file_content(file_content)
+            return file_content
+        
+        results = run_ingestion_pipeline(supported_files, read_file, self.config)
+        
+        # Update the known files dictionary and the manifest (files that couldn't be read or failed are retried)
+        self.record_files([file for file in supported_files if file['id'] in content_hashes and results.get(file['id'])],
+                          content_hashes)
+        
+        print(f"Processed {sum(results.values())} of {len(supported_files)} files successfully.")
+    
+    def initial_scan(self) -> None:
+        """
+        Scan the watched directory once to build the known_files dictionary without processing the files.
+        """
+        if self.initialized:
+            return
+        
+        print("Performing initial scan of files...")
+        # Get all files in the watched directory
+        initial_files = self.get_changes()
+        
+        # Build the known_files dictionary and the manifest without processing the files
+        self.record_files(initial_files)
+        
+        print(f"Found {len(self.known_files)} files in initial scan.")
+        self.initialized = True
+    
+    def delete_files(self, file_ids: List[str]) -> None:
+        """
+        Remove deleted files from the database and the known_files dictionary.
+        
+        Args:
+            file_ids: Deleted file IDs (paths)
+        """
+        print(f"Found {len(file_ids)} deleted files.")
+        for file_id in file_ids:
+            print(f"Processing deleted file: {file_id}")
+            # Delete from database
+            delete_document_by_file_id(file_id)
+            # Remove from known_files
+            self.known_files.pop(file_id, None)
+        self.manifest.remove_many(file_ids)
+    
+    def sync_changes(self) -> None:
+        """
+        Scan the watched directory and process new, modified and deleted files.
+        """
+        # Get changes since the last check
+        changed_files = self.get_changes()
+        
+        # Check for deleted files
+        deleted_file_ids = self.check_for_deleted_files()
+        
+        # Process changed files
+        if changed_files:
+            print(f"Found {len(changed_files)} new or modified files.")
+            self.process_files(changed_files)
+        else:
+            print("No new or modified files found.")
+        
+        # Process deleted files
+        if deleted_file_ids:
+            self.delete_files(deleted_file_ids)
+    
+    def queue_event(self, file_path: str) -> None:
+        """
+        Record a file system event for a path. Bursts of events for the same path are debounced
+        and the file is processed once it has been quiet for the debounce interval.
+        
+        Args:
+            file_path: Path of the created, modified, moved or deleted file
+        """
+        with self.pending_lock:
+            self.pending_events[os.path.abspath(file_path)] = time.monotonic()
+    
+    def request_reconciliation(self) -> None:
+        """
+        Ask the event loop to run a full reconciliation scan as soon as possible.
+        """
+        self.reconcile_requested = True
+    
+    def flush_pending_events(self, debounce_seconds: float = 2.0) -> None:
+        """
+        Process the paths whose last event is older than the debounce interval.
+        
+        Args:
+            debounce_seconds: How long a path must be quiet before it is processed
+        """
+        now = time.monotonic()
+        with self.pending_lock:
+            ready = [path for path, last_event in self.pending_events.items() if now - last_event >= debounce_seconds]
+            for path in ready:
+                del self.pending_events[path]
+        
+        changed_files = []
+        deleted_file_ids = []
+        for path in ready:
+            if os.path.isfile(path):
+                try:
+                    file_stat = os.stat(path)
+                    # Skip events that didn't change the file (e.g. it was only opened)
+                    if not self.is_unchanged(path, file_stat):
+                        changed_files.append(self.get_file_info(path, file_stat=file_stat))
+                except OSError:
+                    # The file disappeared again since the check
+                    continue
+            elif path in self.known_files:
+                deleted_file_ids.append(path)
+        
+        if changed_files:
+            print(f"Found {len(changed_files)} new or modified files.")
+            self.process_files(changed_files)
+        
+        if deleted_file_ids:
+            self.delete_files(deleted_file_ids)
+    
+    def watch_for_events(self, debounce_seconds: float = 2.0, reconcile_interval_seconds: int = 600) -> None:
+        """
+        Watch the local directory for file system events with watchdog and process files as soon as they change.
+        A periodic reconciliation scan catches anything the events missed.
+        
+        Args:
+            debounce_seconds: How long a path must be quiet before it is processed
+            reconcile_interval_seconds: The interval in seconds between reconciliation scans
+        """
+        if Observer is None:
+            print("watchdog is not installed, falling back to polling for changes.")
+            self.watch_for_changes(interval_seconds=reconcile_interval_seconds)
+            return
+        
+        print(f"Starting Local File watcher in {self.watch_directory} in event mode. Reconciling every {reconcile_interval_seconds} seconds...")
+        
+        observer = Observer()
+        try:
+            # Start listening before the initial scan so no changes are missed in between
+            observer.schedule(LocalFileEventHandler(self), self.watch_directory, recursive=True)
+            observer.start()
+            
+            self.initial_scan()
+            next_reconcile = time.monotonic() + reconcile_interval_seconds
+            
+            while True:
+                time.sleep(min(debounce_seconds, 1.0))
+                self.flush_pending_events(debounce_seconds)
+                
+                # Reconciliation scan as a safety net for missed events
+                if self.reconcile_requested or time.monotonic() >= next_reconcile:
+                    print("Running reconciliation scan...")
+                    self.reconcile_requested = False
+                    self.sync_changes()
+                    next_reconcile = time.monotonic() + reconcile_interval_seconds
+        
+        except KeyboardInterrupt:
+            print("Stopping Local File watcher...")
+        except Exception as e:
+            print(f"Error in Local File watcher: {e}")
+        finally:
+            if observer.is_alive():
+                observer.stop()
+                observer.join()
+            self.checkpoints.flush()
+    
     def watch_for_changes(self, interval_seconds: int = 60) -> None:
         """
         Watch for changes in the local directory at regular intervals.
@@ -282,43 +623,10 @@ class LocalFileWatcher:
         
         try:
             # Initial scan to build the known_files dictionary
-            if not self.initialized:
-                print("Performing initial scan of files...")
-                # Get all files in the watched directory
-                initial_files = self.get_changes()
-                
-                # Build the known_files dictionary - only store the modifiedTime
-                for file in initial_files:
-                    # Only store the modifiedTime to avoid processing all files
-                    self.known_files[file['id']] = file.get('modifiedTime')
-                
-                print(f"Found {len(self.known_files)} files in initial scan.")
-                self.initialized = True
+            self.initial_scan()
             
             while True:
-                # Get changes since the last check
-                changed_files = self.get_changes()
-                
-                # Check for deleted files
-                deleted_file_ids = self.check_for_deleted_files()
-                
-                # Process changed files
-                if changed_files:
-                    print(f"Found {len(changed_files)} new or modified files.")
-                    for file in changed_files:
-                        self.process_file(file)
-                else:
-                    print("No new or modified files found.")
-                
-                # Process deleted files
-                if deleted_file_ids:
-                    print(f"Found {len(deleted_file_ids)} deleted files.")
-                    for file_id in deleted_file_ids:
-                        print(f"Processing deleted file: {file_id}")
-                        # Delete from database
-                        delete_document_by_file_id(file_id)
-                        # Remove from known_files
-                        del self.known_files[file_id]
+                self.sync_changes()
                 
                 # Wait for the next check
                 print(f"Waiting {interval_seconds} seconds until next check...")
@@ -328,3 +636,6 @@ class LocalFileWatcher:
             print("Stopping Local File watcher...")
         except Exception as e:
             print(f"Error in Local File watcher: {e}")
+        finally:
+            # Write the latest checkpoint before exiting
+            self.checkpoints.flush()
@@ -20,6 +20,8 @@ def main():
                         help='Directory to watch for files (relative to script location)')
     parser.add_argument('--interval', type=int, default=60,
                         help='Interval in seconds between checks for changes')
+    parser.add_argument('--mode', type=str, choices=['poll', 'events'], default=None,
+                        help='Poll the directory every interval or react to file system events (overrides watch_mode in the config)')
     
     args = parser.parse_args()
     
@@ -31,7 +33,15 @@ def main():
         )
         
         # Watch for changes
-        watcher.watch_for_changes(interval_seconds=args.interval)
+        mode = args.mode or watcher.config.get('watch_mode', 'poll')
+        if mode == 'events':
+            event_mode = watcher.config.get('event_mode', {})
+            watcher.watch_for_events(
+                debounce_seconds=event_mode.get('debounce_seconds', 2.0),
+                reconcile_interval_seconds=event_mode.get('reconcile_interval_seconds', 600)
+            )
+        else:
+            watcher.watch_for_changes(interval_seconds=args.interval)
     
     except KeyboardInterrupt:
         print("Local Files RAG Pipeline stopped by user.")
@@ -31,7 +31,8 @@ with patch.dict(os.environ, {
         
         # Add the parent directory to sys.path to import the modules
         sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-        from Local_Files.file_watcher import LocalFileWatcher
+        from Local_Files.file_watcher import LocalFileWatcher, LocalFileEventHandler
+        from common.file_manifest import hash_file_content
 
 class TestLocalFileWatcher:
     @pytest.fixture
@@ -132,10 +133,10 @@ class TestLocalFileWatcher:
         captured = capfd.readouterr()
         assert "Invalid last check time format" in captured.out
     
-    @patch('builtins.open', new_callable=mock_open)
-    @patch('json.dump')
-    def test_save_last_check_time(self, mock_json_dump, mock_file_open, watcher):
-        """Test saving last check time to config file"""
+    def test_save_last_check_time(self, watcher):
+        """Test saving last check time to the checkpoint file"""
+        watcher.checkpoints.flush_interval_seconds = 0
+        
         # Set a specific last check time
         test_time = datetime(2023, 5, 15, 10, 30, 0)
         watcher.last_check_time = test_time
@@ -143,17 +144,44 @@ class TestLocalFileWatcher:
         # Call the method
         watcher.save_last_check_time()
         
-        # Verify the config was updated and written to file
-        assert watcher.config['last_check_time'] == test_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-        mock_json_dump.assert_called_once()
-        mock_file_open.assert_called_once_with(watcher.config_path, 'w')
+        # Verify the checkpoint was written
+        with open(watcher.checkpoints.path) as f:
+            checkpoint = json.load(f)
+        assert checkpoint['version'] == 1
+        assert checkpoint['sources'][watcher.checkpoint_source]['last_check_time'] == test_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        
+        # config.json is no longer rewritten
+        with open(watcher.config_path) as f:
+            assert json.load(f)['last_check_time'] == '2023-01-01T00:00:00.000Z'
+    
+    def test_save_last_check_time_batched(self, watcher):
+        """Test that checkpoint writes are batched until the flush interval passes or flush is called"""
+        watcher.checkpoints.flush_interval_seconds = 3600
+        watcher.last_check_time = datetime(2023, 5, 15, 10, 30, 0)
+        
+        watcher.save_last_check_time()
+        assert not os.path.exists(watcher.checkpoints.path)
+        
+        watcher.checkpoints.flush()
+        assert os.path.exists(watcher.checkpoints.path)
     
-    @patch('builtins.open')
-    @patch('json.dump')
-    def test_save_last_check_time_error(self, mock_json_dump, mock_open, watcher, capfd):
+    def test_resume_from_checkpoint(self, watcher):
+        """Test that a new watcher resumes from the checkpointed last check time"""
+        test_time = datetime(2023, 5, 15, 10, 30, 0)
+        watcher.last_check_time = test_time
+        watcher.save_last_check_time()
+        watcher.checkpoints.flush()
+        
+        restarted = LocalFileWatcher(watch_directory=watcher.watch_directory, config_path=watcher.config_path)
+        
+        assert restarted.last_check_time == test_time
+    
+    @patch('os.replace')
+    def test_save_last_check_time_error(self, mock_replace, watcher, capfd):
         """Test error handling when saving last check time"""
         # Setup mock to raise an exception
-        mock_open.side_effect = Exception("Write error")
+        mock_replace.side_effect = OSError("Write error")
+        watcher.checkpoints.flush_interval_seconds = 0
         
         # Set a specific last check time
         test_time = datetime(2023, 5, 15, 10, 30, 0)
@@ -164,7 +192,8 @@ class TestLocalFileWatcher:
         
         # Check that error was printed
         captured = capfd.readouterr()
-        assert "Error saving last check time" in captured.out
+        assert "Error saving checkpoint" in captured.out
+        assert "Write error" in captured.out
     
     def test_get_mime_type(self, watcher):
         """Test getting MIME type for different file extensions"""
@@ -219,6 +248,8 @@ class TestLocalFileWatcher:
             def __init__(self, mtime, ctime):
                 self.st_mtime = mtime
                 self.st_ctime = ctime
+                self.st_size = 100
+                self.st_ino = 1
         
         # Set file modification and creation times
         now_timestamp = datetime.now().timestamp()
@@ -276,7 +307,7 @@ class TestLocalFileWatcher:
         # Mock the methods that process_file calls
         watcher.get_file_content = MagicMock(return_value=b'test content')
         
-        with patch('Local_Files.file_watcher.extract_text_from_file', return_value='test content'), \
+        with patch('Local_Files.file_watcher.iter_text_from_file', return_value=iter(['test content'])), \
              patch('Local_Files.file_watcher.chunk_text', return_value=['chunk1', 'chunk2']), \
              patch('Local_Files.file_watcher.create_embeddings', return_value=[[0.1, 0.2], [0.3, 0.4]]), \
              patch('Local_Files.file_watcher.process_file_for_rag'):
@@ -286,6 +317,25 @@ class TestLocalFileWatcher:
             # Verify the known_files was updated
             assert watcher.known_files['/test_dir/test.txt'] == '2023-01-01T00:00:00Z'
     
+    def test_process_file_failure_is_retried(self, watcher, capfd):
+        """Test that a file that fails to process isn't recorded, so it's picked up again"""
+        file_data = {
+            'id': '/test_dir/test.txt',
+            'name': 'test.txt',
+            'mimeType': 'text/plain',
+            'webViewLink': 'file:///test_dir/test.txt',
+            'modifiedTime': '2023-01-01T00:00:00Z'
+        }
+        watcher.get_file_content = MagicMock(return_value=b'test content')
+        
+        with patch('Local_Files.file_watcher.iter_text_from_file', return_value=iter(['test content'])), \
+             patch('Local_Files.file_watcher.process_file_for_rag', return_value=False):
+            watcher.process_file(file_data)
+        
+        assert '/test_dir/test.txt' not in watcher.known_files
+        assert watcher.manifest.get('/test_dir/test.txt') is None
+        assert "Failed to process file" in capfd.readouterr().out
+    
     def test_process_file_unsupported_type(self, watcher, capfd):
         """Test processing a file with unsupported MIME type"""
         # Create a mock file with unsupported MIME type
@@ -336,8 +386,8 @@ class TestLocalFileWatcher:
         # Mock get_file_content to return some content
         watcher.get_file_content = MagicMock(return_value=b'test content')
         
-        # Mock extract_text_from_file to return None (simulating extraction failure)
-        with patch('Local_Files.file_watcher.extract_text_from_file', return_value=None):
+        # Mock iter_text_from_file to yield no text (simulating extraction failure)
+        with patch('Local_Files.file_watcher.iter_text_from_file', return_value=iter([])):
             # Call the method
             watcher.process_file(file_data)
         
@@ -395,3 +445,225 @@ class TestLocalFileWatcher:
         
         # Verify the deleted file was removed from known_files
         assert '/test_dir/file1.txt' not in watcher.known_files
+    
+    def test_process_files_uses_pipeline(self, watcher):
+        """Test that a batch of changed files goes through the ingestion pipeline"""
+        files = [
+            {'id': '/test_dir/file1.txt', 'name': 'file1.txt', 'mimeType': 'text/plain', 'webViewLink': 'file:///test_dir/file1.txt', 'modifiedTime': '2023-01-02T00:00:00Z'},
+            {'id': '/test_dir/file2.pdf', 'name': 'file2.pdf', 'mimeType': 'application/pdf', 'webViewLink': 'file:///test_dir/file2.pdf', 'modifiedTime': '2023-01-02T00:00:00Z'},
+            {'id': '/test_dir/file3.exe', 'name': 'file3.exe', 'mimeType': 'application/octet-stream', 'webViewLink': 'file:///test_dir/file3.exe', 'modifiedTime': '2023-01-02T00:00:00Z'}
+        ]
+        
+        def run_pipeline(pipeline_files, read_file, config):
+            for file in pipeline_files:
+                read_file(file)
+            return {'/test_dir/file1.txt': True, '/test_dir/file2.pdf': False}
+        
+        with patch('Local_Files.file_watcher.run_ingestion_pipeline') as mock_pipeline, \
+             patch.object(LocalFileWatcher, 'get_file_content', return_value=b'content'), \
+             patch.object(LocalFileWatcher, 'process_file') as mock_process:
+            mock_pipeline.side_effect = run_pipeline
+            watcher.process_files(files)
+        
+        mock_process.assert_not_called()
+        pipeline_files = mock_pipeline.call_args.args[0]
+        # Unsupported files are skipped and local files are titled without their extension
+        assert [f['id'] for f in pipeline_files] == ['/test_dir/file1.txt', '/test_dir/file2.pdf']
+        assert [f['title'] for f in pipeline_files] == ['file1', 'file2']
+        assert mock_pipeline.call_args.args[2] is watcher.config
+        # Unsupported files are recorded too so they aren't picked up again until they change,
+        # while the file that failed isn't recorded so it's retried on the next check
+        assert watcher.known_files == {
+            '/test_dir/file1.txt': '2023-01-02T00:00:00Z',
+            '/test_dir/file3.exe': '2023-01-02T00:00:00Z'
+        }
+        assert watcher.manifest.get('/test_dir/file1.txt')['content_hash'] is not None
+        assert watcher.manifest.get('/test_dir/file2.pdf') is None
+        assert watcher.manifest.get('/test_dir/file3.exe')['content_hash'] is None
+    
+    def test_process_files_sequential_when_disabled(self, watcher):
+        """Test that the pipeline can be turned off in the config"""
+        watcher.config['ingestion'] = {'enabled': False}
+        files = [{'id': '/test_dir/file1.txt'}, {'id': '/test_dir/file2.txt'}]
+        
+        with patch('Local_Files.file_watcher.run_ingestion_pipeline') as mock_pipeline, \
+             patch.object(LocalFileWatcher, 'process_file') as mock_process:
+            watcher.process_files(files)
+        
+        mock_pipeline.assert_not_called()
+        assert mock_process.call_count == 2
+    
+    def test_event_handler_queues_paths(self, watcher):
+        """Test that file system events are queued on the watcher"""
+        handler = LocalFileEventHandler(watcher)
+        
+        handler.dispatch(MagicMock(event_type='created', is_directory=False, src_path='/test_dir/new.txt'))
+        handler.dispatch(MagicMock(event_type='moved', is_directory=False, src_path='/test_dir/old.txt', dest_path='/test_dir/renamed.txt'))
+        handler.dispatch(MagicMock(event_type='opened', is_directory=False, src_path='/test_dir/opened.txt'))
+        
+        assert set(watcher.pending_events) == {'/test_dir/new.txt', '/test_dir/old.txt', '/test_dir/renamed.txt'}
+        assert not watcher.reconcile_requested
+        
+        # Directory moves need a full scan since the files inside them don't get events
+        handler.dispatch(MagicMock(event_type='moved', is_directory=True, src_path='/test_dir/sub', dest_path='/test_dir/sub2'))
+        assert watcher.reconcile_requested
+    
+    @patch('Local_Files.file_watcher.delete_document_by_file_id')
+    def test_flush_pending_events(self, mock_delete, watcher):
+        """Test that debounced events are processed as changed or deleted files"""
+        new_file = os.path.join(watcher.watch_directory, 'new.txt')
+        with open(new_file, 'w') as f:
+            f.write('content')
+        deleted_file = os.path.join(watcher.watch_directory, 'deleted.txt')
+        watcher.known_files[deleted_file] = '2023-01-01T00:00:00'
+        
+        watcher.queue_event(new_file)
+        watcher.queue_event(deleted_file)
+        
+        with patch.object(LocalFileWatcher, 'process_files') as mock_process:
+            # Events newer than the debounce interval wait for the burst to settle
+            watcher.flush_pending_events(debounce_seconds=60)
+            mock_process.assert_not_called()
+            mock_delete.assert_not_called()
+            
+            watcher.flush_pending_events(debounce_seconds=0)
+        
+        files = mock_process.call_args.args[0]
+        assert len(files) == 1
+        assert files[0]['id'] == new_file
+        assert files[0]['name'] == 'new.txt'
+        assert files[0]['mimeType'] == 'text/plain'
+        mock_delete.assert_called_once_with(deleted_file)
+        assert deleted_file not in watcher.known_files
+        assert watcher.pending_events == {}
+    
+    def test_flush_pending_events_skips_unchanged(self, watcher):
+        """Test that events for files already processed at their current modified time are ignored"""
+        file_path = os.path.join(watcher.watch_directory, 'file.txt')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        watcher.record_files([watcher.get_file_info(file_path)])
+        watcher.queue_event(file_path)
+        
+        with patch.object(LocalFileWatcher, 'process_files') as mock_process:
+            watcher.flush_pending_events(debounce_seconds=0)
+        
+        mock_process.assert_not_called()
+    
+    def test_flush_pending_events_file_vanishes(self, watcher):
+        """Test that a file deleted right after it was stat'ed doesn't stop the event loop"""
+        file_path = os.path.join(watcher.watch_directory, 'file.txt')
+        with open(file_path, 'w') as f:
+            f.write('content')
+        vanished = os.path.join(watcher.watch_directory, 'vanished.txt')
+        watcher.queue_event(vanished)
+        watcher.queue_event(file_path)
+        
+        real_stat = os.stat
+        vanished_stats = []
+        def stat(path, *args, **kwargs):
+            # The vanished file exists for its first stat only
+            if path == vanished:
+                vanished_stats.append(path)
+                if len(vanished_stats) > 1:
+                    raise FileNotFoundError(path)
+                return real_stat(file_path)
+            return real_stat(path, *args, **kwargs)
+        
+        with patch.object(LocalFileWatcher, 'process_files') as mock_process, \
+             patch('Local_Files.file_watcher.os.path.isfile', return_value=True), \
+             patch('Local_Files.file_watcher.os.stat', side_effect=stat):
+            watcher.flush_pending_events(debounce_seconds=0)
+        
+        assert [file['id'] for file in mock_process.call_args.args[0]] == [vanished, file_path]
+    
+    @patch('Local_Files.file_watcher.Observer')
+    @patch.object(LocalFileWatcher, 'initial_scan')
+    @patch.object(LocalFileWatcher, 'flush_pending_events')
+    @patch.object(LocalFileWatcher, 'sync_changes')
+    @patch('time.sleep')
+    def test_watch_for_events(self, mock_sleep, mock_sync, mock_flush, mock_initial_scan, mock_observer_class, watcher):
+        """Test the event loop flushes events and reconciles when requested"""
+        mock_observer = MagicMock()
+        mock_observer_class.return_value = mock_observer
+        
+        # Request a reconciliation during the first iteration, stop on the second
+        def sleep_side_effect(seconds):
+            if mock_sleep.call_count == 1:
+                watcher.request_reconciliation()
+            else:
+                raise KeyboardInterrupt()
+        mock_sleep.side_effect = sleep_side_effect
+        
+        watcher.watch_for_events(debounce_seconds=0.5, reconcile_interval_seconds=600)
+        
+        args, kwargs = mock_observer.schedule.call_args
+        assert isinstance(args[0], LocalFileEventHandler)
+        assert args[1] == watcher.watch_directory
+        assert kwargs == {'recursive': True}
+        mock_observer.start.assert_called_once()
+        mock_initial_scan.assert_called_once()
+        mock_flush.assert_called_once_with(0.5)
+        mock_sync.assert_called_once()
+        assert not watcher.reconcile_requested
+        mock_observer.stop.assert_called_once()
+    
+    @patch('Local_Files.file_watcher.Observer', None)
+    @patch.object(LocalFileWatcher, 'watch_for_changes')
+    def test_watch_for_events_without_watchdog(self, mock_watch_for_changes, watcher, capfd):
+        """Test falling back to polling when watchdog isn't installed"""
+        watcher.watch_for_events(reconcile_interval_seconds=120)
+        
+        mock_watch_for_changes.assert_called_once_with(interval_seconds=120)
+        assert "falling back to polling" in capfd.readouterr().out
+    
+    def test_manifest_persists_across_restarts(self, watcher, mock_config, tmp_path):
+        """Test that a restarted watcher reconciles against the manifest instead of rescanning"""
+        unchanged_file = os.path.join(watcher.watch_directory, 'unchanged.txt')
+        modified_file = os.path.join(watcher.watch_directory, 'modified.txt')
+        deleted_file = os.path.join(watcher.watch_directory, 'deleted.txt')
+        for path in (unchanged_file, modified_file, deleted_file):
+            with open(path, 'w') as f:
+                f.write('content')
+        
+        with patch.object(LocalFileWatcher, 'save_last_check_time'):
+            watcher.initial_scan()
+        assert len(watcher.manifest) == 3
+        watcher.manifest.close()
+        
+        # Changes while the watcher is down
+        with open(modified_file, 'w') as f:
+            f.write('new content')
+        os.remove(deleted_file)
+        
+        restarted = LocalFileWatcher(watch_directory=watcher.watch_directory, config_path=watcher.config_path)
+        assert restarted.initialized
+        assert set(restarted.known_files) == {unchanged_file, modified_file, deleted_file}
+        
+        with patch.object(LocalFileWatcher, 'save_last_check_time'):
+            changed_files = restarted.get_changes()
+        
+        assert [file['id'] for file in changed_files] == [modified_file]
+        assert restarted.check_for_deleted_files() == [deleted_file]
+        
+        with patch('Local_Files.file_watcher.delete_document_by_file_id'):
+            restarted.delete_files([deleted_file])
+        assert deleted_file not in restarted.manifest
+    
+    def test_touched_file_with_same_content_is_unchanged(self, watcher):
+        """Test that a file whose modified time changed but content didn't isn't reprocessed"""
+        file_path = os.path.join(watcher.watch_directory, 'file.txt')
+        with open(file_path, 'wb') as f:
+            f.write(b'content')
+        watcher.record_files([watcher.get_file_info(file_path)], {file_path: hash_file_content(b'content')})
+        
+        stat = os.stat(file_path)
+        os.utime(file_path, (stat.st_atime, stat.st_mtime + 10))
+        
+        assert watcher.is_unchanged(file_path, os.stat(file_path))
+        # The manifest entry is refreshed with the new modified time
+        assert watcher.manifest.get(file_path)['modified_time'] == datetime.fromtimestamp(stat.st_mtime + 10).isoformat()
+        
+        with open(file_path, 'wb') as f:
+            f.write(b'CONTENT')
+        assert not watcher.is_unchanged(file_path, os.stat(file_path))
@@ -0,0 +1,84 @@
+"""
+Benchmark the chunking strategies on synthetic markdown text.
+
+Usage:
+    python benchmarks/benchmark_chunking.py --size-mb 100
+    python benchmarks/benchmark_chunking.py --size-mb 10 --tokenizer path/to/tokenizer.json
+"""
+import argparse
+import random
+import time
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.chunking import CHUNKING_STRATEGIES, DEFAULT_TOKENIZER, get_tokenizer
+
+WORDS = ["retrieval", "augmented", "generation", "agent", "document", "vector", "embedding", "chunk",
+         "the", "a", "of", "and", "to", "in", "is", "for", "with", "on", "data", "model"]
+
+def generate_text(size_bytes: int, seed: int = 0) -> str:
+    """
+    Generate markdown-like text with headings, paragraphs and sentences of varying length.
+
+    Args:
+        size_bytes: Approximate size of the text in characters
+        seed: Random seed so every run chunks the same text
+
+    Returns:
+        The generated text
+    """
+    rng = random.Random(seed)
+    sections = []
+    size = 0
+    while size < size_bytes:
+        paragraphs = [f"{'#' * rng.randint(1, 3)} Section {len(sections)}"]
+        for _ in range(rng.randint(1, 6)):
+            sentences = []
+            for _ in range(rng.randint(1, 8)):
+                words = rng.choices(WORDS, k=rng.randint(4, 30))
+                sentences.append(" ".join(words).capitalize() + ".")
+            paragraphs.append(" ".join(sentences))
+        section = "\n\n".join(paragraphs) + "\n\n"
+        sections.append(section)
+        size += len(section)
+    return "".join(sections)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RAG pipeline chunking strategies')
+    parser.add_argument('--size-mb', type=float, default=10, help='Size of the generated text in MB')
+    parser.add_argument('--chunk-size', type=int, default=400, help='Chunk size in characters for the character based strategies')
+    parser.add_argument('--token-chunk-size', type=int, default=256, help='Chunk size in tokens for the token strategy')
+    parser.add_argument('--tokenizer', type=str, default=DEFAULT_TOKENIZER, help='Tokenizer file or Hugging Face model for the token strategy')
+    parser.add_argument('--strategies', nargs='+', default=list(CHUNKING_STRATEGIES), help='Strategies to benchmark')
+    args = parser.parse_args()
+
+    text = generate_text(int(args.size_mb * 1024 * 1024))
+    megabytes = len(text) / (1024 * 1024)
+    settings = {
+        "default_chunk_size": args.chunk_size,
+        "default_chunk_overlap": 0,
+        "token_chunk_size": args.token_chunk_size,
+        "tokenizer": args.tokenizer
+    }
+    print(f"Chunking {megabytes:.1f} MB of text\n")
+    print(f"{'strategy':<12}{'seconds':>10}{'MB/s':>10}{'chunks':>12}{'avg chars':>12}")
+
+    for strategy in args.strategies:
+        if strategy == 'token':
+            try:
+                # Load outside the timed section
+                get_tokenizer(args.tokenizer)
+            except Exception as e:
+                print(f"{strategy:<12}skipped, tokenizer '{args.tokenizer}' could not be loaded: {e}")
+                continue
+
+        start = time.perf_counter()
+        chunks = CHUNKING_STRATEGIES[strategy](text, settings)
+        elapsed = time.perf_counter() - start
+
+        average = sum(len(chunk) for chunk in chunks) / len(chunks) if chunks else 0
+        print(f"{strategy:<12}{elapsed:>10.2f}{megabytes / elapsed:>10.1f}{len(chunks):>12}{average:>12.0f}")
+
+if __name__ == "__main__":
+    main()
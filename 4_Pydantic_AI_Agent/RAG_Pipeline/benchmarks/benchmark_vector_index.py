@@ -0,0 +1,138 @@
+"""
+Benchmark the recall and latency of HNSW and IVFFlat indexes against a brute-force scan.
+
+A synthetic corpus of clustered vectors is generated inside Postgres (over DATABASE_URL, pgvector required)
+in a scratch table, the exact top k of every query is computed with a sequential scan, then each index is
+built and queried with a range of ef_search / probes settings.
+
+Usage:
+    python benchmarks/benchmark_vector_index.py --rows 1000000 --dim 128
+    python benchmarks/benchmark_vector_index.py --rows 100000 --methods hnsw --ef-search 20 40 80
+"""
+import argparse
+import random
+import time
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.db_handler import get_db_connection
+from common.vector_index import build_index_sql, recommended_lists, DEFAULT_M, DEFAULT_EF_CONSTRUCTION
+
+def to_vector(values) -> str:
+    return "[" + ",".join(f"{value:.6f}" for value in values) + "]"
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def generate_corpus(cursor, table: str, rows: int, dim: int, centers, noise: float, batch_size: int = 100_000) -> None:
+    """
+    Fill the scratch table with rows scattered around the cluster centers, generated server side.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {table}, {table}_centers")
+    cursor.execute(f"CREATE TABLE {table} (id bigserial PRIMARY KEY, embedding vector({dim}))")
+    cursor.execute(f"CREATE TABLE {table}_centers (id int PRIMARY KEY, center real[])")
+    cursor.executemany(f"INSERT INTO {table}_centers (id, center) VALUES (%s, %s)",
+                       [(i, center) for i, center in enumerate(centers)])
+
+    for start in range(0, rows, batch_size):
+        count = min(batch_size, rows - start)
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (embedding)
+            SELECT (
+                SELECT array_agg(c.center[d] + (random() - 0.5) * %s ORDER BY d)
+                FROM generate_series(1, %s) d
+            )::vector
+            FROM generate_series(%s, %s) g
+            JOIN {table}_centers c ON c.id = g %% %s
+            """,
+            (noise, dim, start, start + count - 1, len(centers))
+        )
+        print(f"  generated {start + count}/{rows} rows", end="\r")
+    print()
+    cursor.execute(f"ANALYZE {table}")
+
+def run_queries(cursor, table: str, queries, k: int):
+    """
+    Run every query and return the result ids and latencies in milliseconds.
+    """
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        cursor.execute(f"SELECT id FROM {table} ORDER BY embedding <=> %s::vector LIMIT %s", (query, k))
+        ids = [row[0] for row in cursor.fetchall()]
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids)
+    return results, latencies
+
+def report(label: str, results, latencies, truth, k: int) -> None:
+    recall = sum(len(set(found) & set(exact)) for found, exact in zip(results, truth)) / (k * len(truth))
+    print(f"{label:<28}{recall:>10.3f}{percentile(latencies, 0.5):>12.1f}{percentile(latencies, 0.95):>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pgvector HNSW/IVFFlat recall and latency against brute force')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Number of vectors in the synthetic corpus')
+    parser.add_argument('--dim', type=int, default=128, help='Vector dimensions')
+    parser.add_argument('--clusters', type=int, default=100, help='Number of clusters the vectors are drawn around')
+    parser.add_argument('--noise', type=float, default=0.5, help='Spread of the vectors around their cluster center')
+    parser.add_argument('--queries', type=int, default=100, help='Number of queries')
+    parser.add_argument('--k', type=int, default=10, help='Number of neighbors per query')
+    parser.add_argument('--methods', nargs='+', choices=['hnsw', 'ivfflat'], default=['hnsw', 'ivfflat'])
+    parser.add_argument('--m', type=int, default=DEFAULT_M, help='HNSW: connections per layer')
+    parser.add_argument('--ef-construction', type=int, default=DEFAULT_EF_CONSTRUCTION, help='HNSW: candidate list size while building')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[20, 40, 100, 200], help='HNSW: ef_search values to try')
+    parser.add_argument('--lists', type=int, default=None, help='IVFFlat: number of lists (default: based on --rows)')
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 5, 10, 40], help='IVFFlat: probes values to try')
+    parser.add_argument('--maintenance-work-mem', type=str, default='1GB', help='Memory for the index builds')
+    parser.add_argument('--table', type=str, default='vector_index_benchmark', help='Scratch table name')
+    parser.add_argument('--keep', action='store_true', help="Don't drop the scratch tables afterwards")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    centers = [[rng.uniform(-1, 1) for _ in range(args.dim)] for _ in range(args.clusters)]
+    queries = [
+        to_vector(value + rng.uniform(-0.5, 0.5) * args.noise for value in rng.choice(centers))
+        for _ in range(args.queries)
+    ]
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            print(f"Generating {args.rows} vectors of {args.dim} dimensions in {args.clusters} clusters...")
+            generate_corpus(cursor, args.table, args.rows, args.dim, centers, args.noise)
+            cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (args.maintenance_work_mem,))
+
+            print(f"\n{'search':<28}{'recall@' + str(args.k):>10}{'p50 ms':>12}{'p95 ms':>12}")
+
+            # Without an index every query is an exact sequential scan
+            truth, latencies = run_queries(cursor, args.table, queries, args.k)
+            report("brute force", truth, latencies, truth, args.k)
+
+            for method in args.methods:
+                lists = args.lists or recommended_lists(args.rows)
+                start = time.perf_counter()
+                cursor.execute(build_index_sql(method, f"{args.table}_idx", m=args.m, ef_construction=args.ef_construction,
+                                               lists=lists, concurrently=False, table=args.table))
+                build_seconds = time.perf_counter() - start
+                options = f"m={args.m}, ef_construction={args.ef_construction}" if method == 'hnsw' else f"lists={lists}"
+                print(f"-- {method} ({options}) built in {build_seconds:.1f} s")
+
+                setting, values = ('hnsw.ef_search', args.ef_search) if method == 'hnsw' else ('ivfflat.probes', args.probes)
+                for value in values:
+                    cursor.execute("SELECT set_config(%s, %s, false)", (setting, str(value)))
+                    results, latencies = run_queries(cursor, args.table, queries, args.k)
+                    report(f"{method} {setting.split('.')[1]}={value}", results, latencies, truth, args.k)
+
+                cursor.execute(f"DROP INDEX {args.table}_idx")
+    finally:
+        if not args.keep:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {args.table}, {args.table}_centers")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
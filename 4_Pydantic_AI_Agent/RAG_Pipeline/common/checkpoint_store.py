@@ -0,0 +1,144 @@
+from typing import Dict, Any
+from datetime import datetime, timezone
+import threading
+import json
+import time
+import os
+
+# Version of the checkpoint file layout, bumped whenever the layout changes
+CHECKPOINT_VERSION = 1
+
+class CheckpointStore:
+    """
+    Versioned JSON file holding the mutable state of the watchers (last check times, page tokens, ...),
+    kept separate from the static configuration in config.json.
+
+    State is grouped per source (e.g. a watched directory or Drive folder) so every source has its own
+    cursors. Writes go to a temporary file that is fsynced and renamed over the checkpoint, so a crash
+    never leaves a half-written file behind. To keep fsyncs off the hot path, changes are only written
+    once flush_interval_seconds have passed since the last write (or when flush() is called).
+    """
+    def __init__(self, path: str, flush_interval_seconds: float = 30.0):
+        """
+        Open the checkpoint file, loading its state if it exists.
+
+        Args:
+            path: Path to the checkpoint JSON file
+            flush_interval_seconds: Minimum time between writes of changed state (0 writes on every change)
+        """
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the checkpoint file. A missing, unreadable or newer-version file leaves the state empty.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+
+            version = data.get('version')
+            if version != CHECKPOINT_VERSION:
+                print(f"Ignoring checkpoint {self.path} with unsupported version {version}")
+                return
+
+            self.sources = data.get('sources', {})
+            print(f"Loaded checkpoint from {self.path}")
+        except Exception as e:
+            print(f"Error loading checkpoint from {self.path}: {e}")
+
+    def get(self, source: str, key: str, default: Any = None) -> Any:
+        """
+        Get a value from the checkpoint of a source.
+
+        Args:
+            source: The source the value belongs to
+            key: The name of the value
+            default: Value to return if it isn't set
+
+        Returns:
+            The stored value, or the default
+        """
+        with self._lock:
+            return self.sources.get(source, {}).get(key, default)
+
+    def set(self, source: str, key: str, value: Any) -> None:
+        """
+        Set a value in the checkpoint of a source. The change is written once the flush interval has passed.
+
+        Args:
+            source: The source the value belongs to
+            key: The name of the value
+            value: JSON serializable value to store
+        """
+        with self._lock:
+            self.sources.setdefault(source, {})[key] = value
+            self._dirty = True
+            due = time.monotonic() - self._last_flush >= self.flush_interval_seconds
+
+        if due:
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Atomically write any pending changes to the checkpoint file.
+
+        Returns:
+            bool: True if the checkpoint is up to date on disk
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+
+            data = {
+                'version': CHECKPOINT_VERSION,
+                'updated_at': datetime.now(timezone.utc).isoformat(),
+                'sources': self.sources
+            }
+            temp_path = f"{self.path}.tmp"
+
+            try:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+
+                with open(temp_path, 'w') as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+
+                # Make the rename itself durable (not supported on Windows)
+                if hasattr(os, 'O_DIRECTORY'):
+                    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+
+                self._dirty = False
+                self._last_flush = time.monotonic()
+                return True
+            except Exception as e:
+                print(f"Error saving checkpoint to {self.path}: {e}")
+                return False
+
+def get_checkpoint_path(config: Dict[str, Any], config_path: str) -> str:
+    """
+    Get the checkpoint file of a watcher: config['checkpoint_path'] or checkpoint.json next to its config file.
+
+    Args:
+        config: The watcher configuration
+        config_path: Path to the watcher's config.json
+
+    Returns:
+        str: Path to the checkpoint file
+    """
+    return config.get('checkpoint_path') or os.path.join(os.path.dirname(os.path.abspath(config_path)), 'checkpoint.json')
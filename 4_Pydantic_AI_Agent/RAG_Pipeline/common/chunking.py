@@ -0,0 +1,287 @@
+from typing import List, Dict, Any, Callable, Optional, Sequence
+from functools import lru_cache
+import re
+import os
+import sys
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Only needed for the token chunking strategy
+    Tokenizer = None
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from text_processor import chunk_text
+
+# Tokenizer used by the token strategy by default: the cl100k_base vocabulary of the OpenAI embedding models
+DEFAULT_TOKENIZER = "Xenova/text-embedding-ada-002"
+
+# Separators tried in order by the recursive strategy, from paragraphs down to single characters
+RECURSIVE_SEPARATORS = ["\n\n", "\n", ". ", "? ", "! ", "; ", ", ", " ", ""]
+
+# Text is tokenized in blocks of about this many characters (cut at line breaks) so it can be encoded in parallel
+TOKENIZE_BLOCK_SIZE = 1024 * 1024
+
+MARKDOWN_HEADING_PATTERN = re.compile(r"^#{1,6}[ \t]", re.MULTILINE)
+HTML_HEADING_PATTERN = re.compile(r"<h[1-6][\s>]", re.IGNORECASE)
+
+@lru_cache(maxsize=8)
+def get_tokenizer(name: str) -> Tokenizer:
+    """
+    Load a tokenizer once per process.
+
+    Args:
+        name: Path to a tokenizer.json file or the name of a Hugging Face Hub model with one
+
+    Returns:
+        The loaded tokenizer
+    """
+    if Tokenizer is None:
+        raise ImportError("The tokenizers package is required for the token chunking strategy")
+    if os.path.isfile(name):
+        return Tokenizer.from_file(name)
+    return Tokenizer.from_pretrained(name)
+
+def _split_blocks(text: str, block_size: int = TOKENIZE_BLOCK_SIZE) -> List[str]:
+    """
+    Cut text into blocks of about block_size characters, ending each block at a line break where possible.
+    """
+    blocks = []
+    start = 0
+    while start < len(text):
+        end = start + block_size
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            if newline > start:
+                end = newline + 1
+        blocks.append(text[start:end])
+        start = end
+    return blocks
+
+def chunk_by_tokens(text: str, chunk_size: int = 256, overlap: int = 0, tokenizer: str = DEFAULT_TOKENIZER) -> List[str]:
+    """
+    Split text into chunks of a fixed number of tokens with optional overlap.
+
+    The text is encoded once (in parallel blocks) and chunks are cut at the character offsets of
+    the token windows, so every chunk keeps its original text and embeds to a predictable size.
+
+    Args:
+        text: The text to chunk
+        chunk_size: Number of tokens in each chunk
+        overlap: Number of overlapping tokens between chunks
+        tokenizer: Path to a tokenizer.json file or the name of a Hugging Face Hub model
+
+    Returns:
+        List of text chunks
+    """
+    if not text:
+        return []
+
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("chunk_size must be larger than overlap")
+
+    blocks = _split_blocks(text)
+    encodings = get_tokenizer(tokenizer).encode_batch(blocks, add_special_tokens=False)
+
+    # Character offsets of every token in the whole text
+    starts = []
+    ends = []
+    base = 0
+    for block, encoding in zip(blocks, encodings):
+        offsets = encoding.offsets
+        starts.extend(offset[0] + base for offset in offsets)
+        ends.extend(offset[1] + base for offset in offsets)
+        base += len(block)
+
+    chunks = []
+    for i in range(0, len(starts), step):
+        chunk = text[starts[i]:ends[min(i + chunk_size, len(ends)) - 1]]
+        if chunk.strip():
+            chunks.append(chunk)
+        if i + chunk_size >= len(starts):
+            break
+    return chunks
+
+def _split_with_separators(text: str, chunk_size: int, separators: Sequence[str]) -> List[str]:
+    """
+    Split text into pieces of at most chunk_size characters, using the coarsest separator that works.
+    """
+    if len(text) <= chunk_size:
+        return [text]
+
+    for index, separator in enumerate(separators):
+        if separator == "":
+            return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        if separator not in text:
+            continue
+
+        # Keep each separator attached to the end of the piece before it so no text is lost
+        parts = text.split(separator)
+        pieces = []
+        for i, part in enumerate(parts):
+            if i < len(parts) - 1:
+                part += separator
+            if not part:
+                continue
+            if len(part) <= chunk_size:
+                pieces.append(part)
+            else:
+                pieces.extend(_split_with_separators(part, chunk_size, separators[index + 1:]))
+        return pieces
+
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+def _merge_pieces(pieces: List[str], chunk_size: int, overlap: int) -> List[str]:
+    """
+    Greedily merge pieces into chunks of at most chunk_size characters, repeating up to overlap
+    characters of trailing pieces at the start of the next chunk.
+    """
+    chunks = []
+    current: List[str] = []
+    current_length = 0
+
+    for piece in pieces:
+        if current and current_length + len(piece) > chunk_size:
+            chunks.append("".join(current))
+            # Carry whole trailing pieces as the overlap, as long as they fit next to the new piece
+            carried: List[str] = []
+            carried_length = 0
+            for previous in reversed(current):
+                if carried_length + len(previous) > overlap or carried_length + len(previous) + len(piece) > chunk_size:
+                    break
+                carried.insert(0, previous)
+                carried_length += len(previous)
+            current = carried
+            current_length = carried_length
+        current.append(piece)
+        current_length += len(piece)
+
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def chunk_recursively(text: str, chunk_size: int = 400, overlap: int = 0,
+                      separators: Sequence[str] = RECURSIVE_SEPARATORS) -> List[str]:
+    """
+    Split text into chunks of at most chunk_size characters at paragraph, line, sentence or word
+    boundaries, only falling back to finer separators for pieces that are still too long.
+
+    Args:
+        text: The text to chunk
+        chunk_size: Maximum size of each chunk in characters
+        overlap: Maximum number of overlapping characters between chunks
+        separators: Separators to split on, from coarsest to finest
+
+    Returns:
+        List of text chunks
+    """
+    if not text:
+        return []
+
+    text = text.replace('\r', '')
+    pieces = _split_with_separators(text, chunk_size, separators)
+    return _merge_pieces(pieces, chunk_size, overlap)
+
+def _split_sections(text: str, pattern: re.Pattern) -> List[str]:
+    """
+    Split text into sections that each start at a heading (plus any text before the first heading).
+    """
+    boundaries = [match.start() for match in pattern.finditer(text)]
+    if not boundaries or boundaries[0] != 0:
+        boundaries.insert(0, 0)
+    boundaries.append(len(text))
+    return [text[start:end] for start, end in zip(boundaries, boundaries[1:]) if text[start:end].strip()]
+
+def chunk_by_headings(text: str, chunk_size: int = 400, overlap: int = 0, pattern: re.Pattern = MARKDOWN_HEADING_PATTERN) -> List[str]:
+    """
+    Split text into chunks that never cross a heading, splitting long sections recursively.
+
+    Args:
+        text: The text to chunk
+        chunk_size: Maximum size of each chunk in characters
+        overlap: Maximum number of overlapping characters between chunks of the same section
+        pattern: Regular expression matching the start of a heading
+
+    Returns:
+        List of text chunks
+    """
+    if not text:
+        return []
+
+    text = text.replace('\r', '')
+    chunks = []
+    for section in _split_sections(text, pattern):
+        chunks.extend(chunk_recursively(section, chunk_size=chunk_size, overlap=overlap))
+    return chunks
+
+def _fixed(text: str, settings: Dict[str, Any]) -> List[str]:
+    return chunk_text(text, chunk_size=settings.get('default_chunk_size', 400), overlap=settings.get('default_chunk_overlap', 0))
+
+def _token(text: str, settings: Dict[str, Any]) -> List[str]:
+    tokenizer = settings.get('tokenizer', DEFAULT_TOKENIZER)
+    try:
+        get_tokenizer(tokenizer)
+    except Exception as e:
+        print(f"Error loading tokenizer '{tokenizer}', falling back to recursive chunking: {e}")
+        return _recursive(text, settings)
+    return chunk_by_tokens(text, chunk_size=settings.get('token_chunk_size', 256),
+                           overlap=settings.get('token_chunk_overlap', 0), tokenizer=tokenizer)
+
+def _recursive(text: str, settings: Dict[str, Any]) -> List[str]:
+    return chunk_recursively(text, chunk_size=settings.get('default_chunk_size', 400), overlap=settings.get('default_chunk_overlap', 0))
+
+def _markdown(text: str, settings: Dict[str, Any]) -> List[str]:
+    return chunk_by_headings(text, chunk_size=settings.get('default_chunk_size', 400),
+                             overlap=settings.get('default_chunk_overlap', 0), pattern=MARKDOWN_HEADING_PATTERN)
+
+def _html(text: str, settings: Dict[str, Any]) -> List[str]:
+    return chunk_by_headings(text, chunk_size=settings.get('default_chunk_size', 400),
+                             overlap=settings.get('default_chunk_overlap', 0), pattern=HTML_HEADING_PATTERN)
+
+# Chunking strategies selectable with text_processing.chunking_strategy in config.json
+CHUNKING_STRATEGIES: Dict[str, Callable[[str, Dict[str, Any]], List[str]]] = {
+    "fixed": _fixed,
+    "token": _token,
+    "recursive": _recursive,
+    "markdown": _markdown,
+    "html": _html,
+}
+
+def get_chunking_strategy(text_processing: Dict[str, Any], mime_type: Optional[str] = None) -> str:
+    """
+    Get the chunking strategy to use for a file.
+
+    text_processing.mime_type_strategies maps mime type prefixes to strategies (e.g. "text/html": "html"),
+    everything else uses text_processing.chunking_strategy ("fixed" by default).
+
+    Args:
+        text_processing: The text_processing section of the config
+        mime_type: Mime type of the file, if known
+
+    Returns:
+        str: Name of the chunking strategy
+    """
+    if mime_type:
+        for prefix, strategy in text_processing.get('mime_type_strategies', {}).items():
+            if mime_type.startswith(prefix):
+                return strategy
+    return text_processing.get('chunking_strategy', 'fixed')
+
+def chunk_with_strategy(text: str, text_processing: Dict[str, Any] = None, mime_type: Optional[str] = None) -> List[str]:
+    """
+    Chunk text with the strategy configured for its mime type.
+
+    Args:
+        text: The text to chunk
+        text_processing: The text_processing section of the config
+        mime_type: Mime type of the file, if known
+
+    Returns:
+        List of text chunks
+    """
+    text_processing = text_processing or {}
+    strategy = get_chunking_strategy(text_processing, mime_type)
+    if strategy not in CHUNKING_STRATEGIES:
+        print(f"Unknown chunking strategy '{strategy}', using fixed size chunks")
+        strategy = 'fixed'
+    return CHUNKING_STRATEGIES[strategy](text, text_processing)
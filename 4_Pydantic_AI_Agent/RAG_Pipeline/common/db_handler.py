@@ -1,17 +1,26 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Sequence, Tuple, Union
 import os
 import io
+import csv
 import json
+import hashlib
 import traceback
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import base64
+try:
+    import psycopg2
+except ImportError:  # Only needed for the optional COPY based bulk load path
+    psycopg2 = None
 import sys
 from pathlib import Path
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from text_processor import chunk_text, create_embeddings, is_tabular_file, extract_schema_from_csv, extract_rows_from_csv
+from text_processor import chunk_text, iter_chunks, create_embeddings_with_cache, is_tabular_file
+from tabular_reader import TabularFile, POSTGRES_TYPES
+from embedding_cache import hash_text
+from chunking import chunk_with_strategy, get_chunking_strategy
 
 # Load environment variables from the project root .env file
 # Get the path to the project root (4_Pydantic_AI_Agent directory)
@@ -26,6 +35,106 @@ supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
 supabase: Client = create_client(supabase_url, supabase_key)
 
+# Bulk insert settings
+# RAG_BULK_INSERT_MODE is either "batch" (multi-row PostgREST inserts) or "copy" (COPY over DATABASE_URL)
+database_url = os.getenv("DATABASE_URL")
+bulk_insert_mode = os.getenv("RAG_BULK_INSERT_MODE", "batch")
+insert_batch_size = int(os.getenv("RAG_INSERT_BATCH_SIZE", "100"))
+row_batch_size = int(os.getenv("RAG_ROW_BATCH_SIZE", "1000"))
+
+class _CsvRowStream(io.TextIOBase):
+    """
+    Read-only file-like object that renders rows as CSV lazily, so COPY ... FROM STDIN
+    can stream any number of rows without building the whole payload in memory.
+    """
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator="\n")
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self, size: int) -> None:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                return
+            self._writer.writerow(row)
+            self._buffer += self._out.getvalue()
+            self._out.seek(0)
+            self._out.truncate()
+
+    def read(self, size: int = -1) -> str:
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def _batched(items: Iterable[Any], batch_size: int) -> Iterator[Tuple[int, List[Any]]]:
+    """
+    Group an iterable into lists of at most batch_size items without materializing it.
+    
+    Yields:
+        Tuple of the index of the first item in the batch and the batch itself
+    """
+    batch = []
+    start = 0
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield start, batch
+            start += len(batch)
+            batch = []
+    if batch:
+        yield start, batch
+
+def get_db_connection():
+    """
+    Open a direct Postgres connection over DATABASE_URL (used for COPY based bulk loads).
+    
+    Returns:
+        A psycopg2 connection
+    """
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is required for COPY based bulk loads (pip install psycopg2-binary)")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL must be set for COPY based bulk loads")
+    return psycopg2.connect(database_url)
+
+def copy_rows(table: str, columns: List[str], rows: Iterable[Sequence[Any]], connection=None) -> int:
+    """
+    Bulk load rows into a table with COPY ... FROM STDIN in a single transaction.
+    
+    Args:
+        table: The table to load into
+        columns: The column names, in the same order as the values in each row
+        rows: Iterable of row value sequences (JSON and vector values already serialized)
+        connection: Optional open connection to reuse, one is opened (and closed) if not given
+        
+    Returns:
+        int: Number of rows loaded
+    """
+    owns_connection = connection is None
+    conn = connection or get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            column_list = ", ".join(columns)
+            cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", _CsvRowStream(rows))
+            row_count = cursor.rowcount
+        conn.commit()
+        return row_count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if owns_connection:
+            conn.close()
+
 def delete_document_by_file_id(file_id: str) -> None:
     """
     Delete all records related to a specific file ID (documents, document_rows, and document_metadata).
@@ -55,11 +164,99 @@ def delete_document_by_file_id(file_id: str) -> None:
     except Exception as e:
         print(f"Error deleting documents: {e}")
 
+def get_file_filter_metadata(file: Dict[str, Any], folder_parents: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """
+    Get the metadata retrieval can filter chunks on besides file_id and mime_type.
+    
+    Args:
+        file: File information dictionary from a watcher (Google Drive or local)
+        folder_parents: Optional map of Google Drive folder IDs to their parent folder IDs, used to find
+            the ancestors of the file's parents
+        
+    Returns:
+        Dict with the folder (first parent folder ID for Google Drive, directory for local files), the
+        folders the file is in at any depth (every parent and its ancestors in folder_parents for Google
+        Drive, every enclosing directory for local files) and the modified_time as a UTC ISO 8601
+        timestamp, when known
+    """
+    metadata = {}
+    if file.get('parents'):
+        metadata["folder"] = file['parents'][0]
+        folders = []
+        pending = list(file['parents'])
+        while pending:
+            folder_id = pending.pop(0)
+            if folder_id in folders:
+                continue
+            folders.append(folder_id)
+            pending.extend((folder_parents or {}).get(folder_id, []))
+        metadata["folders"] = folders
+    elif file.get('webViewLink', '').startswith('file://'):
+        metadata["folder"] = os.path.dirname(file['id'])
+        folders = []
+        folder = metadata["folder"]
+        while folder and folder not in folders:
+            folders.append(folder)
+            folder = os.path.dirname(folder)
+        metadata["folders"] = folders
+    
+    if file.get('modifiedTime'):
+        try:
+            # Drive times end in Z, local times are naive and in the machine's timezone
+            modified_time = datetime.fromisoformat(file['modifiedTime'].replace('Z', '+00:00'))
+            metadata["modified_time"] = modified_time.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        except ValueError:
+            print(f"Unrecognized modified time for file ID {file.get('id')}: {file['modifiedTime']}")
+    return metadata
+
+def build_chunk_rows(chunks: List[str], embeddings: List[List[float]], chunk_indices: Iterable[int], file_id: str,
+                     file_url: str, file_title: str, mime_type: str, file_contents: bytes | None = None,
+                     file_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Build the documents table rows for a set of chunks.
+    
+    Args:
+        chunks: List of text chunks
+        embeddings: List of embedding vectors for each chunk
+        chunk_indices: Position of each chunk within the document
+        file_id: The Google Drive file ID
+        file_url: The URL to access the file
+        file_title: The title of the file
+        mime_type: The mime type of the file
+        file_contents: Optional binary of the file to store as metadata
+        file_metadata: Optional extra metadata for every chunk (see get_file_filter_metadata)
+        
+    Returns:
+        List of rows with content, metadata (including the chunk's content hash) and embedding
+    """
+    file_bytes_str = base64.b64encode(file_contents).decode('utf-8') if file_contents else None
+    data = []
+    for i, chunk, embedding in zip(chunk_indices, chunks, embeddings):
+        data.append({
+            "content": chunk,
+            "metadata": {
+                "file_id": file_id,
+                "file_url": file_url,
+                "file_title": file_title,
+                "mime_type": mime_type,
+                **(file_metadata or {}),
+                "chunk_index": i,
+                "chunk_hash": hash_text(chunk),
+                **({"file_contents": file_bytes_str} if file_bytes_str else {})
+            },
+            "embedding": embedding
+        })
+    return data
+
 def insert_document_chunks(chunks: List[str], embeddings: List[List[float]], file_id: str, 
-                        file_url: str, file_title: str, mime_type: str, file_contents: bytes | None = None) -> None:
+                        file_url: str, file_title: str, mime_type: str, file_contents: bytes | None = None,
+                        batch_size: int = None, mode: str = None, file_metadata: Optional[Dict[str, Any]] = None) -> bool:
     """
     Insert document chunks with their embeddings into the Supabase database.
     
+    Chunks are sent in batches of multiple rows per request, or streamed with a single
+    COPY over DATABASE_URL when the mode is "copy".
+    
     Args:
         chunks: List of text chunks
         embeddings: List of embedding vectors for each chunk
@@ -68,36 +265,189 @@ def insert_document_chunks(chunks: List[str], embeddings: List[List[float]], fil
         file_title: The title of the file
         mime_type: The mime type of the file
         file_contents: Optional binary of the file to store as metadata
+        batch_size: Number of rows per insert request (defaults to RAG_INSERT_BATCH_SIZE)
+        mode: "batch" or "copy" (defaults to RAG_BULK_INSERT_MODE)
+        file_metadata: Optional extra metadata for every chunk (folder, modified time)
+        
+    Returns:
+        bool: True if every chunk was inserted, False otherwise
     """
+    batch_size = batch_size or insert_batch_size
+    mode = mode or bulk_insert_mode
+    
     try:
         # Ensure we have the same number of chunks and embeddings
         if len(chunks) != len(embeddings):
             raise ValueError("Number of chunks and embeddings must match")
         
         # Prepare the data for insertion
-        data = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            file_bytes_str = base64.b64encode(file_contents).decode('utf-8') if file_contents else None
-            data.append({
-                "content": chunk,
-                "metadata": {
-                    "file_id": file_id,
-                    "file_url": file_url,
-                    "file_title": file_title,
-                    "mime_type": mime_type,
-                    "chunk_index": i,
-                    **({"file_contents": file_bytes_str} if file_bytes_str else {})
-                },
-                "embedding": embedding
-            })
-        
-        # Insert the data into the documents table
-        for item in data:
-            supabase.table("documents").insert(item).execute()
+        data = build_chunk_rows(chunks, embeddings, range(len(chunks)), file_id, file_url, file_title, mime_type,
+                                file_contents, file_metadata)
+        
+        if mode == "copy":
+            rows = ((item["content"], json.dumps(item["metadata"]), json.dumps(item["embedding"])) for item in data)
+            inserted = copy_rows("documents", ["content", "metadata", "embedding"], rows)
+            print(f"Copied {inserted} document chunks for file ID: {file_id}")
+            return True
+        
+        # Insert the data into the documents table, several rows per request
+        failed_batches = []
+        for start, batch in _batched(data, batch_size):
+            try:
+                supabase.table("documents").insert(batch).execute()
+            except Exception as e:
+                end = start + len(batch) - 1
+                failed_batches.append((start, end))
+                print(f"Error inserting document chunks {start}-{end} for file ID {file_id}: {e}")
+        
+        if failed_batches:
+            print(f"Failed to insert {len(failed_batches)} of {-(-len(data) // batch_size)} chunk batches for file ID: {file_id}")
+            return False
+        return True
     except Exception as e:
         print(f"Error inserting/updating document chunks: {e}")
+        return False
+
+def get_stored_chunks(file_id: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Get the id, chunk_index and chunk_hash of every stored chunk of a file (without content or embeddings).
+    
+    Args:
+        file_id: The Google Drive file ID
+        page_size: Number of rows to fetch per request
+        
+    Returns:
+        List of dictionaries with id, chunk_index and chunk_hash (None for chunks stored without a hash)
+    """
+    stored = []
+    start = 0
+    while True:
+        response = supabase.table("documents") \
+            .select("id, chunk_index:metadata->>chunk_index, chunk_hash:metadata->>chunk_hash") \
+            .eq("metadata->>file_id", file_id) \
+            .order("id") \
+            .range(start, start + page_size - 1) \
+            .execute()
+        stored.extend(response.data)
+        if len(response.data) < page_size:
+            return stored
+        start += page_size
+
+def diff_document_chunks(stored: List[Dict[str, Any]], chunks: List[str]) -> Tuple[List[int], List[Dict[str, Any]], List[int]]:
+    """
+    Diff the stored chunks of a file against its new chunk list by content hash and chunk_index.
+    
+    A stored chunk with the same hash at the same index is kept as is. A stored chunk whose
+    content moved to another index is kept and re-indexed. Everything else is removed, and new
+    chunks without a matching stored chunk are added.
+    
+    Args:
+        stored: Stored chunks as returned by get_stored_chunks
+        chunks: The new list of text chunks
+        
+    Returns:
+        Tuple of (ids of rows to delete, [{"id", "chunk_index"}] rows to re-index, indices of chunks to insert)
+    """
+    new_hashes = [hash_text(chunk) for chunk in chunks]
+    
+    # Map each new (hash, index) and hash to the chunk positions still waiting for a stored row
+    unmatched_positions = set(range(len(chunks)))
+    positions_by_hash: Dict[str, List[int]] = {}
+    for i, content_hash in enumerate(new_hashes):
+        positions_by_hash.setdefault(content_hash, []).append(i)
+    
+    delete_ids = []
+    leftovers = []
+    
+    # First pass: rows that are unchanged at the same position
+    for row in stored:
+        index = int(row["chunk_index"]) if row.get("chunk_index") is not None else None
+        if index is not None and index in unmatched_positions and new_hashes[index] == row.get("chunk_hash"):
+            unmatched_positions.discard(index)
+        else:
+            leftovers.append(row)
+    
+    # Second pass: rows whose content moved to another position
+    reindex = []
+    for row in leftovers:
+        positions = [i for i in positions_by_hash.get(row.get("chunk_hash"), []) if i in unmatched_positions]
+        if positions:
+            unmatched_positions.discard(positions[0])
+            reindex.append({"id": row["id"], "chunk_index": positions[0]})
+        else:
+            delete_ids.append(row["id"])
+    
+    return delete_ids, reindex, sorted(unmatched_positions)
+
+def chunk_version(stored: List[Dict[str, Any]]) -> str:
+    """
+    Get the version of a file's stored chunks, the same as the document_chunk_version database function.
+    
+    Args:
+        stored: Stored chunks as returned by get_stored_chunks
+        
+    Returns:
+        str: md5 of every chunk's "id:chunk_hash", ordered by id
+    """
+    rows = sorted(stored, key=lambda row: int(row["id"]))
+    return hashlib.md5("\n".join(f"{row['id']}:{row.get('chunk_hash') or ''}" for row in rows).encode('utf-8')).hexdigest()
+
+def update_document_chunks(chunks: List[str], file_id: str, file_url: str, file_title: str, mime_type: str,
+                           file_metadata: Optional[Dict[str, Any]] = None, max_attempts: int = 3) -> bool:
+    """
+    Incrementally update the stored chunks of a file to match a new chunk list.
+    
+    Only the added chunks are embedded and inserted, and only the removed ones are deleted.
+    The whole change is applied by the apply_document_chunk_diff database function in one
+    transaction, so readers never see a half-updated document. The function rejects the diff if
+    the stored chunks changed after they were read (a concurrent update of the same file), in which
+    case the diff is computed again.
+    
+    Args:
+        chunks: The new list of text chunks
+        file_id: The Google Drive file ID
+        file_url: The URL to access the file
+        file_title: The title of the file
+        mime_type: The mime type of the file
+        file_metadata: Optional extra metadata for every chunk (folder, modified time)
+        max_attempts: Number of times to diff and apply when the diff turns out to be stale
+        
+    Returns:
+        bool: True if the update was applied, False otherwise
+    """
+    try:
+        for attempt in range(1, max_attempts + 1):
+            stored = get_stored_chunks(file_id)
+            delete_ids, reindex, added = diff_document_chunks(stored, chunks)
+            
+            added_chunks = [chunks[i] for i in added]
+            embeddings = create_embeddings_with_cache(added_chunks)
+            new_rows = build_chunk_rows(added_chunks, embeddings, added, file_id, file_url, file_title, mime_type,
+                                        file_metadata=file_metadata)
+            
+            try:
+                supabase.rpc("apply_document_chunk_diff", {
+                    "p_file_id": file_id,
+                    "p_delete_ids": delete_ids,
+                    "p_reindex": reindex,
+                    "p_new_chunks": new_rows,
+                    "p_metadata": {"file_url": file_url, "file_title": file_title, "mime_type": mime_type, **(file_metadata or {})},
+                    "p_expected_version": chunk_version(stored)
+                }).execute()
+            except Exception as e:
+                if "Stale chunk diff" not in str(e) or attempt == max_attempts:
+                    raise
+                print(f"Chunks of file ID {file_id} changed while updating, diffing again...")
+                continue
+            
+            print(f"Updated chunks for file ID {file_id}: {len(stored) - len(delete_ids)} kept "
+                  f"({len(reindex)} moved), {len(delete_ids)} removed, {len(added)} added")
+            return True
+    except Exception as e:
+        print(f"Error updating document chunks: {e}")
+        return False
 
-def insert_or_update_document_metadata(file_id: str, file_title: str, file_url: str, schema: Optional[List[str]] = None) -> None:
+def insert_or_update_document_metadata(file_id: str, file_title: str, file_url: str, schema: Optional[Dict[str, str]] = None) -> None:
     """
     Insert or update a record in the document_metadata table.
     
@@ -105,7 +455,7 @@ def insert_or_update_document_metadata(file_id: str, file_title: str, file_url:
         file_id: The Google Drive file ID (used as primary key)
         file_title: The title of the file
         file_url: The URL to access the file
-        schema: Optional schema for tabular files (column names)
+        schema: Optional schema for tabular files (column names mapped to their inferred types)
     """
     try:
         # Check if the record already exists
@@ -133,91 +483,259 @@ def insert_or_update_document_metadata(file_id: str, file_title: str, file_url:
     except Exception as e:
         print(f"Error inserting/updating document metadata: {e}")
 
-def insert_document_rows(file_id: str, rows: List[Dict[str, Any]]) -> None:
+def insert_document_rows(file_id: str, rows: Iterable[Dict[str, Any]], batch_size: int = None, mode: str = None) -> bool:
     """
     Insert rows from a tabular file into the document_rows table.
     
+    Rows are consumed lazily and written in batches of many rows per request, or streamed
+    with a single COPY over DATABASE_URL when the mode is "copy", so memory stays bounded
+    by the batch size no matter how large the file is.
+    
     Args:
         file_id: The Google Drive file ID (references document_metadata.id)
-        rows: List of row data as dictionaries
+        rows: Iterable of row data as dictionaries (a generator works)
+        batch_size: Number of rows per insert request (defaults to RAG_ROW_BATCH_SIZE)
+        mode: "batch" or "copy" (defaults to RAG_BULK_INSERT_MODE)
+        
+    Returns:
+        bool: True if every row was inserted, False otherwise
     """
+    batch_size = batch_size or row_batch_size
+    mode = mode or bulk_insert_mode
+    
     try:
         # First, delete any existing rows for this file
         supabase.table("document_rows").delete().eq("dataset_id", file_id).execute()
         print(f"Deleted existing rows for file ID: {file_id}")
         
-        # Insert new rows
-        for row in rows:
-            supabase.table("document_rows").insert({
-                "dataset_id": file_id,
-                "row_data": row
-            }).execute()
-        print(f"Inserted {len(rows)} rows for file ID: {file_id}")
+        if mode == "copy":
+            inserted = copy_rows("document_rows", ["dataset_id", "row_data"],
+                                 ((file_id, json.dumps(row)) for row in rows))
+            print(f"Inserted {inserted} rows for file ID: {file_id}")
+            return True
+        
+        # Insert new rows, several rows per request
+        inserted = 0
+        failed_batches = 0
+        for start, batch in _batched(rows, batch_size):
+            try:
+                supabase.table("document_rows").insert([
+                    {"dataset_id": file_id, "row_data": row} for row in batch
+                ]).execute()
+                inserted += len(batch)
+            except Exception as e:
+                failed_batches += 1
+                print(f"Error inserting document rows {start}-{start + len(batch) - 1} for file ID {file_id}: {e}")
+        
+        print(f"Inserted {inserted} rows for file ID: {file_id}")
+        return failed_batches == 0
     except Exception as e:
         print(f"Error inserting document rows: {e}")
+        return False
+
+def materialize_dataset_table(file_id: str, column_types: Dict[str, str], index_columns: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Create (or recreate) the typed table of a tabular file from its rows in document_rows.
+    
+    The table is a materialized view in the datasets schema, created by the materialize_dataset
+    function from sql/dataset_tables.sql, with one natively typed column per column of the file
+    and an index on each of the index_columns. Columns whose names clash with row_id or with each
+    other (Postgres truncates names to 63 bytes) get a numbered suffix. The table name and the column
+    mapping are recorded in document_metadata and listed by the dataset_tables view.
+    
+    Args:
+        file_id: The Google Drive file ID (the dataset_id of the rows)
+        column_types: The inferred type of every column
+        index_columns: Columns to index (low-cardinality keys used for filtering and grouping)
+        
+    Returns:
+        Dict with the "table" name and the "columns" of the table by column of the file, or None if it couldn't be created
+    """
+    index_columns = set(index_columns)
+    columns = [
+        {"name": column, "type": POSTGRES_TYPES[column_type], "index": column in index_columns}
+        for column, column_type in column_types.items()
+    ]
+    
+    try:
+        response = supabase.rpc("materialize_dataset", {"p_dataset_id": file_id, "p_columns": columns}).execute()
+        table = response.data
+        renamed = {column: name for column, name in table["columns"].items() if column != name}
+        print(f"Materialized typed table {table['table']} for file ID: {file_id}"
+              + (f" (renamed columns: {renamed})" if renamed else ""))
+        return table
+    except Exception as e:
+        print(f"Error materializing typed table for file ID {file_id}: {e}")
+        return None
+
+def drop_dataset_table(file_id: str) -> None:
+    """
+    Drop the typed table of a tabular file, e.g. before its rows are reloaded.
+    
+    Other changes to document_rows refresh the typed table through triggers from sql/dataset_tables.sql,
+    so dropping it first keeps a reload from refreshing it for every batch of rows.
+    
+    Args:
+        file_id: The Google Drive file ID (the dataset_id of the rows)
+    """
+    try:
+        supabase.rpc("drop_dataset", {"p_dataset_id": file_id}).execute()
+    except Exception as e:
+        print(f"Error dropping typed table for file ID {file_id}: {e}")
+
+def is_incremental_update(mime_type: str = None, config: Dict[str, Any] = None) -> bool:
+    """
+    Check if a file should be updated incrementally (config['update_mode'] is "incremental").
+    Images always get replaced since their binary is stored with the chunk.
+    
+    Args:
+        mime_type: Mime type of the file
+        config: Configuration dictionary
+        
+    Returns:
+        bool: True if the file's chunks should be diffed against the stored ones
+    """
+    update_mode = config.get('update_mode', 'replace') if config else 'replace'
+    return update_mode == 'incremental' and not (mime_type or '').startswith("image")
 
-def process_file_for_rag(file_content: bytes, text: str, file_id: str, file_url: str, 
-                        file_title: str, mime_type: str = None, config: Dict[str, Any] = None) -> None:
+def chunk_file_text(text: Union[str, Iterable[str]], config: Dict[str, Any] = None, mime_type: Optional[str] = None) -> List[str]:
     """
-    Process a file for the RAG pipeline - delete existing records and insert new ones.
+    Chunk the text of a file using the text processing settings from the config.
+    
+    Args:
+        text: The text content extracted from the file, or a stream of its segments (e.g. PDF pages) which
+            fixed size chunking consumes as they are extracted
+        config: Configuration for things like the chunking strategy, chunk size and overlap
+        mime_type: Mime type of the file, used to pick a per mime type chunking strategy
+        
+    Returns:
+        List of text chunks
+    """
+    # Get text processing settings from config
+    text_processing = (config or {}).get('text_processing', {})
+    if get_chunking_strategy(text_processing, mime_type) != 'fixed':
+        # The other strategies split on the structure of the document, so they need the whole text
+        if not isinstance(text, str):
+            text = "".join(text)
+        return chunk_with_strategy(text, text_processing, mime_type)
+
+    chunk_size = text_processing.get('default_chunk_size', 400)
+    chunk_overlap = text_processing.get('default_chunk_overlap', 0)
+
+    # Chunk the text
+    if isinstance(text, str):
+        return chunk_text(text, chunk_size=chunk_size, overlap=chunk_overlap)
+    return list(iter_chunks(text, chunk_size=chunk_size, overlap=chunk_overlap))
+
+def store_file_for_rag(file_content: bytes, chunks: List[str], embeddings: Optional[List[List[float]]], file_id: str,
+                       file_url: str, file_title: str, mime_type: str = None, config: Dict[str, Any] = None,
+                       file_metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Write an already chunked (and embedded) file to the database - metadata, tabular rows and chunks.
     
     Args:
         file_content: The binary content of the file
-        text: The text content extracted from the file
+        chunks: The text chunks of the file
+        embeddings: Embedding vectors for the chunks (not needed for incremental updates)
         file_id: The Google Drive file ID
         file_url: The URL to access the file
         file_title: The title of the file
         mime_type: Mime type of the file
-        config: Configuration for things like the chunk size and overlap
+        config: Configuration dictionary
+        file_metadata: Optional extra metadata for every chunk (folder, modified time) to filter retrieval on
+        
+    Returns:
+        bool: True if the file was stored successfully
     """
-    try:
-        # First, delete any existing records for this file
+    # Incremental updates diff the chunks against the stored ones instead of replacing the document
+    incremental = is_incremental_update(mime_type, config)
+    
+    # First, delete any existing records for this file
+    if not incremental:
         delete_document_by_file_id(file_id)
+    
+    # Check if this is a tabular file
+    tabular_file = None
+    schema = None
+    
+    if mime_type and is_tabular_file(mime_type, config):
+        # Infer the column types of the CSV/XLSX file (one streaming pass over the rows)
+        try:
+            tabular_file = TabularFile(file_content, mime_type)
+            schema = tabular_file.column_types
+        except Exception as e:
+            print(f"Error extracting schema from tabular file '{file_title}' (ID: {file_id}): {e}")
+            tabular_file = None
+    
+    # First, insert or update document metadata (needed for foreign key constraint)
+    insert_or_update_document_metadata(file_id, file_title, file_url, schema)
+    
+    # Then, if it's a tabular file, insert the rows
+    if tabular_file:
+        typed_storage = (config or {}).get('tabular_storage', 'jsonb') == 'typed'
         
-        # Check if this is a tabular file
-        is_tabular = False
-        schema = None
+        # The typed table is rebuilt once the rows are reloaded (incremental updates keep the metadata it hangs off)
+        if typed_storage:
+            drop_dataset_table(file_id)
         
-        if mime_type:
-            is_tabular = is_tabular_file(mime_type, config)
-            
-        if is_tabular:
-            # Extract schema (column names) from CSV
-            schema = extract_schema_from_csv(file_content)
-        
-        # First, insert or update document metadata (needed for foreign key constraint)
-        insert_or_update_document_metadata(file_id, file_title, file_url, schema)
-        
-        # Then, if it's a tabular file, insert the rows
-        if is_tabular:
-            # Extract and insert rows for tabular files
-            rows = extract_rows_from_csv(file_content)
-            if rows:
-                insert_document_rows(file_id, rows)
-
-        # Get text processing settings from config
-        text_processing = config.get('text_processing', {})
-        chunk_size = text_processing.get('default_chunk_size', 400)
-        chunk_overlap = text_processing.get('default_chunk_overlap', 0)
-
-        # Chunk the text
-        chunks = chunk_text(text, chunk_size=chunk_size, overlap=chunk_overlap)
-        if not chunks:
-            print(f"No chunks were created for file '{file_name}' (Path: {file_path})")
-            return
-        
-        # Create embeddings for the chunks
-        embeddings = create_embeddings(chunks)  
-
-        # For images, don't chunk the image, just store the title for RAG and include the binary in the metadata
-        if mime_type.startswith("image"):
-            insert_document_chunks(chunks, embeddings, file_id, file_url, file_title, mime_type, file_content)
-            return
-        
-        # Insert the chunks with their embeddings
-        insert_document_chunks(chunks, embeddings, file_id, file_url, file_title, mime_type)
+        # Stream the typed rows for tabular files into the database in batches
+        rows_inserted = insert_document_rows(file_id, tabular_file.iter_rows())
+        
+        # Optionally expose the dataset as a real typed table for fast aggregations
+        if rows_inserted and typed_storage:
+            index_columns = tabular_file.low_cardinality_columns(config.get('typed_index_max_distinct', 100))
+            materialize_dataset_table(file_id, schema, index_columns)
 
-        return True
+    # Apply the diff (this also removes the stored chunks of a file that no longer has any text)
+    # Only the chunks are updated atomically: the rows and typed table of a tabular file were reloaded
+    # above in separate requests, since they're streamed in batches too large for one transaction
+    if incremental:
+        return update_document_chunks(chunks, file_id, file_url, file_title, mime_type, file_metadata)
+    
+    if not chunks:
+        print(f"No chunks were created for file '{file_title}' (ID: {file_id})")
+        return False
+
+    # For images, don't chunk the image, just store the title for RAG and include the binary in the metadata
+    if mime_type.startswith("image"):
+        return insert_document_chunks(chunks, embeddings, file_id, file_url, file_title, mime_type, file_content,
+                                      file_metadata=file_metadata)
+    
+    # Insert the chunks with their embeddings
+    return insert_document_chunks(chunks, embeddings, file_id, file_url, file_title, mime_type,
+                                  file_metadata=file_metadata)
+
+def process_file_for_rag(file_content: bytes, text: Union[str, Iterable[str]], file_id: str, file_url: str, 
+                        file_title: str, mime_type: str = None, config: Dict[str, Any] = None,
+                        file_metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Process a file for the RAG pipeline - delete existing records and insert new ones,
+    or diff the chunks against the stored ones when config['update_mode'] is "incremental".
+    
+    Args:
+        file_content: The binary content of the file
+        text: The text content extracted from the file, or a stream of its segments from iter_text_from_file
+        file_id: The Google Drive file ID
+        file_url: The URL to access the file
+        file_title: The title of the file
+        mime_type: Mime type of the file
+        config: Configuration for things like the chunk size and overlap
+        file_metadata: Optional extra metadata for every chunk (folder, modified time) to filter retrieval on
+        
+    Returns:
+        bool: True if the file was processed successfully
+    """
+    try:
+        chunks = chunk_file_text(text, config, mime_type)
+        
+        # Create embeddings for the chunks, reusing cached vectors for unchanged chunks
+        # (incremental updates only embed the chunks that were added)
+        embeddings = None
+        if chunks and not is_incremental_update(mime_type, config):
+            embeddings = create_embeddings_with_cache(chunks)
+        
+        return store_file_for_rag(file_content, chunks, embeddings, file_id, file_url, file_title, mime_type, config,
+                                  file_metadata)
     except Exception as e:
         traceback.print_exc()
         print(f"Error processing file for RAG: {e}")
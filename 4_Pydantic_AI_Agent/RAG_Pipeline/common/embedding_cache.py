@@ -0,0 +1,131 @@
+from typing import List, Dict, Iterable, Optional
+from array import array
+import threading
+import hashlib
+import sqlite3
+import os
+
+def hash_text(text: str) -> str:
+    """
+    Get the content hash used to identify a chunk.
+
+    Args:
+        text: The chunk text
+
+    Returns:
+        str: Hex SHA-256 digest of the text
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent SQLite cache of chunk embeddings keyed by content hash and embedding model.
+
+    Unchanged chunks of re-ingested files reuse their stored vectors, so only new or
+    edited chunks are sent to the embedding API.
+    """
+    def __init__(self, db_path: str):
+        """
+        Open (and create if needed) the cache database.
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        # The ingestion pipeline embeds from worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    PRIMARY KEY (content_hash, model)
+                )
+                """
+            )
+            self._conn.commit()
+
+    def get_many(self, content_hashes: Iterable[str], model: str) -> Dict[str, List[float]]:
+        """
+        Look up the cached embeddings for a set of content hashes.
+
+        Args:
+            content_hashes: The content hashes to look up
+            model: The embedding model name
+
+        Returns:
+            Dict mapping each cached content hash to its embedding vector
+        """
+        content_hashes = list(dict.fromkeys(content_hashes))
+        found = {}
+
+        with self._lock:
+            # Stay well under SQLite's limit on bound parameters
+            for start in range(0, len(content_hashes), 500):
+                batch = content_hashes[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT content_hash, embedding FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model or "", *batch]
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = array('d', blob).tolist()
+
+        return found
+
+    def put_many(self, embeddings: Dict[str, List[float]], model: str) -> None:
+        """
+        Store embeddings in the cache.
+
+        Args:
+            embeddings: Dict mapping content hashes to embedding vectors
+            model: The embedding model name
+        """
+        if not embeddings:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, model, embedding) VALUES (?, ?, ?)",
+                [(content_hash, model or "", array('d', embedding).tobytes()) for content_hash, embedding in embeddings.items()]
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        """
+        Close the cache database.
+        """
+        with self._lock:
+            self._conn.close()
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Get the shared embedding cache, opening it on first use.
+
+    The cache lives at EMBEDDING_CACHE_PATH (default: embedding_cache.sqlite in the RAG_Pipeline
+    directory). Setting EMBEDDING_CACHE_PATH to an empty value disables the cache.
+
+    Returns:
+        The shared EmbeddingCache, or None if caching is disabled or the cache can't be opened
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'embedding_cache.sqlite')
+        db_path = os.getenv("EMBEDDING_CACHE_PATH", default_path)
+        if not db_path:
+            return None
+        try:
+            _embedding_cache = EmbeddingCache(db_path)
+        except Exception as e:
+            print(f"Error opening embedding cache at {db_path}: {e}")
+            return None
+    return _embedding_cache
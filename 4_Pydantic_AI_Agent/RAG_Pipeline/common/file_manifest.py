@@ -0,0 +1,141 @@
+from typing import Dict, Any, Iterable, Optional
+import threading
+import hashlib
+import sqlite3
+import os
+
+def hash_file_content(content: bytes) -> str:
+    """
+    Get the content hash stored in the manifest for a file.
+
+    Args:
+        content: The binary content of the file
+
+    Returns:
+        str: Hex SHA-256 digest of the content
+    """
+    return hashlib.sha256(content).hexdigest()
+
+class FileManifest:
+    """
+    Persistent SQLite manifest of the files a watcher has ingested, keyed by path.
+
+    Each entry stores the modified time, size, inode and content hash of the file when it was
+    last ingested, so after a restart the watcher only has to process files that differ from
+    their entry (and can tell which ones were deleted while it was down). The entries are kept
+    in memory as well so comparing a scan against the manifest doesn't hit the database.
+    """
+    def __init__(self, db_path: str):
+        """
+        Open (and create if needed) the manifest database and load its entries.
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    modified_time TEXT,
+                    size INTEGER,
+                    inode INTEGER,
+                    content_hash TEXT
+                )
+                """
+            )
+            self._conn.commit()
+
+            rows = self._conn.execute("SELECT path, modified_time, size, inode, content_hash FROM files").fetchall()
+
+        self.entries: Dict[str, Dict[str, Any]] = {
+            path: {'modified_time': modified_time, 'size': size, 'inode': inode, 'content_hash': content_hash}
+            for path, modified_time, size, inode, content_hash in rows
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.entries
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the manifest entry for a path.
+
+        Args:
+            path: The file path
+
+        Returns:
+            The entry (modified_time, size, inode, content_hash), or None if the file isn't in the manifest
+        """
+        return self.entries.get(path)
+
+    def modified_times(self) -> Dict[str, str]:
+        """
+        Get the recorded modified time of every file in the manifest.
+
+        Returns:
+            Dict mapping each path to its modified time
+        """
+        return {path: entry['modified_time'] for path, entry in self.entries.items()}
+
+    def upsert_many(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Add or replace manifest entries.
+
+        Args:
+            entries: Dict mapping paths to entries with modified_time, size, inode and content_hash
+        """
+        if not entries:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, modified_time, size, inode, content_hash) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (path, entry.get('modified_time'), entry.get('size'), entry.get('inode'), entry.get('content_hash'))
+                    for path, entry in entries.items()
+                ]
+            )
+            self._conn.commit()
+
+        for path, entry in entries.items():
+            self.entries[path] = {
+                'modified_time': entry.get('modified_time'),
+                'size': entry.get('size'),
+                'inode': entry.get('inode'),
+                'content_hash': entry.get('content_hash')
+            }
+
+    def remove_many(self, paths: Iterable[str]) -> None:
+        """
+        Remove files from the manifest.
+
+        Args:
+            paths: The file paths to remove
+        """
+        paths = [path for path in paths if path in self.entries]
+        if not paths:
+            return
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+            self._conn.commit()
+
+        for path in paths:
+            del self.entries[path]
+
+    def close(self) -> None:
+        """
+        Close the manifest database.
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,213 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+from dataclasses import dataclass
+import traceback
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.text_processor import extract_text_from_file, create_embeddings_with_cache
+from common.db_handler import chunk_file_text, store_file_for_rag, is_incremental_update, get_file_filter_metadata
+
+# Mime types that get parsed in the process pool since extraction is CPU-bound
+PROCESS_POOL_MIME_TYPES = ["application/pdf"]
+
+@dataclass
+class IngestionItem:
+    """
+    A file moving through the ingestion pipeline, filled in stage by stage.
+    """
+    file: Dict[str, Any]
+    content: Optional[bytes] = None
+    text: Optional[str] = None
+    chunks: Optional[List[str]] = None
+    embeddings: Optional[List[List[float]]] = None
+
+    @property
+    def file_id(self) -> str:
+        return self.file['id']
+
+    @property
+    def title(self) -> str:
+        # Watchers can set a display title (e.g. the file name without its extension)
+        return self.file.get('title', self.file['name'])
+
+class IngestionPipeline:
+    """
+    Pipelined ingestion engine with separate read, extract, chunk, embed and write stages.
+
+    Each stage runs its own pool of asyncio workers and hands files to the next stage through a
+    bounded queue, so a slow stage applies back pressure instead of buffering whole directories
+    in memory. Blocking work runs off the event loop - PDF parsing in a process pool and file
+    reads, embedding requests and database writes in threads.
+    """
+    def __init__(self, read_file: Callable[[Dict[str, Any]], Optional[bytes]], config: Dict[str, Any] = None,
+                 folder_parents: Optional[Dict[str, List[str]]] = None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            read_file: Function that returns the binary content of a file (or None if it can't be read)
+            config: Watcher configuration; concurrency settings are read from config['ingestion']
+            folder_parents: Optional map of Google Drive folder IDs to their parent folder IDs, used to
+                record every folder a file is in for the folder filter
+        """
+        self.read_file = read_file
+        self.config = config or {}
+        self.folder_parents = folder_parents
+
+        ingestion = self.config.get('ingestion', {})
+        self.read_concurrency = max(1, ingestion.get('read_concurrency', 8))
+        self.extract_concurrency = max(1, ingestion.get('extract_concurrency', 4))
+        self.chunk_concurrency = max(1, ingestion.get('chunk_concurrency', 2))
+        self.embed_concurrency = max(1, ingestion.get('embed_concurrency', 4))
+        self.write_concurrency = max(1, ingestion.get('write_concurrency', 4))
+        self.queue_size = max(1, ingestion.get('queue_size', 16))
+        # Set to 0 to parse PDFs in threads instead of a process pool
+        self.extract_processes = ingestion.get('extract_processes', os.cpu_count() or 1)
+
+        self.results: Dict[str, bool] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    async def _read(self, item: IngestionItem) -> Optional[IngestionItem]:
+        item.content = await asyncio.to_thread(self.read_file, item.file)
+        if not item.content:
+            print(f"Failed to read file '{item.title}' (ID: {item.file_id})")
+            self.results[item.file_id] = False
+            return None
+        return item
+
+    async def _extract(self, item: IngestionItem) -> Optional[IngestionItem]:
+        mime_type = item.file['mimeType']
+        args = (item.content, mime_type, item.file['name'], self.config)
+
+        if self._process_pool and mime_type in PROCESS_POOL_MIME_TYPES:
+            loop = asyncio.get_running_loop()
+            item.text = await loop.run_in_executor(self._process_pool, extract_text_from_file, *args)
+        else:
+            item.text = await asyncio.to_thread(extract_text_from_file, *args)
+
+        if not item.text:
+            print(f"No text could be extracted from file '{item.title}' (ID: {item.file_id})")
+            self.results[item.file_id] = False
+            return None
+        return item
+
+    async def _chunk(self, item: IngestionItem) -> IngestionItem:
+        item.chunks = await asyncio.to_thread(chunk_file_text, item.text, self.config, item.file['mimeType'])
+        return item
+
+    async def _embed(self, item: IngestionItem) -> IngestionItem:
+        # Incremental updates only embed the added chunks, which happens when the diff is written
+        if item.chunks and not is_incremental_update(item.file['mimeType'], self.config):
+            item.embeddings = await asyncio.to_thread(create_embeddings_with_cache, item.chunks)
+        return item
+
+    async def _write(self, item: IngestionItem) -> None:
+        success = await asyncio.to_thread(
+            store_file_for_rag, item.content, item.chunks, item.embeddings, item.file_id,
+            item.file.get('webViewLink'), item.title, item.file['mimeType'], self.config,
+            get_file_filter_metadata(item.file, self.folder_parents)
+        )
+        self.results[item.file_id] = bool(success)
+
+        if success:
+            print(f"Successfully processed file '{item.title}' (ID: {item.file_id})")
+        else:
+            print(f"Failed to process file '{item.title}' (ID: {item.file_id})")
+
+    async def _run_stage(self, stage: Callable, concurrency: int, in_queue: asyncio.Queue,
+                         out_queue: Optional[asyncio.Queue] = None, next_concurrency: int = 0) -> None:
+        """
+        Run the workers of one stage until the queue is drained, then signal the next stage.
+
+        Args:
+            stage: Coroutine function processing one item, returning the item to pass on (or None to drop it)
+            concurrency: Number of workers for this stage
+            in_queue: Queue this stage reads from
+            out_queue: Queue of the next stage (None for the last stage)
+            next_concurrency: Number of workers in the next stage
+        """
+        async def worker() -> None:
+            while True:
+                item = await in_queue.get()
+                if item is None:
+                    return
+                try:
+                    result = await stage(item)
+                except Exception as e:
+                    traceback.print_exc()
+                    print(f"Error processing file '{item.title}' (ID: {item.file_id}): {e}")
+                    self.results[item.file_id] = False
+                    continue
+                if out_queue is not None and result is not None:
+                    await out_queue.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        # One stop signal per worker of the next stage
+        if out_queue is not None:
+            for _ in range(next_concurrency):
+                await out_queue.put(None)
+
+    async def run(self, files: List[Dict[str, Any]]) -> Dict[str, bool]:
+        """
+        Ingest files through the pipeline.
+
+        Args:
+            files: File information dictionaries (id, name, mimeType, webViewLink and optionally title)
+
+        Returns:
+            Dict mapping each file ID to whether it was stored successfully
+        """
+        self.results = {}
+        stages = [
+            (self._read, self.read_concurrency),
+            (self._extract, self.extract_concurrency),
+            (self._chunk, self.chunk_concurrency),
+            (self._embed, self.embed_concurrency),
+            (self._write, self.write_concurrency),
+        ]
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in stages]
+
+        if self.extract_processes and any(file['mimeType'] in PROCESS_POOL_MIME_TYPES for file in files):
+            self._process_pool = ProcessPoolExecutor(max_workers=self.extract_processes)
+
+        async def feed() -> None:
+            for file in files:
+                await queues[0].put(IngestionItem(file=file))
+            for _ in range(self.read_concurrency):
+                await queues[0].put(None)
+
+        try:
+            tasks = [feed()]
+            for i, (stage, concurrency) in enumerate(stages):
+                if i + 1 < len(stages):
+                    tasks.append(self._run_stage(stage, concurrency, queues[i], queues[i + 1], stages[i + 1][1]))
+                else:
+                    tasks.append(self._run_stage(stage, concurrency, queues[i]))
+            await asyncio.gather(*tasks)
+        finally:
+            if self._process_pool:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+        return self.results
+
+def run_ingestion_pipeline(files: List[Dict[str, Any]], read_file: Callable[[Dict[str, Any]], Optional[bytes]],
+                           config: Dict[str, Any] = None,
+                           folder_parents: Optional[Dict[str, List[str]]] = None) -> Dict[str, bool]:
+    """
+    Ingest files through an IngestionPipeline from synchronous code such as the watcher loops.
+
+    Args:
+        files: File information dictionaries (id, name, mimeType, webViewLink and optionally title)
+        read_file: Function that returns the binary content of a file (or None if it can't be read)
+        config: Watcher configuration
+        folder_parents: Optional map of Google Drive folder IDs to their parent folder IDs
+
+    Returns:
+        Dict mapping each file ID to whether it was stored successfully
+    """
+    return asyncio.run(IngestionPipeline(read_file, config, folder_parents).run(files))
@@ -0,0 +1,291 @@
+from typing import List, Dict, Any, Iterator, Optional
+from datetime import datetime, date, time
+import csv
+import io
+import re
+
+try:
+    import openpyxl
+except ImportError:  # Only needed for XLSX files
+    openpyxl = None
+
+XLSX_MIME_TYPES = [
+    'xlsx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+]
+
+# Inferred column types, from most to least specific
+INTEGER = "integer"
+NUMBER = "number"
+BOOLEAN = "boolean"
+DATE = "date"
+TIMESTAMP = "timestamp"
+TIMESTAMPTZ = "timestamptz"  # Timestamps with a UTC offset, which timestamp would drop
+TEXT = "text"
+
+# Postgres type of each inferred column type
+POSTGRES_TYPES = {
+    INTEGER: "bigint",
+    NUMBER: "double precision",
+    BOOLEAN: "boolean",
+    DATE: "date",
+    TIMESTAMP: "timestamp",
+    TIMESTAMPTZ: "timestamptz",
+    TEXT: "text",
+}
+
+# Leading zeros (zip codes, IDs, ...) keep a value as text so they aren't lost
+INTEGER_PATTERN = re.compile(r"^[+-]?(0|[1-9]\d*)$")
+NUMBER_PATTERN = re.compile(r"^[+-]?((0|[1-9]\d*)(\.\d*)?([eE][+-]?\d+)?|\.\d+([eE][+-]?\d+)?)$")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+TIMESTAMP_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?([+-]\d{2}:?\d{2}|Z)?$")
+BOOLEAN_VALUES = {"true": True, "false": False}
+
+# Postgres bigint range
+MAX_INTEGER = 2 ** 63 - 1
+
+# Distinct values are counted per column up to this many (enough to spot low-cardinality keys)
+DISTINCT_COUNT_LIMIT = 1000
+
+def is_xlsx_file(file_content: bytes, mime_type: Optional[str] = None) -> bool:
+    """
+    Check if a file is an XLSX workbook, by mime type or by its zip signature.
+
+    Args:
+        file_content: The binary content of the file
+        mime_type: The MIME type of the file
+
+    Returns:
+        bool: True if the file is an XLSX workbook
+    """
+    if mime_type and any(mime_type.startswith(t) for t in XLSX_MIME_TYPES):
+        return True
+    return file_content[:4] == b"PK\x03\x04"
+
+def _value_types(value: Any) -> set:
+    """
+    Get the column types a single non-empty value is compatible with.
+    """
+    if isinstance(value, bool):
+        return {BOOLEAN, TEXT}
+    if isinstance(value, int):
+        return {INTEGER, NUMBER, TEXT} if abs(value) <= MAX_INTEGER else {NUMBER, TEXT}
+    if isinstance(value, float):
+        return {NUMBER, TEXT}
+    if isinstance(value, datetime):
+        return {TIMESTAMPTZ, TEXT} if value.tzinfo else {TIMESTAMP, TEXT}
+    if isinstance(value, date):
+        return {DATE, TIMESTAMP, TEXT}
+    if not isinstance(value, str):
+        return {TEXT}
+
+    value = value.strip()
+    if INTEGER_PATTERN.match(value):
+        return {INTEGER, NUMBER, TEXT} if abs(int(value)) <= MAX_INTEGER else {NUMBER, TEXT}
+    if NUMBER_PATTERN.match(value):
+        return {NUMBER, TEXT}
+    if value.lower() in BOOLEAN_VALUES:
+        return {BOOLEAN, TEXT}
+    if DATE_PATTERN.match(value):
+        try:
+            date.fromisoformat(value)
+            return {DATE, TIMESTAMP, TEXT}
+        except ValueError:
+            return {TEXT}
+    if TIMESTAMP_PATTERN.match(value):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            # Naive and offset timestamps don't mix, so a column of both stays text
+            return {TIMESTAMPTZ, TEXT} if parsed.tzinfo else {TIMESTAMP, TEXT}
+        except ValueError:
+            return {TEXT}
+    return {TEXT}
+
+def _most_specific(candidates: set) -> str:
+    for column_type in (INTEGER, NUMBER, BOOLEAN, DATE, TIMESTAMP, TIMESTAMPTZ):
+        if column_type in candidates:
+            return column_type
+    return TEXT
+
+def convert_value(value: Any, column_type: str) -> Any:
+    """
+    Convert a raw cell value to the JSON value stored for its column type.
+    Dates and timestamps are stored as ISO 8601 strings, empty cells as None.
+
+    Args:
+        value: The raw value (a string for CSV files, a typed cell value for XLSX files)
+        column_type: The inferred type of the column
+
+    Returns:
+        The converted value
+    """
+    if value is None or (isinstance(value, str) and value.strip() == ""):
+        return None
+
+    if column_type == INTEGER:
+        return int(value.strip()) if isinstance(value, str) else int(value)
+    if column_type == NUMBER:
+        return float(value.strip()) if isinstance(value, str) else float(value)
+    if column_type == BOOLEAN:
+        return BOOLEAN_VALUES[value.strip().lower()] if isinstance(value, str) else bool(value)
+    if column_type in (DATE, TIMESTAMP, TIMESTAMPTZ):
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value.strip()
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value if isinstance(value, str) else str(value)
+
+class TabularFile:
+    """
+    Streaming reader for CSV files (including Google Sheets exported as CSV) and XLSX workbooks.
+
+    Column types are inferred in a first pass over the rows that only keeps the candidate types of
+    each column in memory, then typed rows are yielded lazily in a second pass. Integers, numbers,
+    booleans, dates and timestamps become native JSON values, so they don't need text casts.
+    XLSX workbooks are read from their first sheet in openpyxl's read-only (streaming) mode.
+    """
+    def __init__(self, file_content: bytes, mime_type: Optional[str] = None):
+        """
+        Open a tabular file.
+
+        Args:
+            file_content: The binary content of the file
+            mime_type: The MIME type of the file
+        """
+        self.file_content = file_content
+        self.is_xlsx = is_xlsx_file(file_content, mime_type)
+        self._columns: Optional[List[str]] = None
+        self._column_types: Optional[Dict[str, str]] = None
+        self._distinct_counts: Optional[Dict[str, Optional[int]]] = None
+        self._value_counts: Optional[Dict[str, int]] = None
+
+    def _iter_raw_rows(self) -> Iterator[List[Any]]:
+        """
+        Yield the raw rows of the file (header first).
+        """
+        if self.is_xlsx:
+            if openpyxl is None:
+                raise ImportError("The openpyxl package is required to read XLSX files")
+            workbook = openpyxl.load_workbook(io.BytesIO(self.file_content), read_only=True, data_only=True)
+            try:
+                for row in workbook.worksheets[0].iter_rows(values_only=True):
+                    # Skip the empty rows read-only worksheets report for formatted cells
+                    if any(value is not None and value != "" for value in row):
+                        yield list(row)
+            finally:
+                workbook.close()
+        else:
+            text_stream = io.TextIOWrapper(io.BytesIO(self.file_content), encoding='utf-8-sig', errors='replace', newline='')
+            yield from csv.reader(text_stream)
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The column names from the header row (unnamed XLSX columns become column_<n>).
+        """
+        if self._columns is None:
+            header = next(self._iter_raw_rows(), [])
+            self._columns = [
+                str(name).strip() if name not in (None, "") else f"column_{i + 1}"
+                for i, name in enumerate(header)
+            ]
+        return self._columns
+
+    def _scan(self) -> None:
+        """
+        Infer the column types and count the (distinct) values of every column in one pass over the rows.
+        """
+        columns = self.columns
+        candidates: List[Optional[set]] = [None] * len(columns)
+        distinct: List[Optional[set]] = [set() for _ in columns]
+        value_counts = [0] * len(columns)
+
+        rows = self._iter_raw_rows()
+        next(rows, None)
+        for row in rows:
+            for i, value in enumerate(row[:len(columns)]):
+                if value is None or (isinstance(value, str) and value.strip() == ""):
+                    continue
+                value_counts[i] += 1
+                if candidates[i] is None:
+                    candidates[i] = _value_types(value)
+                elif len(candidates[i]) > 1:
+                    candidates[i] &= _value_types(value)
+                if distinct[i] is not None:
+                    distinct[i].add(value.strip() if isinstance(value, str) else value)
+                    if len(distinct[i]) > DISTINCT_COUNT_LIMIT:
+                        distinct[i] = None
+
+        self._column_types = {
+            column: _most_specific(column_candidates) if column_candidates else TEXT
+            for column, column_candidates in zip(columns, candidates)
+        }
+        self._distinct_counts = {
+            column: len(values) if values is not None else None
+            for column, values in zip(columns, distinct)
+        }
+        self._value_counts = dict(zip(columns, value_counts))
+
+    @property
+    def column_types(self) -> Dict[str, str]:
+        """
+        The inferred type of every column, in column order. Columns without values are text.
+        """
+        if self._column_types is None:
+            self._scan()
+        return self._column_types
+
+    def low_cardinality_columns(self, max_distinct: int = 100) -> List[str]:
+        """
+        Get the columns with few distinct, repeating values - the keys worth indexing for filters and GROUP BY.
+
+        Args:
+            max_distinct: Maximum number of distinct values (at most DISTINCT_COUNT_LIMIT)
+
+        Returns:
+            List of column names
+        """
+        if self._distinct_counts is None:
+            self._scan()
+        return [
+            column for column in self.columns
+            if self._distinct_counts[column] is not None
+            and 0 < self._distinct_counts[column] <= max_distinct
+            and self._distinct_counts[column] < self._value_counts[column]
+        ]
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield the rows as dictionaries of typed values.
+
+        Yields:
+            Dict[str, Any]: Row data keyed by column name
+        """
+        columns = self.columns
+        column_types = self.column_types
+
+        rows = self._iter_raw_rows()
+        next(rows, None)
+        for row in rows:
+            values = list(row[:len(columns)]) + [None] * (len(columns) - len(row))
+            yield {
+                column: convert_value(value, column_types[column])
+                for column, value in zip(columns, values)
+            }
+
+    def to_csv_text(self) -> str:
+        """
+        Render the file as CSV text (the text that gets chunked and embedded).
+
+        Returns:
+            str: The rows as CSV, header first
+        """
+        if not self.is_xlsx:
+            return self.file_content.decode('utf-8', errors='replace')
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        for row in self._iter_raw_rows():
+            writer.writerow(["" if value is None else convert_value(value, TEXT) for value in row])
+        return output.getvalue()
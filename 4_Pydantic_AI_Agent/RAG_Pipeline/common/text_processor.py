@@ -1,13 +1,22 @@
 import os
 import io
 import csv
-import tempfile
-from typing import List, Dict, Any
+import sys
+import time
+import random
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Iterable, Optional
+import itertools
 import pypdf
 from openai import OpenAI
 from dotenv import load_dotenv
 from pathlib import Path
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from embedding_cache import EmbeddingCache, get_embedding_cache, hash_text
+from tabular_reader import TabularFile, is_xlsx_file
+
 # Load environment variables from the project root .env file
 # Get the path to the project root (4_Pydantic_AI_Agent directory)
 project_root = Path(__file__).resolve().parent.parent.parent
@@ -20,6 +29,56 @@ load_dotenv(dotenv_path, override=True)
 api_key = os.getenv("EMBEDDING_API_KEY", "") or "ollama"
 openai_client = OpenAI(api_key=api_key, base_url=os.getenv("EMBEDDING_BASE_URL"))
 
+# Embedding request limits - each batch sent to the embedding API stays under both limits
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "100000"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# PDFs with at least this many pages have their pages parsed across a process pool
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "50"))
+PDF_MAX_WORKERS = int(os.getenv("PDF_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+def iter_chunks(segments: Iterable[str], chunk_size: int = 400, overlap: int = 0) -> Iterator[str]:
+    """
+    Split a stream of text segments into chunks of specified size with optional overlap.
+    
+    Produces the same chunks as chunk_text on the concatenated segments, but only keeps the
+    current segment and the unfinished chunk in memory, so documents of any size can be chunked
+    as they are read (e.g. the pages from iter_pdf_pages or the lines of a file).
+    
+    Args:
+        segments: Iterable of text segments that together make up the document
+        chunk_size: Size of each chunk in characters
+        overlap: Number of overlapping characters between chunks
+        
+    Yields:
+        Text chunks
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("chunk_size must be larger than overlap")
+    
+    buffer = ""
+    for segment in segments:
+        if not segment:
+            continue
+        
+        # Clean the text
+        buffer += segment.replace('\r', '')
+        
+        # Emit every complete chunk, then keep only the tail the next chunk starts in
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            yield buffer[start:start + chunk_size]
+            start += step
+        if start:
+            buffer = buffer[start:]
+    
+    # The remaining (shorter) chunks at the end of the document
+    for start in range(0, len(buffer), step):
+        yield buffer[start:start + chunk_size]
+
 def chunk_text(text: str, chunk_size: int = 400, overlap: int = 0) -> List[str]:
     """
     Split text into chunks of specified size with optional overlap.
@@ -35,17 +94,87 @@ def chunk_text(text: str, chunk_size: int = 400, overlap: int = 0) -> List[str]:
     if not text:
         return []
     
-    # Clean the text
-    text = text.replace('\r', '')
+    return list(iter_chunks([text], chunk_size=chunk_size, overlap=overlap))
+
+# The PDF each pool worker parses, set once per worker by _init_pdf_worker
+_worker_pdf_reader = None
+
+def _init_pdf_worker(file_content: bytes) -> None:
+    """
+    Parse the PDF once in a worker process, so page ranges don't resend or reparse the document.
+    
+    Args:
+        file_content: Binary content of the PDF file
+    """
+    global _worker_pdf_reader
+    _worker_pdf_reader = pypdf.PdfReader(io.BytesIO(file_content))
+
+def _extract_pdf_page_range(start: int, end: int) -> List[str]:
+    """
+    Extract the text of a range of PDF pages (run in worker processes set up by _init_pdf_worker).
+    
+    Args:
+        start: Index of the first page
+        end: Index after the last page
+        
+    Returns:
+        Text of each page in the range
+    """
+    return [_worker_pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def iter_pdf_pages(file_content: bytes, max_workers: int = None, parallel_page_threshold: int = None) -> Iterator[str]:
+    """
+    Lazily extract the text of each page of a PDF, parsing straight from memory.
+    
+    Large PDFs are split into page ranges that are parsed across a process pool. Each worker gets the
+    PDF bytes once and parses them once, and only the page ranges are sent per task. Pages are still
+    yielded in order as soon as their range is done, so chunking can start before the last page is parsed.
+    
+    Args:
+        file_content: Binary content of the PDF file
+        max_workers: Number of worker processes for large PDFs (defaults to PDF_MAX_WORKERS)
+        parallel_page_threshold: Page count from which to use the process pool (defaults to PDF_PARALLEL_PAGE_THRESHOLD)
+        
+    Yields:
+        The text of each page (empty for pages without text)
+    """
+    max_workers = max_workers or PDF_MAX_WORKERS
+    parallel_page_threshold = parallel_page_threshold or PDF_PARALLEL_PAGE_THRESHOLD
+    
+    # BytesIO shares the bytes object's buffer, so no copy or temporary file is needed
+    pdf_reader = pypdf.PdfReader(io.BytesIO(file_content))
+    page_count = len(pdf_reader.pages)
     
-    # Split text into chunks
-    chunks = []
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i + chunk_size]
-        if chunk:  # Only add non-empty chunks
-            chunks.append(chunk)
+    # Don't start a nested pool when already running in a worker process (e.g. the ingestion pipeline's)
+    in_worker = multiprocessing.parent_process() is not None
+    if page_count < parallel_page_threshold or max_workers <= 1 or in_worker:
+        for page in pdf_reader.pages:
+            yield page.extract_text() or ""
+        return
     
-    return chunks
+    # Several ranges per worker so the first pages come back early
+    range_size = max(1, -(-page_count // (max_workers * 4)))
+    ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_pdf_worker,
+                             initargs=(file_content,)) as executor:
+        futures = [executor.submit(_extract_pdf_page_range, start, end) for start, end in ranges]
+        for future in futures:
+            yield from future.result()
+
+def iter_pdf_text(file_content: bytes) -> Iterator[str]:
+    """
+    Lazily extract the text of a PDF page by page, skipping pages without text.
+    
+    Args:
+        file_content: Binary content of the PDF file
+        
+    Yields:
+        The text of each page, followed by a blank line
+    """
+    for page_text in iter_pdf_pages(file_content):
+        if page_text:
+            yield f"{page_text}\n\n"
 
 def extract_text_from_pdf(file_content: bytes) -> str:
     """
@@ -57,28 +186,32 @@ def extract_text_from_pdf(file_content: bytes) -> str:
     Returns:
         Extracted text from the PDF
     """
-    # Create a temporary file to store the PDF content
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-        temp_file.write(file_content)
-        temp_file_path = temp_file.name
+    # Join once instead of growing a string page by page
+    return "".join(iter_pdf_text(file_content))
+
+def iter_text_from_file(file_content: bytes, mime_type: str, file_name: str, config: Dict[str, Any] = None) -> Iterator[str]:
+    """
+    Lazily extract the text of a file as segments (PDF pages, lines of text files), based on its MIME type.
     
-    try:
-        # Open the PDF file
-        with open(temp_file_path, 'rb') as file:
-            pdf_reader = pypdf.PdfReader(file)
-            text = ""
-            
-            # Extract text from each page
-            for page in pdf_reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-        
-        return text
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    Joined together the segments are the same text as extract_text_from_file returns, but they can
+    be chunked with iter_chunks as they are extracted instead of building the whole text first.
+    
+    Args:
+        file_content: Binary content of the file
+        mime_type: MIME type of the file
+        file_name: Name of the file
+        config: Configuration dictionary with supported_mime_types
+        
+    Yields:
+        Text segments of the file
+    """
+    if 'application/pdf' in mime_type:
+        yield from iter_pdf_text(file_content)
+    elif mime_type.startswith('image') or is_xlsx_file(file_content, mime_type):
+        yield extract_text_from_file(file_content, mime_type, file_name, config)
+    else:
+        # Decode line by line, newline='' keeps the line endings as they are
+        yield from io.TextIOWrapper(io.BytesIO(file_content), encoding='utf-8', errors='replace', newline='')
 
 def extract_text_from_file(file_content: bytes, mime_type: str, file_name: str, config: Dict[str, Any] = None) -> str:
     """
@@ -100,35 +233,213 @@ def extract_text_from_file(file_content: bytes, mime_type: str, file_name: str,
         return extract_text_from_pdf(file_content)
     elif mime_type.startswith('image'):
         return file_name
+    elif is_xlsx_file(file_content, mime_type):
+        # Workbooks are zip archives, so embed their cells as CSV text instead of decoding the bytes
+        return TabularFile(file_content, mime_type).to_csv_text()
     elif config and any(mime_type.startswith(t) for t in supported_mime_types):
         return file_content.decode('utf-8', errors='replace')
     else:
         # For unsupported file types, just try to extract the text
         return file_content.decode('utf-8', errors='replace')
 
-def create_embeddings(texts: List[str]) -> List[List[float]]:
+def peek_segments(segments: Iterable[str]) -> Optional[Iterator[str]]:
+    """
+    Check that a stream of text segments has any text, without losing the segments read to find out.
+    
+    Args:
+        segments: Iterable of text segments (e.g. from iter_text_from_file)
+        
+    Returns:
+        Iterator over all the segments, or None if none of them has text
+    """
+    segments = iter(segments)
+    for segment in segments:
+        if segment:
+            return itertools.chain([segment], segments)
+    return None
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text (about 4 characters per token).
+    
+    Args:
+        text: The text to estimate
+        
+    Returns:
+        int: Estimated token count
+    """
+    return len(text) // 4 + 1
+
+def batch_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS) -> List[List[str]]:
+    """
+    Split texts into batches bounded by both item count and estimated token count.
+    
+    Args:
+        texts: List of texts to batch
+        batch_size: Maximum number of texts per batch
+        max_batch_tokens: Maximum estimated tokens per batch
+        
+    Returns:
+        List of batches, in the same order as the input texts
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for text in texts:
+        tokens = estimate_tokens(text)
+        # Start a new batch when adding this text would exceed either limit
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+def _is_retryable_error(error: Exception) -> bool:
+    """
+    Check if an embedding API error is worth retrying (rate limits and transient server errors).
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'RateLimitError')
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Get the delay before the next retry, honoring a Retry-After header when the API sends one.
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        retry_after = float(headers.get('retry-after'))
+        if retry_after >= 0:
+            return retry_after
+    except (TypeError, ValueError):
+        pass
+    
+    # Exponential backoff with jitter, capped at one minute
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+def _embed_batch(batch: List[str], max_retries: int = EMBEDDING_MAX_RETRIES) -> List[List[float]]:
+    """
+    Embed a single batch of texts, backing off and retrying on rate limits.
+    
+    Args:
+        batch: List of texts that fits within one embedding request
+        max_retries: Maximum number of retries before giving up
+        
+    Returns:
+        List of embedding vectors for the batch
+    """
+    attempt = 0
+    while True:
+        try:
+            response = openai_client.embeddings.create(
+                model=os.getenv("EMBEDDING_MODEL_CHOICE"),
+                input=batch
+            )
+            return [item.embedding for item in response.data]
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable_error(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"Embedding request failed ({e}), retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            attempt += 1
+
+def create_embeddings(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                      max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+                      max_concurrency: int = EMBEDDING_MAX_CONCURRENCY) -> List[List[float]]:
     """
     Create embeddings for a list of text chunks using OpenAI.
     
+    The texts are split into batches bounded by count and estimated tokens, and the
+    batches are embedded concurrently. Rate limited requests are retried with backoff.
+    
     Args:
         texts: List of text chunks to embed
+        batch_size: Maximum number of texts per embedding request
+        max_batch_tokens: Maximum estimated tokens per embedding request
+        max_concurrency: Maximum number of embedding requests in flight
         
     Returns:
-        List of embedding vectors
+        List of embedding vectors, in the same order as the input texts
     """
     if not texts:
         return []
     
-    response = openai_client.embeddings.create(
-        model=os.getenv("EMBEDDING_MODEL_CHOICE"),
-        input=texts
-    )
+    batches = batch_texts(texts, batch_size, max_batch_tokens)
+    
+    # No need for a thread pool when everything fits in one request
+    if len(batches) == 1 or max_concurrency <= 1:
+        embeddings = []
+        for batch in batches:
+            embeddings.extend(_embed_batch(batch))
+        return embeddings
     
-    # Extract the embedding vectors from the response
-    embeddings = [item.embedding for item in response.data]
+    # executor.map keeps the results in batch order
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+        results = executor.map(_embed_batch, batches)
+        embeddings = []
+        for batch_embeddings in results:
+            embeddings.extend(batch_embeddings)
     
     return embeddings
 
+def create_embeddings_with_cache(texts: List[str], cache: EmbeddingCache = None) -> List[List[float]]:
+    """
+    Create embeddings for a list of text chunks, reusing cached vectors for chunks seen before.
+    
+    Chunks are identified by their content hash and the embedding model, so only new or
+    changed chunks (deduplicated) are sent to the embedding API.
+    
+    Args:
+        texts: List of text chunks to embed
+        cache: Optional cache to use instead of the shared one from get_embedding_cache
+        
+    Returns:
+        List of embedding vectors, in the same order as the input texts
+    """
+    if not texts:
+        return []
+    
+    cache = cache or get_embedding_cache()
+    if cache is None:
+        return create_embeddings(texts)
+    
+    model = os.getenv("EMBEDDING_MODEL_CHOICE")
+    hashes = [hash_text(text) for text in texts]
+    
+    try:
+        vectors = cache.get_many(hashes, model)
+    except Exception as e:
+        print(f"Error reading embedding cache: {e}")
+        vectors = {}
+    
+    # Embed each missing chunk once, even if it appears several times in the file
+    missing = {}
+    for content_hash, text in zip(hashes, texts):
+        if content_hash not in vectors and content_hash not in missing:
+            missing[content_hash] = text
+    
+    if missing:
+        new_vectors = dict(zip(missing.keys(), create_embeddings(list(missing.values()))))
+        vectors.update(new_vectors)
+        try:
+            cache.put_many(new_vectors, model)
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+    
+    print(f"Embedding cache: reused {len(texts) - len(missing)} of {len(texts)} chunks")
+    return [vectors[content_hash] for content_hash in hashes]
+
 def is_tabular_file(mime_type: str, config: Dict[str, Any] = None) -> bool:
     """
     Check if a file is tabular based on its MIME type.
@@ -176,6 +487,27 @@ def extract_schema_from_csv(file_content: bytes) -> List[str]:
         print(f"Error extracting schema from CSV: {e}")
         return []
 
+def iter_rows_from_csv(file_content: bytes) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield rows from a CSV file as dictionaries.
+    
+    The content is decoded incrementally while reading, so only one row at a time
+    is held in memory on top of the raw file content.
+    
+    Args:
+        file_content: The binary content of the CSV file
+        
+    Yields:
+        Dict[str, Any]: Row data as a dictionary
+    """
+    try:
+        text_stream = io.TextIOWrapper(io.BytesIO(file_content), encoding='utf-8', errors='replace', newline='')
+        csv_reader = csv.DictReader(text_stream)
+        for row in csv_reader:
+            yield row
+    except Exception as e:
+        print(f"Error extracting rows from CSV: {e}")
+
 def extract_rows_from_csv(file_content: bytes) -> List[Dict[str, Any]]:
     """
     Extract rows from a CSV file as a list of dictionaries.
@@ -186,11 +518,4 @@ def extract_rows_from_csv(file_content: bytes) -> List[Dict[str, Any]]:
     Returns:
         List[Dict[str, Any]]: List of row data as dictionaries
     """
-    try:
-        # Decode the CSV content
-        text_content = file_content.decode('utf-8', errors='replace')
-        csv_reader = csv.DictReader(io.StringIO(text_content))
-        return list(csv_reader)
-    except Exception as e:
-        print(f"Error extracting rows from CSV: {e}")
-        return []    
+    return list(iter_rows_from_csv(file_content))
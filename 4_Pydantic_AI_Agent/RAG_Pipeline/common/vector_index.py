@@ -0,0 +1,233 @@
+from typing import Dict, Any, Optional
+import argparse
+import json
+import math
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from db_handler import get_db_connection
+
+# Name of the approximate nearest neighbor index on documents.embedding (also created by sql/documents.sql)
+VECTOR_INDEX_NAME = "documents_embedding_idx"
+VECTOR_INDEX_METHODS = ("hnsw", "ivfflat")
+
+# pgvector's defaults for HNSW
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 64
+
+def recommended_lists(row_count: int) -> int:
+    """
+    Get the number of IVFFlat lists pgvector recommends for a table size:
+    rows / 1000 up to 1M rows and sqrt(rows) beyond that.
+
+    Args:
+        row_count: Number of rows in the table
+
+    Returns:
+        int: Number of lists (at least 1)
+    """
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+def build_index_sql(method: str, index_name: str = VECTOR_INDEX_NAME, m: int = DEFAULT_M,
+                    ef_construction: int = DEFAULT_EF_CONSTRUCTION, lists: int = 100,
+                    concurrently: bool = True, table: str = "documents", column: str = "embedding") -> str:
+    """
+    Get the CREATE INDEX statement for a cosine distance vector index.
+
+    Args:
+        method: "hnsw" or "ivfflat"
+        index_name: Name of the index
+        m: HNSW: maximum number of connections per layer
+        ef_construction: HNSW: size of the candidate list while building
+        lists: IVFFlat: number of inverted lists
+        concurrently: Build without locking out writes (can't run in a transaction)
+        table: The table to index
+        column: The vector column
+
+    Returns:
+        str: The SQL statement
+    """
+    if method == "hnsw":
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    elif method == "ivfflat":
+        options = f"lists = {int(lists)}"
+    else:
+        raise ValueError(f"Unsupported vector index method: {method} (use one of {', '.join(VECTOR_INDEX_METHODS)})")
+
+    concurrently_sql = " CONCURRENTLY" if concurrently else ""
+    return (
+        f"CREATE INDEX{concurrently_sql} {index_name} ON {table} "
+        f"USING {method} ({column} vector_cosine_ops) WITH ({options})"
+    )
+
+def get_vector_index(connection=None) -> Optional[Dict[str, Any]]:
+    """
+    Get the vector index on documents.embedding with the parameters it was built with.
+
+    Args:
+        connection: Optional open connection to reuse, one is opened (and closed) if not given
+
+    Returns:
+        Dict with the index definition and build parameters, or None if there is no index
+    """
+    owns_connection = connection is None
+    conn = connection or get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexdef, obj_description(format('%%I.%%I', schemaname, indexname)::regclass, 'pg_class') "
+                "FROM pg_indexes WHERE tablename = 'documents' AND indexname = %s",
+                (VECTOR_INDEX_NAME,)
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+
+        definition, comment = row
+        index = {"definition": definition}
+        # Build parameters are kept in the index comment (indexes from sql/documents.sql have none)
+        if comment:
+            try:
+                index.update(json.loads(comment))
+            except ValueError:
+                pass
+        index.setdefault("method", "ivfflat" if "USING ivfflat" in definition else "hnsw")
+        return index
+    finally:
+        if owns_connection:
+            conn.close()
+
+def create_vector_index(method: str = "hnsw", m: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+                        lists: Optional[int] = None, maintenance_work_mem: Optional[str] = None,
+                        connection=None) -> Dict[str, Any]:
+    """
+    Build (or rebuild) the vector index on documents.embedding.
+
+    The new index is built concurrently under a temporary name and swapped in for the old one, so
+    searches keep using an index and ingestion isn't blocked while it builds.
+
+    Args:
+        method: "hnsw" or "ivfflat"
+        m: HNSW: maximum number of connections per layer
+        ef_construction: HNSW: size of the candidate list while building
+        lists: IVFFlat: number of inverted lists (defaults to the recommendation for the row count)
+        maintenance_work_mem: Optional memory for the build (e.g. "2GB"), HNSW builds are much faster if the graph fits
+        connection: Optional open connection to reuse, one is opened (and closed) if not given
+
+    Returns:
+        Dict with the build parameters
+    """
+    if method not in VECTOR_INDEX_METHODS:
+        raise ValueError(f"Unsupported vector index method: {method} (use one of {', '.join(VECTOR_INDEX_METHODS)})")
+
+    owns_connection = connection is None
+    conn = connection or get_db_connection()
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM documents")
+            row_count = cursor.fetchone()[0]
+
+            params: Dict[str, Any] = {"method": method, "row_count": row_count}
+            if method == "hnsw":
+                params.update({"m": m, "ef_construction": ef_construction})
+            else:
+                params["lists"] = lists or recommended_lists(row_count)
+
+            if maintenance_work_mem:
+                cursor.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+
+            temp_name = f"{VECTOR_INDEX_NAME}_new"
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {temp_name}")
+            print(f"Building {method} index on documents.embedding ({row_count} rows)...")
+            cursor.execute(build_index_sql(method, temp_name, m=m, ef_construction=ef_construction,
+                                           lists=params.get("lists", 100)))
+
+            # Swap the new index in
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}")
+            cursor.execute(f"ALTER INDEX {temp_name} RENAME TO {VECTOR_INDEX_NAME}")
+            cursor.execute(f"COMMENT ON INDEX {VECTOR_INDEX_NAME} IS %s", (json.dumps(params),))
+            cursor.execute("ANALYZE documents")
+
+        print(f"Created {method} index {VECTOR_INDEX_NAME} with {params}")
+        return params
+    finally:
+        if owns_connection:
+            conn.close()
+
+def maintain_vector_index(growth_factor: float = 2.0, connection=None) -> str:
+    """
+    Keep the vector index in line with the table.
+
+    Creates the default HNSW index if there is none. IVFFlat lists are trained on the rows present
+    at build time, so an IVFFlat index is rebuilt with the recommended number of lists once the
+    table has grown or shrunk by more than growth_factor since the last build. HNSW indexes stay
+    accurate as rows are added and only get their statistics refreshed.
+
+    Args:
+        growth_factor: Change in row count (either way) that triggers an IVFFlat rebuild
+        connection: Optional open connection to reuse, one is opened (and closed) if not given
+
+    Returns:
+        str: What was done ("created", "rebuilt" or "analyzed")
+    """
+    owns_connection = connection is None
+    conn = connection or get_db_connection()
+    # Rebuilds run concurrently, which needs autocommit before any statement opens a transaction
+    conn.autocommit = True
+    try:
+        index = get_vector_index(conn)
+        if index is None:
+            create_vector_index("hnsw", connection=conn)
+            return "created"
+
+        if index["method"] == "ivfflat":
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM documents")
+                row_count = cursor.fetchone()[0]
+
+            built_with = max(1, index.get("row_count", 0))
+            if max(row_count, 1) / built_with > growth_factor or built_with / max(row_count, 1) > growth_factor:
+                print(f"documents grew from {built_with} to {row_count} rows since the IVFFlat index was built")
+                create_vector_index("ivfflat", connection=conn)
+                return "rebuilt"
+
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE documents")
+        return "analyzed"
+    finally:
+        if owns_connection:
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the approximate nearest neighbor index on documents.embedding (uses DATABASE_URL)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    create_parser = subparsers.add_parser('create', help='Build or rebuild the index')
+    create_parser.add_argument('--method', choices=VECTOR_INDEX_METHODS, default='hnsw', help='Index type')
+    create_parser.add_argument('--m', type=int, default=DEFAULT_M, help='HNSW: connections per layer')
+    create_parser.add_argument('--ef-construction', type=int, default=DEFAULT_EF_CONSTRUCTION, help='HNSW: candidate list size while building')
+    create_parser.add_argument('--lists', type=int, default=None, help='IVFFlat: number of lists (default: based on the row count)')
+    create_parser.add_argument('--maintenance-work-mem', type=str, default=None, help='Memory for the build, e.g. 2GB')
+
+    maintain_parser = subparsers.add_parser('maintain', help='Create a missing index and rebuild IVFFlat indexes after large changes')
+    maintain_parser.add_argument('--growth-factor', type=float, default=2.0, help='Row count change that triggers an IVFFlat rebuild')
+
+    subparsers.add_parser('show', help='Show the current index')
+
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create_vector_index(args.method, m=args.m, ef_construction=args.ef_construction, lists=args.lists,
+                            maintenance_work_mem=args.maintenance_work_mem)
+    elif args.command == 'maintain':
+        print(f"Vector index {maintain_vector_index(args.growth_factor)}")
+    else:
+        print(json.dumps(get_vector_index(), indent=2))
+
+if __name__ == "__main__":
+    main()
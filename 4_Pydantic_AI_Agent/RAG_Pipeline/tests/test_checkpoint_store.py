@@ -0,0 +1,94 @@
+import pytest
+import json
+import os
+import sys
+from unittest.mock import patch
+
+# Add the parent directory to sys.path to import the modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.checkpoint_store import CheckpointStore, CHECKPOINT_VERSION, get_checkpoint_path
+
+class TestCheckpointStore:
+    @pytest.fixture
+    def path(self, tmp_path):
+        return str(tmp_path / "state" / "checkpoint.json")
+    
+    def test_round_trip_per_source(self, path):
+        """Test values are stored per source and survive reopening"""
+        store = CheckpointStore(path, flush_interval_seconds=0)
+        store.set("local:/data", "last_check_time", "2025-01-01T00:00:00.000000Z")
+        store.set("drive:root", "page_token", "123")
+        
+        reopened = CheckpointStore(path)
+        
+        assert reopened.get("local:/data", "last_check_time") == "2025-01-01T00:00:00.000000Z"
+        assert reopened.get("drive:root", "page_token") == "123"
+        assert reopened.get("drive:root", "last_check_time") is None
+        assert reopened.get("drive:other", "page_token", "default") == "default"
+    
+    def test_versioned_layout(self, path):
+        """Test the file records its schema version"""
+        store = CheckpointStore(path, flush_interval_seconds=0)
+        store.set("source", "key", "value")
+        
+        with open(path) as f:
+            data = json.load(f)
+        
+        assert data['version'] == CHECKPOINT_VERSION
+        assert data['sources'] == {"source": {"key": "value"}}
+        assert 'updated_at' in data
+    
+    def test_unsupported_version_ignored(self, path, capfd):
+        """Test a checkpoint written with another layout version isn't used"""
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump({"version": CHECKPOINT_VERSION + 1, "sources": {"source": {"key": "value"}}}, f)
+        
+        store = CheckpointStore(path)
+        
+        assert store.get("source", "key") is None
+        assert "unsupported version" in capfd.readouterr().out
+    
+    def test_corrupt_file_ignored(self, path, capfd):
+        """Test an unreadable checkpoint leaves the state empty instead of crashing"""
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('{"version": 1, "sour')
+        
+        store = CheckpointStore(path)
+        
+        assert store.sources == {}
+        assert "Error loading checkpoint" in capfd.readouterr().out
+    
+    def test_writes_are_batched(self, path):
+        """Test changes are only written once the flush interval has passed or on flush"""
+        store = CheckpointStore(path, flush_interval_seconds=3600)
+        store.set("source", "key", "value")
+        
+        assert not os.path.exists(path)
+        assert store.flush()
+        assert CheckpointStore(path).get("source", "key") == "value"
+    
+    def test_failed_write_keeps_previous_checkpoint(self, path):
+        """Test a failed write leaves the last complete checkpoint in place"""
+        store = CheckpointStore(path, flush_interval_seconds=0)
+        store.set("source", "key", "old")
+        
+        with patch('os.replace', side_effect=OSError("disk full")):
+            store.set("source", "key", "new")
+            assert not store.flush()
+        
+        assert CheckpointStore(path).get("source", "key") == "old"
+        # The change is still pending and gets written by the next flush
+        assert store.flush()
+        assert CheckpointStore(path).get("source", "key") == "new"
+
+class TestGetCheckpointPath:
+    def test_default_next_to_config(self, tmp_path):
+        """Test the checkpoint defaults to checkpoint.json next to the config file"""
+        config_path = str(tmp_path / "config.json")
+        assert get_checkpoint_path({}, config_path) == str(tmp_path / "checkpoint.json")
+    
+    def test_configured_path(self, tmp_path):
+        """Test the checkpoint path can be set in the config"""
+        assert get_checkpoint_path({"checkpoint_path": "/state/cp.json"}, str(tmp_path / "config.json")) == "/state/cp.json"
@@ -0,0 +1,132 @@
+import pytest
+from unittest.mock import patch
+import os
+import sys
+
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+
+# Add the parent directory to sys.path to import the modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.chunking import (
+    chunk_by_tokens,
+    chunk_recursively,
+    chunk_by_headings,
+    chunk_with_strategy,
+    get_chunking_strategy,
+    HTML_HEADING_PATTERN
+)
+
+@pytest.fixture
+def tokenizer_path(tmp_path):
+    """A word level tokenizer saved locally so the tests don't download one"""
+    vocab = {"[UNK]": 0}
+    for word in ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "."]:
+        vocab[word] = len(vocab)
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(path))
+    return str(path)
+
+class TestChunkByTokens:
+    def test_fixed_token_windows(self, tokenizer_path):
+        """Test that chunks hold a fixed number of tokens and keep the original text"""
+        text = "one two three four five six seven"
+        result = chunk_by_tokens(text, chunk_size=3, tokenizer=tokenizer_path)
+        assert result == ["one two three", "four five six", "seven"]
+
+    def test_overlap(self, tokenizer_path):
+        """Test overlapping token windows"""
+        text = "one two three four five"
+        result = chunk_by_tokens(text, chunk_size=3, overlap=1, tokenizer=tokenizer_path)
+        assert result == ["one two three", "three four five"]
+
+    def test_spans_blocks(self, tokenizer_path):
+        """Test that windows continue across the blocks the text is tokenized in"""
+        text = "one two\nthree four\nfive six\n"
+        with patch('common.chunking.TOKENIZE_BLOCK_SIZE', 8):
+            result = chunk_by_tokens(text, chunk_size=4, tokenizer=tokenizer_path)
+        assert result == ["one two\nthree four", "five six"]
+
+    def test_empty_text(self, tokenizer_path):
+        assert chunk_by_tokens("", tokenizer=tokenizer_path) == []
+
+class TestChunkRecursively:
+    def test_keeps_paragraphs_together(self):
+        """Test that paragraphs that fit are not cut"""
+        text = "First paragraph.\n\nSecond paragraph.\n\nThird paragraph."
+        result = chunk_recursively(text, chunk_size=40)
+        assert result == ["First paragraph.\n\nSecond paragraph.\n\n", "Third paragraph."]
+
+    def test_splits_long_paragraphs_at_sentences(self):
+        """Test that paragraphs too long for a chunk are split at sentence boundaries"""
+        text = "Sentence one is here. Sentence two is here. Sentence three is here."
+        result = chunk_recursively(text, chunk_size=30)
+        assert result == ["Sentence one is here. ", "Sentence two is here. ", "Sentence three is here."]
+        assert "".join(result) == text
+
+    def test_chunks_never_exceed_size(self):
+        """Test that unbroken text is still cut to the chunk size"""
+        text = "word " * 50 + "x" * 120
+        result = chunk_recursively(text, chunk_size=50)
+        assert all(len(chunk) <= 50 for chunk in result)
+        assert "".join(result) == text
+
+    def test_overlap_repeats_trailing_pieces(self):
+        """Test that whole trailing pieces are repeated at the start of the next chunk"""
+        text = "aaaa bbbb cccc dddd"
+        result = chunk_recursively(text, chunk_size=10, overlap=5)
+        assert result == ["aaaa bbbb ", "bbbb cccc ", "cccc dddd"]
+
+class TestChunkByHeadings:
+    def test_markdown_sections(self):
+        """Test that chunks never cross a markdown heading"""
+        text = "Intro text\n# Title\nShort section\n## Sub\nAnother section"
+        result = chunk_by_headings(text, chunk_size=100)
+        assert result == ["Intro text\n", "# Title\nShort section\n", "## Sub\nAnother section"]
+
+    def test_long_sections_are_split(self):
+        """Test that long sections are split recursively within the section"""
+        text = "# Title\n" + "Sentence here. " * 10 + "\n# Next\nEnd"
+        result = chunk_by_headings(text, chunk_size=50)
+        assert all(len(chunk) <= 50 for chunk in result)
+        assert result[-1] == "# Next\nEnd"
+
+    def test_html_sections(self):
+        """Test splitting at HTML headings"""
+        text = "<p>Intro</p><h1>Title</h1><p>Body</p><h2 class='x'>Sub</h2><p>More</p>"
+        result = chunk_by_headings(text, chunk_size=100, pattern=HTML_HEADING_PATTERN)
+        assert result == ["<p>Intro</p>", "<h1>Title</h1><p>Body</p>", "<h2 class='x'>Sub</h2><p>More</p>"]
+
+class TestChunkWithStrategy:
+    def test_default_is_fixed(self):
+        """Test that the fixed size strategy is used without configuration"""
+        assert get_chunking_strategy({}) == 'fixed'
+        assert chunk_with_strategy("A" * 500, {"default_chunk_size": 400}) == ["A" * 400, "A" * 100]
+
+    def test_mime_type_strategies(self):
+        """Test per mime type strategy overrides"""
+        settings = {"chunking_strategy": "recursive", "mime_type_strategies": {"text/html": "html", "text/markdown": "markdown"}}
+        assert get_chunking_strategy(settings, "text/html") == 'html'
+        assert get_chunking_strategy(settings, "text/markdown") == 'markdown'
+        assert get_chunking_strategy(settings, "text/plain") == 'recursive'
+        assert get_chunking_strategy(settings) == 'recursive'
+
+    def test_token_strategy(self, tokenizer_path):
+        settings = {"chunking_strategy": "token", "tokenizer": tokenizer_path, "token_chunk_size": 2}
+        assert chunk_with_strategy("one two three", settings) == ["one two", "three"]
+
+    def test_token_strategy_falls_back_without_tokenizer(self, capfd):
+        """Test that a tokenizer that can't be loaded falls back to recursive chunking"""
+        settings = {"chunking_strategy": "token", "tokenizer": "/missing/tokenizer.json", "default_chunk_size": 10}
+        with patch('common.chunking.Tokenizer.from_pretrained', side_effect=Exception("not found")):
+            result = chunk_with_strategy("aaaa bbbb cccc", settings)
+        assert result == ["aaaa bbbb ", "cccc"]
+        assert "falling back to recursive chunking" in capfd.readouterr().out
+
+    def test_unknown_strategy(self, capfd):
+        result = chunk_with_strategy("A" * 10, {"chunking_strategy": "semantic", "default_chunk_size": 5})
+        assert result == ["A" * 5, "A" * 5]
+        assert "Unknown chunking strategy 'semantic'" in capfd.readouterr().out
@@ -1,4 +1,5 @@
 import pytest
+import hashlib
 from unittest.mock import patch, MagicMock, call
 import os
 import sys
@@ -23,8 +24,18 @@ with patch.dict(os.environ, {
             insert_document_chunks,
             insert_or_update_document_metadata,
             insert_document_rows,
-            process_file_for_rag
+            process_file_for_rag,
+            copy_rows,
+            _CsvRowStream,
+            diff_document_chunks,
+            update_document_chunks,
+            chunk_file_text,
+            materialize_dataset_table,
+            drop_dataset_table,
+            chunk_version,
+            get_file_filter_metadata
         )
+        from common.embedding_cache import hash_text
 
 # Create a mock for supabase client
 @pytest.fixture
@@ -106,10 +117,13 @@ class TestInsertDocumentChunks:
         
         # Assertions
         mock_supabase.table.assert_called_with("documents")
-        assert mock_table.insert.call_count == 2
+        # Both chunks go out in a single multi-row request
+        assert mock_table.insert.call_count == 1
+        rows = mock_table.insert.call_args[0][0]
+        assert len(rows) == 2
         
-        # Check first chunk insertion
-        first_call_args = mock_table.insert.call_args_list[0][0][0]
+        # Check first chunk
+        first_call_args = rows[0]
         assert first_call_args["content"] == "Chunk 1"
         assert first_call_args["embedding"] == [0.1, 0.2]
         assert first_call_args["metadata"]["file_id"] == "file123"
@@ -117,12 +131,69 @@ class TestInsertDocumentChunks:
         assert first_call_args["metadata"]["file_title"] == "Test File"
         assert first_call_args["metadata"]["chunk_index"] == 0
         
-        # Check second chunk insertion
-        second_call_args = mock_table.insert.call_args_list[1][0][0]
+        # Check second chunk
+        second_call_args = rows[1]
         assert second_call_args["content"] == "Chunk 2"
         assert second_call_args["embedding"] == [0.3, 0.4]
         assert second_call_args["metadata"]["chunk_index"] == 1
     
+    @patch('common.db_handler.supabase')
+    def test_file_metadata_on_every_chunk(self, mock_supabase):
+        """Test that the folder and modified time are stored on every chunk for filtered retrieval"""
+        mock_table = MagicMock()
+        mock_supabase.table.return_value = mock_table
+        file_metadata = {"folder": "folder1", "modified_time": "2024-01-31T10:00:00Z"}
+        
+        insert_document_chunks(["Chunk 1", "Chunk 2"], [[0.1], [0.2]], "file123", "https://example.com/file123",
+                               "Test File", "text/plain", file_metadata=file_metadata)
+        
+        rows = mock_table.insert.call_args[0][0]
+        for i, row in enumerate(rows):
+            assert row["metadata"]["folder"] == "folder1"
+            assert row["metadata"]["modified_time"] == "2024-01-31T10:00:00Z"
+            assert row["metadata"]["chunk_index"] == i
+    
+    @patch('common.db_handler.supabase')
+    def test_batches_and_reports_failures(self, mock_supabase, capfd):
+        """Test chunks are split into batches and failed batches are reported"""
+        chunks = [f"Chunk {i}" for i in range(5)]
+        embeddings = [[float(i)] for i in range(5)]
+        
+        mock_table = MagicMock()
+        mock_supabase.table.return_value = mock_table
+        # The second batch fails, the others succeed
+        mock_table.insert.return_value.execute.side_effect = [MagicMock(), Exception("Payload too large"), MagicMock()]
+        
+        result = insert_document_chunks(chunks, embeddings, "file123", "https://example.com", "Test File",
+                                        "text/plain", batch_size=2, mode="batch")
+        
+        assert result is False
+        assert mock_table.insert.call_count == 3
+        assert [len(call_args[0][0]) for call_args in mock_table.insert.call_args_list] == [2, 2, 1]
+        
+        captured = capfd.readouterr()
+        assert "Error inserting document chunks 2-3 for file ID file123: Payload too large" in captured.out
+        assert "Failed to insert 1 of 3 chunk batches" in captured.out
+    
+    @patch('common.db_handler.copy_rows')
+    @patch('common.db_handler.supabase')
+    def test_copy_mode(self, mock_supabase, mock_copy_rows):
+        """Test the COPY based bulk load path"""
+        mock_copy_rows.return_value = 2
+        
+        result = insert_document_chunks(["Chunk 1", "Chunk 2"], [[0.1, 0.2], [0.3, 0.4]], "file123",
+                                        "https://example.com", "Test File", "text/plain", mode="copy")
+        
+        assert result is True
+        mock_supabase.table.assert_not_called()
+        table, columns, rows = mock_copy_rows.call_args[0]
+        assert table == "documents"
+        assert columns == ["content", "metadata", "embedding"]
+        rows = list(rows)
+        assert rows[0][0] == "Chunk 1"
+        assert json.loads(rows[0][1])["chunk_index"] == 0
+        assert rows[1][2] == "[0.3, 0.4]"
+    
     def test_mismatch_error(self, capfd):
         """Test error when chunks and embeddings counts don't match"""
         chunks = ["Chunk 1", "Chunk 2"]
@@ -141,6 +212,181 @@ class TestInsertDocumentChunks:
             captured = capfd.readouterr()
             assert "Error inserting/updating document chunks: Number of chunks and embeddings must match" in captured.out
 
+class TestGetFileFilterMetadata:
+    def test_google_drive_file(self):
+        file = {"id": "abc", "parents": ["folder1"], "modifiedTime": "2024-01-31T10:00:00.000Z",
+                "webViewLink": "https://docs.google.com/abc"}
+        assert get_file_filter_metadata(file) == {"folder": "folder1", "folders": ["folder1"],
+                                                  "modified_time": "2024-01-31T10:00:00Z"}
+    
+    def test_google_drive_ancestors(self):
+        """Test that every parent of a Drive file and their ancestors are recorded"""
+        file = {"id": "abc", "parents": ["sub1", "other"], "webViewLink": "https://docs.google.com/abc"}
+        folder_parents = {"sub1": ["sub0"], "sub0": ["root"], "other": ["root"]}
+        assert get_file_filter_metadata(file, folder_parents) == {
+            "folder": "sub1", "folders": ["sub1", "other", "sub0", "root"]
+        }
+    
+    def test_local_file(self):
+        """Test that local files use their directory and get their modified time converted to UTC"""
+        file = {"id": "/data/docs/report.txt", "webViewLink": "file:///data/docs/report.txt",
+                "modifiedTime": "2024-01-31T10:00:00+02:00"}
+        assert get_file_filter_metadata(file) == {"folder": "/data/docs", "folders": ["/data/docs", "/data", "/"],
+                                                  "modified_time": "2024-01-31T08:00:00Z"}
+    
+    def test_missing_and_invalid_values(self, capfd):
+        assert get_file_filter_metadata({"id": "abc", "modifiedTime": "yesterday"}) == {}
+        assert "Unrecognized modified time" in capfd.readouterr().out
+
+class TestCopyRows:
+    def test_csv_row_stream(self):
+        """Test rows are rendered lazily as CSV in small reads"""
+        stream = _CsvRowStream([("a", '{"k": "v, w"}'), ("b", "[1, 2]")])
+        
+        data = ""
+        while True:
+            piece = stream.read(5)
+            if not piece:
+                break
+            data += piece
+        
+        assert data == 'a,"{""k"": ""v, w""}"\nb,"[1, 2]"\n'
+    
+    def test_copy_rows_commits(self):
+        """Test COPY is issued for the given columns and committed"""
+        mock_conn = MagicMock()
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_cursor.rowcount = 1
+        
+        result = copy_rows("documents", ["content", "metadata"], [("a", "{}")], connection=mock_conn)
+        
+        assert result == 1
+        sql = mock_cursor.copy_expert.call_args[0][0]
+        assert sql == "COPY documents (content, metadata) FROM STDIN WITH (FORMAT csv)"
+        mock_conn.commit.assert_called_once()
+        mock_conn.close.assert_not_called()
+    
+    def test_copy_rows_rolls_back_on_error(self):
+        """Test a failed COPY is rolled back and the error is raised"""
+        mock_conn = MagicMock()
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_cursor.copy_expert.side_effect = Exception("COPY failed")
+        
+        with pytest.raises(Exception, match="COPY failed"):
+            copy_rows("documents", ["content"], [("a",)], connection=mock_conn)
+        
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+class TestDiffDocumentChunks:
+    def stored(self, *rows):
+        return [{"id": row_id, "chunk_index": str(index), "chunk_hash": hash_text(text)} for row_id, index, text in rows]
+    
+    def test_unchanged(self):
+        """Test an unchanged document produces an empty diff"""
+        stored = self.stored((1, 0, "A"), (2, 1, "B"))
+        assert diff_document_chunks(stored, ["A", "B"]) == ([], [], [])
+    
+    def test_changed_chunk(self):
+        """Test a changed chunk is deleted and its replacement added"""
+        stored = self.stored((1, 0, "A"), (2, 1, "B"), (3, 2, "C"))
+        assert diff_document_chunks(stored, ["A", "B2", "C"]) == ([2], [], [1])
+    
+    def test_moved_and_removed_chunks(self):
+        """Test chunks that moved are re-indexed and removed chunks are deleted"""
+        stored = self.stored((1, 0, "A"), (2, 1, "B"), (3, 2, "C"))
+        delete_ids, reindex, added = diff_document_chunks(stored, ["New", "A", "C"])
+        assert delete_ids == [2]
+        # "C" stays at index 2, "A" moved from 0 to 1
+        assert reindex == [{"id": 1, "chunk_index": 1}]
+        assert added == [0]
+    
+    def test_legacy_rows_without_hash(self):
+        """Test rows stored before hashes existed are replaced"""
+        stored = [{"id": 1, "chunk_index": "0", "chunk_hash": None}]
+        assert diff_document_chunks(stored, ["A"]) == ([1], [], [0])
+    
+    def test_duplicate_chunks(self):
+        """Test each stored row matches at most one new chunk"""
+        stored = self.stored((1, 0, "A"))
+        assert diff_document_chunks(stored, ["A", "A"]) == ([], [], [1])
+
+class TestUpdateDocumentChunks:
+    @patch('common.db_handler.create_embeddings_with_cache')
+    @patch('common.db_handler.supabase')
+    def test_applies_diff_in_one_call(self, mock_supabase, mock_embed, capfd):
+        """Test only added chunks are embedded and the diff is applied atomically"""
+        select = mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.range.return_value
+        select.execute.return_value.data = [
+            {"id": 1, "chunk_index": "0", "chunk_hash": hash_text("A")},
+            {"id": 2, "chunk_index": "1", "chunk_hash": hash_text("B")}
+        ]
+        mock_embed.return_value = [[0.5]]
+        
+        result = update_document_chunks(["A", "C"], "file123", "https://example.com", "Test File", "text/plain")
+        
+        assert result is True
+        mock_embed.assert_called_once_with(["C"])
+        mock_supabase.table.return_value.delete.assert_not_called()
+        name, params = mock_supabase.rpc.call_args[0]
+        assert name == "apply_document_chunk_diff"
+        assert params["p_file_id"] == "file123"
+        assert params["p_delete_ids"] == [2]
+        assert params["p_reindex"] == []
+        assert len(params["p_new_chunks"]) == 1
+        new_chunk = params["p_new_chunks"][0]
+        assert new_chunk["content"] == "C"
+        assert new_chunk["embedding"] == [0.5]
+        assert new_chunk["metadata"]["chunk_index"] == 1
+        assert new_chunk["metadata"]["chunk_hash"] == hash_text("C")
+        # The RPC gets the version the diff was computed against, so it can reject a stale diff
+        expected = hashlib.md5(f"1:{hash_text('A')}\n2:{hash_text('B')}".encode('utf-8')).hexdigest()
+        assert params["p_expected_version"] == expected
+        
+        captured = capfd.readouterr()
+        assert "1 kept (0 moved), 1 removed, 1 added" in captured.out
+    
+    @patch('common.db_handler.create_embeddings_with_cache')
+    @patch('common.db_handler.supabase')
+    def test_stale_diff_is_recomputed(self, mock_supabase, mock_embed, capfd):
+        """Test that a diff rejected as stale is computed again from the current chunks"""
+        select = mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.range.return_value
+        select.execute.side_effect = [
+            MagicMock(data=[{"id": 1, "chunk_index": "0", "chunk_hash": hash_text("A")}]),
+            MagicMock(data=[{"id": 3, "chunk_index": "0", "chunk_hash": hash_text("B")}])
+        ]
+        mock_embed.side_effect = lambda chunks: [[0.5]] * len(chunks)
+        mock_supabase.rpc.return_value.execute.side_effect = [Exception("Stale chunk diff for file file123"), MagicMock()]
+        
+        result = update_document_chunks(["B"], "file123", "https://example.com", "Test File", "text/plain")
+        
+        assert result is True
+        assert mock_supabase.rpc.call_count == 2
+        params = mock_supabase.rpc.call_args_list[1][0][1]
+        assert params["p_delete_ids"] == []
+        assert params["p_new_chunks"] == []
+        assert params["p_expected_version"] == chunk_version([{"id": 3, "chunk_hash": hash_text("B")}])
+        assert "changed while updating, diffing again" in capfd.readouterr().out
+    
+    def test_chunk_version(self):
+        """Test the version is independent of the order the chunks were read in"""
+        rows = [{"id": 2, "chunk_hash": "b"}, {"id": 10, "chunk_hash": None}, {"id": 1, "chunk_hash": "a"}]
+        
+        assert chunk_version(rows) == hashlib.md5(b"1:a\n2:b\n10:").hexdigest()
+        assert chunk_version([]) == hashlib.md5(b"").hexdigest()
+    
+    @patch('common.db_handler.supabase')
+    def test_error_handling(self, mock_supabase, capfd):
+        """Test errors are reported and nothing is half applied"""
+        mock_supabase.table.side_effect = Exception("DB error")
+        
+        result = update_document_chunks(["A"], "file123", "https://example.com", "Test File", "text/plain")
+        
+        assert result is False
+        mock_supabase.rpc.assert_not_called()
+        captured = capfd.readouterr()
+        assert "Error updating document chunks: DB error" in captured.out
+
 class TestInsertOrUpdateDocumentMetadata:
     @patch('common.db_handler.supabase')
     def test_insert_new_record(self, mock_supabase, capfd):
@@ -241,18 +487,17 @@ class TestInsertDocumentRows:
         mock_table.delete.assert_called_once()
         mock_table.delete.return_value.eq.assert_called_once_with("dataset_id", "file123")
         
-        # Should insert new rows
-        assert mock_table.insert.call_count == 2
+        # Should insert both rows in a single request
+        assert mock_table.insert.call_count == 1
+        inserted_rows = mock_table.insert.call_args[0][0]
         
-        # Check first row insertion
-        first_call_args = mock_table.insert.call_args_list[0][0][0]
-        assert first_call_args["dataset_id"] == "file123"
-        assert first_call_args["row_data"] == {"name": "John", "age": 30}
+        # Check first row
+        assert inserted_rows[0]["dataset_id"] == "file123"
+        assert inserted_rows[0]["row_data"] == {"name": "John", "age": 30}
         
-        # Check second row insertion
-        second_call_args = mock_table.insert.call_args_list[1][0][0]
-        assert second_call_args["dataset_id"] == "file123"
-        assert second_call_args["row_data"] == {"name": "Jane", "age": 25}
+        # Check second row
+        assert inserted_rows[1]["dataset_id"] == "file123"
+        assert inserted_rows[1]["row_data"] == {"name": "Jane", "age": 25}
         
         # Should print success message
         captured = capfd.readouterr()
@@ -274,6 +519,147 @@ class TestInsertDocumentRows:
         captured = capfd.readouterr()
         assert "Error inserting document rows: DB error" in captured.out
 
+    @patch('common.db_handler.supabase')
+    def test_streams_generator_in_batches(self, mock_supabase, capfd):
+        """Test rows from a generator are consumed lazily in bounded batches"""
+        mock_table = MagicMock()
+        mock_supabase.table.return_value = mock_table
+        consumed = []
+        
+        def row_generator():
+            for i in range(5):
+                consumed.append(i)
+                yield {"n": i}
+        
+        batch_sizes = []
+        def record_insert(batch):
+            # Rows past the current batch must not have been read yet
+            batch_sizes.append((len(batch), len(consumed)))
+            return MagicMock()
+        mock_table.insert.side_effect = record_insert
+        
+        result = insert_document_rows("file123", row_generator(), batch_size=2, mode="batch")
+        
+        assert result is True
+        assert batch_sizes == [(2, 2), (2, 4), (1, 5)]
+        captured = capfd.readouterr()
+        assert "Inserted 5 rows for file ID: file123" in captured.out
+    
+    @patch('common.db_handler.supabase')
+    def test_reports_failed_batches(self, mock_supabase, capfd):
+        """Test a failed batch is reported with its row range"""
+        mock_table = MagicMock()
+        mock_supabase.table.return_value = mock_table
+        mock_table.insert.return_value.execute.side_effect = [Exception("Timeout"), MagicMock()]
+        
+        result = insert_document_rows("file123", [{"n": i} for i in range(3)], batch_size=2, mode="batch")
+        
+        assert result is False
+        captured = capfd.readouterr()
+        assert "Error inserting document rows 0-1 for file ID file123: Timeout" in captured.out
+        assert "Inserted 1 rows for file ID: file123" in captured.out
+    
+    @patch('common.db_handler.copy_rows')
+    @patch('common.db_handler.supabase')
+    def test_copy_mode(self, mock_supabase, mock_copy_rows):
+        """Test the COPY based row loader"""
+        mock_copy_rows.return_value = 2
+        
+        result = insert_document_rows("file123", iter([{"a": "1"}, {"a": "2"}]), mode="copy")
+        
+        assert result is True
+        mock_supabase.table.return_value.insert.assert_not_called()
+        table, columns, rows = mock_copy_rows.call_args[0]
+        assert table == "document_rows"
+        assert columns == ["dataset_id", "row_data"]
+        assert list(rows) == [("file123", '{"a": "1"}'), ("file123", '{"a": "2"}')]
+
+class TestMaterializeDatasetTable:
+    @patch('common.db_handler.supabase')
+    def test_materializes_typed_columns(self, mock_supabase, capfd):
+        """Test creating the typed table with Postgres types and indexes on the given columns"""
+        table = {"table": "datasets.dataset_abc", "columns": {"region": "region", "sales": "sales", "year": "year"}}
+        mock_supabase.rpc.return_value.execute.return_value.data = table
+        
+        result = materialize_dataset_table("file123", {"region": "text", "sales": "number", "year": "integer"}, ["region"])
+        
+        assert result == table
+        mock_supabase.rpc.assert_called_once_with("materialize_dataset", {
+            "p_dataset_id": "file123",
+            "p_columns": [
+                {"name": "region", "type": "text", "index": True},
+                {"name": "sales", "type": "double precision", "index": False},
+                {"name": "year", "type": "bigint", "index": False}
+            ]
+        })
+        assert "Materialized typed table datasets.dataset_abc for file ID: file123" in capfd.readouterr().out
+
+    @patch('common.db_handler.supabase')
+    def test_reports_renamed_columns(self, mock_supabase, capfd):
+        """Test that columns renamed to avoid clashes are reported"""
+        mock_supabase.rpc.return_value.execute.return_value.data = {
+            "table": "datasets.dataset_abc", "columns": {"row_id": "row_id_2", "sales": "sales"}
+        }
+        
+        materialize_dataset_table("file123", {"row_id": "integer", "sales": "number"})
+        
+        assert "(renamed columns: {'row_id': 'row_id_2'})" in capfd.readouterr().out
+
+    @patch('common.db_handler.supabase')
+    def test_error_handling(self, mock_supabase, capfd):
+        mock_supabase.rpc.return_value.execute.side_effect = Exception("function does not exist")
+        
+        assert materialize_dataset_table("file123", {"a": "text"}) is None
+        assert "Error materializing typed table for file ID file123: function does not exist" in capfd.readouterr().out
+
+class TestDropDatasetTable:
+    @patch('common.db_handler.supabase')
+    def test_drops_typed_table(self, mock_supabase):
+        drop_dataset_table("file123")
+        
+        mock_supabase.rpc.assert_called_once_with("drop_dataset", {"p_dataset_id": "file123"})
+
+    @patch('common.db_handler.supabase')
+    def test_error_handling(self, mock_supabase, capfd):
+        mock_supabase.rpc.return_value.execute.side_effect = Exception("function does not exist")
+        
+        drop_dataset_table("file123")
+        assert "Error dropping typed table for file ID file123: function does not exist" in capfd.readouterr().out
+
+class TestChunkFileText:
+    @patch('common.db_handler.chunk_text')
+    def test_fixed_strategy(self, mock_chunk_text):
+        """Test that the default strategy chunks with the configured size and overlap"""
+        mock_chunk_text.return_value = ["chunk"]
+        config = {"text_processing": {"default_chunk_size": 100, "default_chunk_overlap": 10}}
+        
+        assert chunk_file_text("text", config) == ["chunk"]
+        mock_chunk_text.assert_called_once_with("text", chunk_size=100, overlap=10)
+
+    def test_fixed_strategy_streams_segments(self):
+        """Test that a stream of segments is chunked as it is read, without joining it first"""
+        config = {"text_processing": {"default_chunk_size": 4, "default_chunk_overlap": 0}}
+        
+        assert chunk_file_text(iter(["abc", "defg", "hi"]), config) == ["abcd", "efgh", "i"]
+
+    @patch('common.db_handler.chunk_with_strategy')
+    def test_configured_strategy_joins_segments(self, mock_chunk_with_strategy):
+        """Test that structure-aware strategies get the whole text of a stream of segments"""
+        mock_chunk_with_strategy.return_value = ["chunk"]
+        settings = {"chunking_strategy": "markdown"}
+        
+        assert chunk_file_text(iter(["# Title\n", "Body"]), {"text_processing": settings}) == ["chunk"]
+        mock_chunk_with_strategy.assert_called_once_with("# Title\nBody", settings, None)
+
+    @patch('common.db_handler.chunk_with_strategy')
+    def test_configured_strategy(self, mock_chunk_with_strategy):
+        """Test that other strategies are chosen by the text_processing settings and mime type"""
+        mock_chunk_with_strategy.return_value = ["chunk"]
+        settings = {"mime_type_strategies": {"text/html": "html"}}
+        
+        assert chunk_file_text("<h1>Title</h1>", {"text_processing": settings}, "text/html") == ["chunk"]
+        mock_chunk_with_strategy.assert_called_once_with("<h1>Title</h1>", settings, "text/html")
+
 class TestProcessFileForRag:
     @pytest.fixture
     def setup_mocks(self):
@@ -283,10 +669,9 @@ class TestProcessFileForRag:
              patch('common.db_handler.insert_document_rows') as mock_insert_rows, \
              patch('common.db_handler.insert_document_chunks') as mock_insert_chunks, \
              patch('common.db_handler.is_tabular_file') as mock_is_tabular, \
-             patch('common.db_handler.extract_schema_from_csv') as mock_extract_schema, \
-             patch('common.db_handler.extract_rows_from_csv') as mock_extract_rows, \
+             patch('common.db_handler.TabularFile') as mock_tabular_file, \
              patch('common.db_handler.chunk_text') as mock_chunk_text, \
-             patch('common.db_handler.create_embeddings') as mock_create_embeddings:
+             patch('common.db_handler.create_embeddings_with_cache') as mock_create_embeddings:
             
             yield {
                 'delete_document': mock_delete_document,
@@ -294,8 +679,7 @@ class TestProcessFileForRag:
                 'insert_rows': mock_insert_rows,
                 'insert_chunks': mock_insert_chunks,
                 'is_tabular': mock_is_tabular,
-                'extract_schema': mock_extract_schema,
-                'extract_rows': mock_extract_rows,
+                'tabular_file': mock_tabular_file,
                 'chunk_text': mock_chunk_text,
                 'create_embeddings': mock_create_embeddings
             }
@@ -327,13 +711,13 @@ class TestProcessFileForRag:
         mocks['delete_document'].assert_called_once_with(file_id)
         mocks['is_tabular'].assert_called_once_with(mime_type, {'text_processing': {'default_chunk_size': 400, 'default_chunk_overlap': 0}})
         mocks['insert_metadata'].assert_called_once_with(file_id, file_title, file_url, None)
-        mocks['extract_rows'].assert_not_called()
+        mocks['tabular_file'].assert_not_called()
         mocks['insert_rows'].assert_not_called()
         mocks['chunk_text'].assert_called_once_with(content, chunk_size=400, overlap=0)
         mocks['create_embeddings'].assert_called_once_with(["Chunk 1", "Chunk 2"])
         mocks['insert_chunks'].assert_called_once_with(
             ["Chunk 1", "Chunk 2"], [[0.1, 0.2], [0.3, 0.4]], 
-            file_id, file_url, file_title, mime_type
+            file_id, file_url, file_title, mime_type, file_metadata=None
         )
     
     def test_tabular_file(self, setup_mocks):
@@ -342,8 +726,8 @@ class TestProcessFileForRag:
         
         # Setup mocks
         mocks['is_tabular'].return_value = True
-        mocks['extract_schema'].return_value = ["col1", "col2"]
-        mocks['extract_rows'].return_value = [{"col1": "val1", "col2": "val2"}]
+        mocks['tabular_file'].return_value.column_types = {"col1": "text", "col2": "integer"}
+        mocks['tabular_file'].return_value.iter_rows.return_value = [{"col1": "val1", "col2": 2}]
         mocks['chunk_text'].return_value = ["Chunk 1", "Chunk 2"]
         mocks['create_embeddings'].return_value = [[0.1, 0.2], [0.3, 0.4]]
         
@@ -364,13 +748,82 @@ class TestProcessFileForRag:
         # Assertions
         mocks['delete_document'].assert_called_once_with(file_id)
         mocks['is_tabular'].assert_called_once_with(mime_type, {'text_processing': {'default_chunk_size': 400, 'default_chunk_overlap': 0}})
-        mocks['extract_schema'].assert_called_once_with(file_content)
-        mocks['insert_metadata'].assert_called_once_with(file_id, file_title, file_url, ["col1", "col2"])
-        mocks['extract_rows'].assert_called_once_with(file_content)
-        mocks['insert_rows'].assert_called_once_with(file_id, [{"col1": "val1", "col2": "val2"}])
+        mocks['tabular_file'].assert_called_once_with(file_content, mime_type)
+        mocks['insert_metadata'].assert_called_once_with(file_id, file_title, file_url, {"col1": "text", "col2": "integer"})
+        mocks['insert_rows'].assert_called_once_with(file_id, [{"col1": "val1", "col2": 2}])
         mocks['chunk_text'].assert_called_once_with(content, chunk_size=400, overlap=0)
         mocks['create_embeddings'].assert_called_once_with(["Chunk 1", "Chunk 2"])
         mocks['insert_chunks'].assert_called_once_with(
             ["Chunk 1", "Chunk 2"], [[0.1, 0.2], [0.3, 0.4]], 
-            file_id, file_url, file_title, mime_type
+            file_id, file_url, file_title, mime_type, file_metadata=None
         )
+    
+    def test_typed_tabular_storage(self, setup_mocks):
+        """Test that typed storage materializes the dataset after its rows are inserted"""
+        mocks = setup_mocks
+        mocks['is_tabular'].return_value = True
+        mocks['tabular_file'].return_value.column_types = {"region": "text", "sales": "number"}
+        mocks['tabular_file'].return_value.low_cardinality_columns.return_value = ["region"]
+        mocks['insert_rows'].return_value = True
+        mocks['chunk_text'].return_value = ["Chunk 1"]
+        config = {'tabular_storage': 'typed', 'typed_index_max_distinct': 50, 'text_processing': {}}
+        
+        calls = MagicMock()
+        mocks['insert_rows'].side_effect = lambda *args: bool(calls.insert_rows(*args))
+        with patch('common.db_handler.materialize_dataset_table', side_effect=calls.materialize) as mock_materialize, \
+             patch('common.db_handler.drop_dataset_table', side_effect=calls.drop):
+            process_file_for_rag(b'region,sales\nEU,1.5', "region,sales\nEU,1.5", "file123",
+                                 "https://example.com/file123", "Sales", "text/csv", config=config)
+        
+        mocks['tabular_file'].return_value.low_cardinality_columns.assert_called_once_with(50)
+        mock_materialize.assert_called_once_with("file123", {"region": "text", "sales": "number"}, ["region"])
+        # The typed table is dropped before the rows are reloaded so it isn't refreshed for every batch
+        assert [name for name, _, _ in calls.method_calls] == ["drop", "insert_rows", "materialize"]
+    
+    def test_typed_tabular_storage_failed_rows(self, setup_mocks):
+        """Test that a failed row reload leaves the dataset without a (stale) typed table"""
+        mocks = setup_mocks
+        mocks['is_tabular'].return_value = True
+        mocks['tabular_file'].return_value.column_types = {"region": "text"}
+        mocks['insert_rows'].return_value = False
+        mocks['chunk_text'].return_value = ["Chunk 1"]
+        config = {'tabular_storage': 'typed', 'update_mode': 'incremental', 'text_processing': {}}
+        
+        with patch('common.db_handler.materialize_dataset_table') as mock_materialize, \
+             patch('common.db_handler.drop_dataset_table') as mock_drop, \
+             patch('common.db_handler.update_document_chunks', return_value=True):
+            process_file_for_rag(b'region\nEU', "region\nEU", "file123", "https://example.com/file123",
+                                 "Sales", "text/csv", config=config)
+        
+        mock_drop.assert_called_once_with("file123")
+        mock_materialize.assert_not_called()
+    
+    def test_jsonb_tabular_storage_by_default(self, setup_mocks):
+        mocks = setup_mocks
+        mocks['is_tabular'].return_value = True
+        mocks['tabular_file'].return_value.column_types = {"region": "text"}
+        mocks['chunk_text'].return_value = ["Chunk 1"]
+        
+        with patch('common.db_handler.materialize_dataset_table') as mock_materialize:
+            process_file_for_rag(b'region\nEU', "region\nEU", "file123", "https://example.com/file123",
+                                 "Sales", "text/csv", config={'text_processing': {}})
+        
+        mock_materialize.assert_not_called()
+    
+    def test_incremental_update_mode(self, setup_mocks):
+        """Test incremental mode diffs the chunks instead of deleting the document"""
+        mocks = setup_mocks
+        mocks['is_tabular'].return_value = False
+        mocks['chunk_text'].return_value = ["Chunk 1", "Chunk 2"]
+        config = {'update_mode': 'incremental', 'text_processing': {}}
+        
+        with patch('common.db_handler.update_document_chunks', return_value=True) as mock_update:
+            result = process_file_for_rag(b'content', "Text content", "file123", "https://example.com/file123",
+                                          "Test File", "text/plain", config=config)
+        
+        assert result is True
+        mocks['delete_document'].assert_not_called()
+        mocks['create_embeddings'].assert_not_called()
+        mocks['insert_chunks'].assert_not_called()
+        mock_update.assert_called_once_with(["Chunk 1", "Chunk 2"], "file123", "https://example.com/file123",
+                                            "Test File", "text/plain", None)
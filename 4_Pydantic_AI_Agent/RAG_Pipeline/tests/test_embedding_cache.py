@@ -0,0 +1,77 @@
+import pytest
+import os
+import sys
+from unittest.mock import patch
+
+# Add the parent directory to sys.path to import the modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import embedding_cache
+from common.embedding_cache import EmbeddingCache, get_embedding_cache, hash_text
+
+class TestHashText:
+    def test_stable_hash(self):
+        """Test the same text always gets the same hash"""
+        assert hash_text("Some chunk") == hash_text("Some chunk")
+        assert hash_text("Some chunk") != hash_text("Some chunk.")
+        assert len(hash_text("")) == 64
+
+class TestEmbeddingCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "nested" / "cache.sqlite"))
+        yield cache
+        cache.close()
+    
+    def test_round_trip(self, cache):
+        """Test stored vectors are returned exactly"""
+        vector = [0.1, -0.2, 0.30000000000000004]
+        cache.put_many({"hash1": vector}, "text-embedding-3-small")
+        
+        result = cache.get_many(["hash1", "hash2"], "text-embedding-3-small")
+        
+        assert result == {"hash1": vector}
+    
+    def test_keyed_by_model(self, cache):
+        """Test vectors are only returned for the model they were created with"""
+        cache.put_many({"hash1": [1.0]}, "model-a")
+        
+        assert cache.get_many(["hash1"], "model-b") == {}
+        assert cache.get_many(["hash1"], "model-a") == {"hash1": [1.0]}
+    
+    def test_persists_across_instances(self, tmp_path):
+        """Test the cache survives reopening the database"""
+        path = str(tmp_path / "cache.sqlite")
+        first = EmbeddingCache(path)
+        first.put_many({"hash1": [1.0, 2.0]}, "model")
+        first.close()
+        
+        second = EmbeddingCache(path)
+        try:
+            assert second.get_many(["hash1"], "model") == {"hash1": [1.0, 2.0]}
+        finally:
+            second.close()
+    
+    def test_many_lookups(self, cache):
+        """Test lookups larger than one query batch"""
+        cache.put_many({f"hash{i}": [float(i)] for i in range(1200)}, "model")
+        
+        result = cache.get_many([f"hash{i}" for i in range(1200)], "model")
+        
+        assert len(result) == 1200
+        assert result["hash1199"] == [1199.0]
+
+class TestGetEmbeddingCache:
+    def test_disabled_with_empty_path(self):
+        """Test an empty EMBEDDING_CACHE_PATH disables caching"""
+        with patch.object(embedding_cache, '_embedding_cache', None), \
+             patch.dict(os.environ, {'EMBEDDING_CACHE_PATH': ''}):
+            assert get_embedding_cache() is None
+    
+    def test_opens_once(self, tmp_path):
+        """Test the shared cache is opened on first use and then reused"""
+        with patch.object(embedding_cache, '_embedding_cache', None), \
+             patch.dict(os.environ, {'EMBEDDING_CACHE_PATH': str(tmp_path / "cache.sqlite")}):
+            cache = get_embedding_cache()
+            assert cache is not None
+            assert get_embedding_cache() is cache
+            cache.close()
@@ -0,0 +1,64 @@
+import pytest
+import os
+import sys
+
+# Add the parent directory to sys.path to import the modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.file_manifest import FileManifest, hash_file_content
+
+class TestHashFileContent:
+    def test_stable_hash(self):
+        """Test the same content always gets the same hash"""
+        assert hash_file_content(b"content") == hash_file_content(b"content")
+        assert hash_file_content(b"content") != hash_file_content(b"content.")
+
+class TestFileManifest:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        return str(tmp_path / "nested" / "manifest.sqlite")
+    
+    def test_entries_persist(self, db_path):
+        """Test entries are loaded again when the manifest is reopened"""
+        manifest = FileManifest(db_path)
+        manifest.upsert_many({
+            "/data/a.txt": {"modified_time": "2025-01-01T00:00:00", "size": 10, "inode": 1, "content_hash": "abc"},
+            "/data/b.txt": {"modified_time": "2025-01-02T00:00:00", "size": 20, "inode": 2}
+        })
+        manifest.close()
+        
+        reopened = FileManifest(db_path)
+        
+        assert len(reopened) == 2
+        assert reopened.get("/data/a.txt") == {"modified_time": "2025-01-01T00:00:00", "size": 10, "inode": 1, "content_hash": "abc"}
+        assert reopened.get("/data/b.txt")["content_hash"] is None
+        assert reopened.modified_times() == {"/data/a.txt": "2025-01-01T00:00:00", "/data/b.txt": "2025-01-02T00:00:00"}
+        reopened.close()
+    
+    def test_upsert_replaces_entry(self, db_path):
+        """Test upserting an existing path replaces its entry"""
+        manifest = FileManifest(db_path)
+        manifest.upsert_many({"/data/a.txt": {"modified_time": "old", "size": 1, "inode": 1}})
+        manifest.upsert_many({"/data/a.txt": {"modified_time": "new", "size": 2, "inode": 1}})
+        manifest.close()
+        
+        reopened = FileManifest(db_path)
+        assert len(reopened) == 1
+        assert reopened.get("/data/a.txt")["modified_time"] == "new"
+        reopened.close()
+    
+    def test_remove_many(self, db_path):
+        """Test removed paths are gone from memory and the database, unknown paths are ignored"""
+        manifest = FileManifest(db_path)
+        manifest.upsert_many({
+            "/data/a.txt": {"modified_time": "t", "size": 1, "inode": 1},
+            "/data/b.txt": {"modified_time": "t", "size": 1, "inode": 2}
+        })
+        manifest.remove_many(["/data/a.txt", "/data/missing.txt"])
+        
+        assert "/data/a.txt" not in manifest
+        assert "/data/b.txt" in manifest
+        manifest.close()
+        
+        reopened = FileManifest(db_path)
+        assert list(reopened.modified_times()) == ["/data/b.txt"]
+        reopened.close()
@@ -0,0 +1,156 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import os
+import sys
+
+# Mock environment variables before importing modules that use them
+with patch.dict(os.environ, {
+    'SUPABASE_URL': 'https://test-supabase-url.com',
+    'SUPABASE_SERVICE_KEY': 'test-supabase-key'
+}):
+    # Mock the create_client function before it's used in db_handler
+    with patch('supabase.create_client') as mock_create_client:
+        mock_create_client.return_value = MagicMock()
+
+        # Add the parent directory to sys.path to import the modules
+        sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        from common.ingestion_pipeline import IngestionPipeline, run_ingestion_pipeline
+
+def make_files(count, mime_type='text/plain'):
+    return [
+        {'id': f'/data/file{i}.txt', 'name': f'file{i}.txt', 'mimeType': mime_type, 'webViewLink': f'file:///data/file{i}.txt'}
+        for i in range(count)
+    ]
+
+class TestIngestionPipeline:
+    @pytest.fixture
+    def config(self):
+        return {
+            "text_processing": {"default_chunk_size": 400, "default_chunk_overlap": 0},
+            "ingestion": {"extract_processes": 0, "queue_size": 2}
+        }
+
+    @pytest.fixture
+    def mocks(self):
+        with patch('common.ingestion_pipeline.extract_text_from_file') as mock_extract, \
+             patch('common.ingestion_pipeline.chunk_file_text') as mock_chunk, \
+             patch('common.ingestion_pipeline.create_embeddings_with_cache') as mock_embed, \
+             patch('common.ingestion_pipeline.store_file_for_rag') as mock_store:
+            mock_extract.side_effect = lambda content, mime_type, name, config: content.decode()
+            mock_chunk.side_effect = lambda text, config, mime_type: [text]
+            mock_embed.side_effect = lambda chunks: [[0.1] * 3 for _ in chunks]
+            mock_store.return_value = True
+            yield {'extract': mock_extract, 'chunk': mock_chunk, 'embed': mock_embed, 'store': mock_store}
+
+    def test_run_processes_all_files(self, config, mocks):
+        files = make_files(10)
+        results = run_ingestion_pipeline(files, lambda file: file['name'].encode(), config)
+
+        assert results == {file['id']: True for file in files}
+        assert mocks['store'].call_count == 10
+        # Each file is written with its own content, chunks and embeddings
+        stored = {c.args[3]: c.args for c in mocks['store'].call_args_list}
+        args = stored['/data/file3.txt']
+        assert args[0] == b'file3.txt'
+        assert args[1] == ['file3.txt']
+        assert args[2] == [[0.1] * 3]
+        assert args[4] == 'file:///data/file3.txt'
+        assert args[5] == 'file3.txt'
+
+    def test_uses_title_when_given(self, config, mocks):
+        files = [dict(make_files(1)[0], title='file0')]
+        run_ingestion_pipeline(files, lambda file: b'text', config)
+
+        assert mocks['store'].call_args.args[5] == 'file0'
+
+    def test_failures_are_isolated(self, config, mocks, capfd):
+        files = make_files(4)
+
+        def read_file(file):
+            return None if file['name'] == 'file0.txt' else file['name'].encode()
+
+        def extract(content, mime_type, name, config):
+            if name == 'file1.txt':
+                raise ValueError("corrupt file")
+            return '' if name == 'file2.txt' else content.decode()
+
+        mocks['extract'].side_effect = extract
+        results = run_ingestion_pipeline(files, read_file, config)
+
+        assert results == {
+            '/data/file0.txt': False,
+            '/data/file1.txt': False,
+            '/data/file2.txt': False,
+            '/data/file3.txt': True
+        }
+        mocks['store'].assert_called_once()
+        captured = capfd.readouterr()
+        assert "Failed to read file 'file0.txt'" in captured.out
+        assert "Error processing file 'file1.txt' (ID: /data/file1.txt): corrupt file" in captured.out
+        assert "No text could be extracted from file 'file2.txt'" in captured.out
+
+    def test_incremental_updates_skip_embedding(self, config, mocks):
+        config['update_mode'] = 'incremental'
+        run_ingestion_pipeline(make_files(2), lambda file: b'text', config)
+
+        mocks['embed'].assert_not_called()
+        assert all(c.args[2] is None for c in mocks['store'].call_args_list)
+
+    def test_stages_overlap_across_files(self, config, mocks):
+        config['ingestion']['embed_concurrency'] = 4
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow_embed(chunks):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            return [[0.1] for _ in chunks]
+
+        mocks['embed'].side_effect = slow_embed
+        results = run_ingestion_pipeline(make_files(8), lambda file: b'text', config)
+
+        assert all(results.values())
+        assert max(peak) > 1
+
+    def test_concurrency_settings_from_config(self):
+        pipeline = IngestionPipeline(lambda file: b'', {"ingestion": {"read_concurrency": 3, "write_concurrency": 0, "queue_size": 5}})
+
+        assert pipeline.read_concurrency == 3
+        # Every stage needs at least one worker
+        assert pipeline.write_concurrency == 1
+        assert pipeline.queue_size == 5
+
+    def test_pdfs_use_process_pool(self, config, mocks):
+        config['ingestion']['extract_processes'] = 2
+        files = make_files(1, 'application/pdf') + [dict(make_files(2)[1])]
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='extract-pool')
+        extract_threads = {}
+
+        def extract(content, mime_type, name, config):
+            extract_threads[mime_type] = threading.current_thread().name
+            return "text"
+
+        mocks['extract'].side_effect = extract
+        # Stand in a thread pool for the process pool since the mocks can't be pickled
+        with patch('common.ingestion_pipeline.ProcessPoolExecutor', return_value=pool) as mock_pool_class:
+            results = run_ingestion_pipeline(files, lambda file: b'content', config)
+
+        mock_pool_class.assert_called_once_with(max_workers=2)
+        assert extract_threads['application/pdf'].startswith('extract-pool')
+        assert not extract_threads['text/plain'].startswith('extract-pool')
+        assert all(results.values())
+
+    def test_no_process_pool_without_pdfs(self, config, mocks):
+        config['ingestion']['extract_processes'] = 2
+        with patch('common.ingestion_pipeline.ProcessPoolExecutor') as mock_pool_class:
+            run_ingestion_pipeline(make_files(2), lambda file: b'content', config)
+
+        mock_pool_class.assert_not_called()
@@ -0,0 +1,151 @@
+import pytest
+from datetime import datetime, date
+import io
+import os
+import sys
+
+# Add the parent directory to sys.path to import the modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.tabular_reader import TabularFile, is_xlsx_file, convert_value
+
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def make_xlsx(rows):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+class TestCsv:
+    def test_infers_column_types(self):
+        """Test inferring a type for every column from all of its values"""
+        content = (
+            b"id,price,active,day,seen_at,zip,name,empty\n"
+            b"1,9.5,true,2024-01-31,2024-01-31T10:00:00,01234,Widget,\n"
+            b"2,10,False,2024-02-01,2024-02-01 11:30,98765,Gadget,\n"
+            b"3,,TRUE,,,12345,42,\n"
+        )
+        tabular_file = TabularFile(content, 'text/csv')
+
+        assert tabular_file.columns == ["id", "price", "active", "day", "seen_at", "zip", "name", "empty"]
+        assert tabular_file.column_types == {
+            "id": "integer",
+            "price": "number",
+            "active": "boolean",
+            "day": "date",
+            "seen_at": "timestamp",
+            "zip": "text",
+            "name": "text",
+            "empty": "text"
+        }
+
+    def test_yields_typed_rows(self):
+        """Test that values are converted to their column type and empty cells become None"""
+        content = b"id,price,active,day\n1,9.5,true,2024-01-31\n2,,false,\n"
+        rows = list(TabularFile(content, 'text/csv').iter_rows())
+
+        assert rows == [
+            {"id": 1, "price": 9.5, "active": True, "day": "2024-01-31"},
+            {"id": 2, "price": None, "active": False, "day": None}
+        ]
+
+    def test_one_bad_value_makes_column_text(self):
+        """Test that a column with any incompatible value stays text"""
+        content = b"amount\n1\n2\nn/a\n"
+        tabular_file = TabularFile(content, 'text/csv')
+
+        assert tabular_file.column_types == {"amount": "text"}
+        assert [row["amount"] for row in tabular_file.iter_rows()] == ["1", "2", "n/a"]
+
+    def test_dates_widen_to_timestamps(self):
+        content = b"when\n2024-01-31\n2024-01-31T10:00:00\n"
+        assert TabularFile(content, 'text/csv').column_types == {"when": "timestamp"}
+
+    def test_timestamps_with_offsets(self):
+        """Test that timestamps with a UTC offset keep it and don't mix with naive ones"""
+        content = b"when\n2024-01-31T10:00:00+02:00\n2024-02-01T08:00:00Z\n"
+        tabular_file = TabularFile(content, 'text/csv')
+
+        assert tabular_file.column_types == {"when": "timestamptz"}
+        assert [row["when"] for row in tabular_file.iter_rows()] == ["2024-01-31T10:00:00+02:00", "2024-02-01T08:00:00Z"]
+
+        content = b"when\n2024-01-31T10:00:00+02:00\n2024-02-01T08:00:00\n"
+        assert TabularFile(content, 'text/csv').column_types == {"when": "text"}
+
+    def test_short_rows_and_bom(self):
+        """Test a byte order mark before the header and rows with missing cells"""
+        content = b"\xef\xbb\xbfa,b\n1\n"
+        tabular_file = TabularFile(content, 'application/vnd.google-apps.spreadsheet')
+
+        assert tabular_file.columns == ["a", "b"]
+        assert list(tabular_file.iter_rows()) == [{"a": 1, "b": None}]
+
+    def test_rows_are_streamed(self):
+        """Test that rows are yielded lazily"""
+        content = b"n\n" + b"".join(f"{i}\n".encode() for i in range(1000))
+        rows = TabularFile(content, 'text/csv').iter_rows()
+
+        assert next(rows) == {"n": 0}
+        assert next(rows) == {"n": 1}
+
+    def test_low_cardinality_columns(self):
+        """Test finding the columns with few repeating values"""
+        content = b"id,region,year,note\n" + b"".join(
+            f"{i},{['EU', 'US', 'APAC'][i % 3]},{2020 + i % 2},\n".encode() for i in range(30)
+        )
+        tabular_file = TabularFile(content, 'text/csv')
+
+        assert tabular_file.low_cardinality_columns() == ["region", "year"]
+        assert tabular_file.low_cardinality_columns(max_distinct=2) == ["year"]
+
+    def test_to_csv_text(self):
+        content = b"a,b\n1,2\n"
+        assert TabularFile(content, 'text/csv').to_csv_text() == "a,b\n1,2\n"
+
+class TestXlsx:
+    def test_reads_typed_cells(self):
+        """Test reading the first sheet of a workbook with its native cell types"""
+        content = make_xlsx([
+            ["id", "price", "active", "day", None],
+            [1, 9.5, True, datetime(2024, 1, 31), "x"],
+            [2, 10, False, datetime(2024, 2, 1, 12, 30), None]
+        ])
+        tabular_file = TabularFile(content, XLSX_MIME_TYPE)
+
+        assert tabular_file.columns == ["id", "price", "active", "day", "column_5"]
+        assert tabular_file.column_types == {
+            "id": "integer",
+            "price": "number",
+            "active": "boolean",
+            "day": "timestamp",
+            "column_5": "text"
+        }
+        assert list(tabular_file.iter_rows()) == [
+            {"id": 1, "price": 9.5, "active": True, "day": "2024-01-31T00:00:00", "column_5": "x"},
+            {"id": 2, "price": 10.0, "active": False, "day": "2024-02-01T12:30:00", "column_5": None}
+        ]
+
+    def test_to_csv_text(self):
+        content = make_xlsx([["name", "qty"], ["Widget", 3]])
+        assert TabularFile(content, XLSX_MIME_TYPE).to_csv_text() == "name,qty\nWidget,3\n"
+
+    def test_detects_workbooks_by_content(self):
+        """Test recognizing a workbook even when its mime type doesn't say so"""
+        content = make_xlsx([["a"], [1]])
+
+        assert is_xlsx_file(content, 'application/octet-stream')
+        assert not is_xlsx_file(b"a,b\n1,2\n", 'text/csv')
+        assert is_xlsx_file(b"", XLSX_MIME_TYPE)
+
+class TestConvertValue:
+    def test_conversions(self):
+        assert convert_value(" 42 ", "integer") == 42
+        assert convert_value("1e3", "number") == 1000.0
+        assert convert_value("False", "boolean") is False
+        assert convert_value(date(2024, 1, 31), "date") == "2024-01-31"
+        assert convert_value(3, "text") == "3"
+        assert convert_value("", "integer") is None
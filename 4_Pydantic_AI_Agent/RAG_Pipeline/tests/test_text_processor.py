@@ -6,6 +6,7 @@ import os
 import sys
 import json
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
 
 # Mock environment variables before importing modules that use them
@@ -25,12 +26,19 @@ with patch.dict(os.environ, {
         sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
         from common.text_processor import (
             chunk_text, 
+            iter_chunks,
             extract_text_from_pdf, 
+            iter_pdf_pages,
             extract_text_from_file, 
+            iter_text_from_file,
+            peek_segments,
             create_embeddings, 
+            create_embeddings_with_cache,
+            batch_texts,
             is_tabular_file, 
             extract_schema_from_csv, 
-            extract_rows_from_csv
+            extract_rows_from_csv,
+            iter_rows_from_csv
         )
 
 class TestChunkText:
@@ -71,19 +79,75 @@ class TestChunkText:
         # Last chunk might be shorter
         assert len(result[3]) <= 400
 
+class TestIterChunks:
+    @pytest.mark.parametrize("chunk_size,overlap", [(400, 0), (400, 100), (7, 3), (10, 9)])
+    def test_matches_chunk_text(self, chunk_size, overlap):
+        """Test that streaming segments gives the same chunks as chunking the whole text"""
+        segments = [f"line {i}\r\n" * (i % 5) for i in range(300)]
+        text = "".join(segments)
+        
+        result = list(iter_chunks(segments, chunk_size=chunk_size, overlap=overlap))
+        
+        assert result == chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+        assert all('\r' not in chunk for chunk in result)
+
+    def test_segments_larger_than_chunk(self):
+        """Test segments that span several chunks"""
+        result = list(iter_chunks(["A" * 650, "B" * 350], chunk_size=400, overlap=100))
+        
+        assert result == chunk_text("A" * 650 + "B" * 350, chunk_size=400, overlap=100)
+
+    def test_consumes_segments_lazily(self):
+        """Test that chunks are yielded before the whole document has been read"""
+        consumed = []
+        
+        def segments():
+            for i in range(1000):
+                consumed.append(i)
+                yield "x" * 100
+        
+        chunks = iter_chunks(segments(), chunk_size=400)
+        
+        assert next(chunks) == "x" * 400
+        assert len(consumed) == 4
+
+    def test_empty_segments(self):
+        """Test that no chunks are produced for empty input"""
+        assert list(iter_chunks([])) == []
+        assert list(iter_chunks(["", ""])) == []
+
+    def test_overlap_must_be_smaller_than_chunk_size(self):
+        """Test that an overlap as large as the chunk size is rejected"""
+        with pytest.raises(ValueError):
+            list(iter_chunks(["text"], chunk_size=10, overlap=10))
+
+def make_pdf(page_texts):
+    """Build a minimal PDF with one line of text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({page_text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return pdf
+
 class TestExtractTextFromPdf:
-    @patch('tempfile.NamedTemporaryFile')
     @patch('pypdf.PdfReader')
-    @patch('os.path.exists')
-    @patch('os.remove')
-    @patch('builtins.open', new_callable=mock_open)
-    def test_extract_text(self, mock_file_open, mock_remove, mock_exists, mock_pdf_reader, mock_temp_file):
+    def test_extract_text(self, mock_pdf_reader):
         """Test extracting text from PDF"""
-        # Setup mocks
-        mock_temp = MagicMock()
-        mock_temp.name = 'temp.pdf'
-        mock_temp_file.return_value.__enter__.return_value = mock_temp
-        
         mock_page1 = MagicMock()
         mock_page1.extract_text.return_value = "Page 1 content"
         mock_page2 = MagicMock()
@@ -93,15 +157,52 @@ class TestExtractTextFromPdf:
         mock_reader.pages = [mock_page1, mock_page2]
         mock_pdf_reader.return_value = mock_reader
         
-        mock_exists.return_value = True
-        
         # Call the function
         result = extract_text_from_pdf(b'fake pdf content')
         
         # Assertions
         assert result == "Page 1 content\n\nPage 2 content\n\n"
-        mock_temp.write.assert_called_once_with(b'fake pdf content')
-        mock_remove.assert_called_once_with('temp.pdf')
+        # The PDF is parsed from memory instead of a temporary file
+        stream = mock_pdf_reader.call_args.args[0]
+        assert isinstance(stream, io.BytesIO)
+        assert stream.getvalue() == b'fake pdf content'
+
+    def test_extract_text_from_real_pdf(self):
+        """Test extracting text from an actual PDF, skipping pages without text"""
+        result = extract_text_from_pdf(make_pdf(["First page", "", "Third page"]))
+        
+        assert result == "First page\n\nThird page\n\n"
+
+    def test_iter_pdf_pages_is_lazy(self):
+        """Test that pages are yielded one at a time"""
+        pages = iter_pdf_pages(make_pdf(["One", "Two"]))
+        
+        assert next(pages) == "One"
+        assert next(pages) == "Two"
+        with pytest.raises(StopIteration):
+            next(pages)
+
+    def test_large_pdf_uses_process_pool(self):
+        """Test that large PDFs are parsed across worker processes, keeping page order"""
+        page_texts = [f"Page {i}" for i in range(12)]
+        pdf = make_pdf(page_texts)
+        
+        with patch('common.text_processor.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as mock_pool:
+            pages = list(iter_pdf_pages(pdf, max_workers=2, parallel_page_threshold=10))
+        
+        # The PDF bytes go to each worker once through the initializer, not with every page range
+        mock_pool.assert_called_once()
+        assert mock_pool.call_args.kwargs['max_workers'] == 2
+        assert mock_pool.call_args.kwargs['initargs'] == (pdf,)
+        assert pages == page_texts
+
+    def test_small_pdf_skips_process_pool(self):
+        """Test that small PDFs are parsed in the calling process"""
+        with patch('common.text_processor.ProcessPoolExecutor') as mock_pool:
+            pages = list(iter_pdf_pages(make_pdf(["Only page"]), max_workers=2, parallel_page_threshold=10))
+        
+        mock_pool.assert_not_called()
+        assert pages == ["Only page"]
 
 class TestExtractTextFromFile:
     @patch('common.text_processor.extract_text_from_pdf')
@@ -114,6 +215,19 @@ class TestExtractTextFromFile:
         mock_extract_pdf.assert_called_once_with(b'fake pdf content')
         assert result == "PDF content"
     
+    def test_xlsx_file(self):
+        """Test that workbooks are extracted as CSV text instead of decoded bytes"""
+        openpyxl = pytest.importorskip("openpyxl")
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["name", "qty"])
+        workbook.active.append(["Widget", 3])
+        output = io.BytesIO()
+        workbook.save(output)
+        
+        result = extract_text_from_file(output.getvalue(), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'test.xlsx')
+        
+        assert result == "name,qty\nWidget,3\n"
+    
     def test_text_file(self):
         """Test extracting text from text file"""
         content = b'Text file content'
@@ -135,6 +249,38 @@ class TestExtractTextFromFile:
         
         assert result == "Some content"
 
+class TestIterTextFromFile:
+    def test_pdf_pages(self):
+        """Test that PDFs are streamed page by page"""
+        segments = iter_text_from_file(make_pdf(["First page", "", "Third page"]), 'application/pdf', 'test.pdf')
+        
+        assert list(segments) == ["First page\n\n", "Third page\n\n"]
+    
+    def test_text_lines(self):
+        """Test that text files are streamed line by line, keeping the line endings"""
+        content = b'line one\r\nline two\nline \xff three'
+        
+        segments = list(iter_text_from_file(content, 'text/plain', 'test.txt'))
+        
+        assert segments == ["line one\r\n", "line two\n", "line \ufffd three"]
+        assert "".join(segments) == extract_text_from_file(content, 'text/plain', 'test.txt')
+    
+    def test_image_file(self):
+        """Test that images yield their file name"""
+        assert list(iter_text_from_file(b'binary', 'image/png', 'photo.png')) == ["photo.png"]
+
+class TestPeekSegments:
+    def test_keeps_every_segment(self):
+        """Test that the first segment with text is still returned after peeking at it"""
+        segments = peek_segments(iter(["", "first", "", "second"]))
+        
+        assert list(segments) == ["first", "", "second"]
+    
+    def test_no_text(self):
+        """Test that a stream without text gives None"""
+        assert peek_segments(iter(["", ""])) is None
+        assert peek_segments([]) is None
+
 # Global reference to the mocked OpenAI client
 openai_client_mock = mock_client
 
@@ -172,6 +318,128 @@ class TestCreateEmbeddings:
             )
             assert result == [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]
 
+    def test_splits_into_batches_in_order(self, openai_client_mock):
+        """Test that large inputs are split into batches and vectors keep input order"""
+        def fake_create(model, input):
+            response = MagicMock()
+            items = []
+            for text in input:
+                item = MagicMock()
+                item.embedding = [float(text.split()[-1])]
+                items.append(item)
+            response.data = items
+            return response
+        
+        openai_client_mock.embeddings.create.side_effect = fake_create
+        texts = [f"Text {i}" for i in range(10)]
+        
+        with patch('common.text_processor.openai_client', openai_client_mock):
+            result = create_embeddings(texts, batch_size=3, max_concurrency=4)
+        
+        assert openai_client_mock.embeddings.create.call_count == 4
+        assert result == [[float(i)] for i in range(10)]
+    
+    @patch('common.text_processor.time.sleep')
+    def test_retries_on_rate_limit(self, mock_sleep, openai_client_mock):
+        """Test that rate limited requests are retried with backoff"""
+        class RateLimited(Exception):
+            status_code = 429
+        
+        mock_item = MagicMock()
+        mock_item.embedding = [0.1]
+        mock_response = MagicMock()
+        mock_response.data = [mock_item]
+        openai_client_mock.embeddings.create.side_effect = [RateLimited("Too many requests"), mock_response]
+        
+        with patch('common.text_processor.openai_client', openai_client_mock):
+            result = create_embeddings(["Text 1"])
+        
+        assert result == [[0.1]]
+        assert openai_client_mock.embeddings.create.call_count == 2
+        mock_sleep.assert_called_once()
+    
+    def test_non_retryable_error_raises(self, openai_client_mock):
+        """Test that errors other than rate limits are raised immediately"""
+        class BadRequest(Exception):
+            status_code = 400
+        
+        openai_client_mock.embeddings.create.side_effect = BadRequest("Bad request")
+        
+        with patch('common.text_processor.openai_client', openai_client_mock):
+            with pytest.raises(BadRequest):
+                create_embeddings(["Text 1"])
+        
+        assert openai_client_mock.embeddings.create.call_count == 1
+
+class TestCreateEmbeddingsWithCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        from common.embedding_cache import EmbeddingCache
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+        yield cache
+        cache.close()
+    
+    def test_only_new_chunks_are_embedded(self, cache):
+        """Test cached chunks are reused and only new ones hit the embedding API"""
+        with patch('common.text_processor.create_embeddings') as mock_create:
+            mock_create.return_value = [[1.0], [2.0]]
+            first = create_embeddings_with_cache(["Chunk A", "Chunk B"], cache=cache)
+            
+            mock_create.reset_mock()
+            mock_create.return_value = [[3.0]]
+            second = create_embeddings_with_cache(["Chunk B", "Chunk C", "Chunk A"], cache=cache)
+        
+        assert first == [[1.0], [2.0]]
+        mock_create.assert_called_once_with(["Chunk C"])
+        assert second == [[2.0], [3.0], [1.0]]
+    
+    def test_duplicate_chunks_embedded_once(self, cache):
+        """Test identical chunks within one file are only embedded once"""
+        with patch('common.text_processor.create_embeddings') as mock_create:
+            mock_create.return_value = [[1.0]]
+            result = create_embeddings_with_cache(["Same", "Same"], cache=cache)
+        
+        mock_create.assert_called_once_with(["Same"])
+        assert result == [[1.0], [1.0]]
+    
+    def test_cache_is_per_model(self, cache):
+        """Test vectors from another embedding model are never reused"""
+        with patch('common.text_processor.create_embeddings') as mock_create:
+            mock_create.return_value = [[1.0]]
+            with patch.dict(os.environ, {'EMBEDDING_MODEL_CHOICE': 'model-a'}):
+                create_embeddings_with_cache(["Chunk A"], cache=cache)
+            with patch.dict(os.environ, {'EMBEDDING_MODEL_CHOICE': 'model-b'}):
+                create_embeddings_with_cache(["Chunk A"], cache=cache)
+        
+        assert mock_create.call_count == 2
+    
+    def test_without_cache(self):
+        """Test embedding falls back to the API when caching is disabled"""
+        with patch('common.text_processor.get_embedding_cache', return_value=None), \
+             patch('common.text_processor.create_embeddings') as mock_create:
+            mock_create.return_value = [[1.0]]
+            result = create_embeddings_with_cache(["Chunk A"])
+        
+        mock_create.assert_called_once_with(["Chunk A"])
+        assert result == [[1.0]]
+
+class TestBatchTexts:
+    def test_count_limit(self):
+        """Test batches never exceed the item count limit"""
+        batches = batch_texts(["a"] * 5, batch_size=2, max_batch_tokens=1000)
+        assert batches == [["a", "a"], ["a", "a"], ["a"]]
+    
+    def test_token_limit(self):
+        """Test batches never exceed the estimated token limit"""
+        texts = ["A" * 400, "B" * 400, "C" * 400]
+        batches = batch_texts(texts, batch_size=100, max_batch_tokens=250)
+        assert batches == [["A" * 400, "B" * 400], ["C" * 400]]
+    
+    def test_oversized_text_gets_own_batch(self):
+        """Test a single text larger than the token limit is still sent on its own"""
+        batches = batch_texts(["A" * 4000, "B"], batch_size=100, max_batch_tokens=10)
+        assert batches == [["A" * 4000], ["B"]]
+
 class TestIsTabularFile:
     @pytest.mark.parametrize("mime_type,expected", [
         ('text/csv', True),
@@ -239,3 +507,13 @@ class TestExtractRowsFromCsv:
         # Check that error was printed
         captured = capfd.readouterr()
         assert "Error extracting rows from CSV" in captured.out
+    
+    def test_iter_rows_is_lazy(self):
+        """Test rows can be streamed one at a time from a generator"""
+        csv_content = b'Name,Age\r\nJohn,30\r\n"Jane, Jr.",25\r\n'
+        
+        rows = iter_rows_from_csv(csv_content)
+        
+        assert next(rows) == {'Name': 'John', 'Age': '30'}
+        assert next(rows) == {'Name': 'Jane, Jr.', 'Age': '25'}
+        assert next(rows, None) is None
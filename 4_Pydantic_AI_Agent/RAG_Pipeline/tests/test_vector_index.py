@@ -0,0 +1,120 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import json
+import os
+import sys
+
+# Mock environment variables before importing modules that use them
+with patch.dict(os.environ, {
+    'SUPABASE_URL': 'https://test-supabase-url.com',
+    'SUPABASE_SERVICE_KEY': 'test-supabase-key'
+}):
+    # Mock the create_client function before it's used in db_handler
+    with patch('supabase.create_client') as mock_create_client:
+        mock_create_client.return_value = MagicMock()
+
+        # Add the parent directory to sys.path to import the modules
+        sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        from common.vector_index import (
+            recommended_lists,
+            build_index_sql,
+            get_vector_index,
+            create_vector_index,
+            maintain_vector_index
+        )
+
+def make_connection(row_count=5000, index_row=None):
+    """Fake psycopg2 connection answering the row count and index lookups"""
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    executed = []
+
+    def execute(sql, params=None):
+        executed.append(sql)
+        if "count(*)" in sql:
+            cursor.fetchone.return_value = (row_count,)
+        elif "pg_indexes" in sql:
+            cursor.fetchone.return_value = index_row
+
+    cursor.execute.side_effect = execute
+    connection.executed = executed
+    return connection
+
+class TestBuildIndexSql:
+    def test_hnsw(self):
+        assert build_index_sql("hnsw", m=24, ef_construction=128) == (
+            "CREATE INDEX CONCURRENTLY documents_embedding_idx ON documents "
+            "USING hnsw (embedding vector_cosine_ops) WITH (m = 24, ef_construction = 128)"
+        )
+
+    def test_ivfflat(self):
+        assert build_index_sql("ivfflat", "idx", lists=500, concurrently=False) == (
+            "CREATE INDEX idx ON documents USING ivfflat (embedding vector_cosine_ops) WITH (lists = 500)"
+        )
+
+    def test_unsupported_method(self):
+        with pytest.raises(ValueError):
+            build_index_sql("flat")
+
+    def test_recommended_lists(self):
+        assert recommended_lists(0) == 1
+        assert recommended_lists(500_000) == 500
+        assert recommended_lists(4_000_000) == 2000
+
+class TestCreateVectorIndex:
+    def test_builds_and_swaps_index(self):
+        """Test that the new index is built concurrently under a temporary name, then swapped in"""
+        connection = make_connection(row_count=200_000)
+
+        params = create_vector_index("ivfflat", connection=connection)
+
+        assert params == {"method": "ivfflat", "row_count": 200_000, "lists": 200}
+        assert connection.autocommit is True
+        executed = connection.executed
+        build = executed.index(build_index_sql("ivfflat", "documents_embedding_idx_new", lists=200))
+        assert executed.index("DROP INDEX CONCURRENTLY IF EXISTS documents_embedding_idx") > build
+        assert "ALTER INDEX documents_embedding_idx_new RENAME TO documents_embedding_idx" in executed
+        connection.close.assert_not_called()
+
+    def test_records_parameters_in_comment(self):
+        connection = make_connection()
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        create_vector_index("hnsw", m=32, ef_construction=200, connection=connection)
+
+        comment_call = [c for c in cursor.execute.call_args_list if c.args[0].startswith("COMMENT ON INDEX")][0]
+        assert json.loads(comment_call.args[1][0]) == {"method": "hnsw", "row_count": 5000, "m": 32, "ef_construction": 200}
+
+class TestMaintainVectorIndex:
+    def test_creates_missing_index(self):
+        connection = make_connection(index_row=None)
+        with patch('common.vector_index.create_vector_index') as mock_create:
+            assert maintain_vector_index(connection=connection) == "created"
+        mock_create.assert_called_once_with("hnsw", connection=connection)
+
+    def test_rebuilds_ivfflat_after_growth(self):
+        """Test that IVFFlat indexes are retrained once the table has grown past the growth factor"""
+        comment = json.dumps({"method": "ivfflat", "row_count": 1000, "lists": 1})
+        connection = make_connection(row_count=5000, index_row=("CREATE INDEX ... USING ivfflat ...", comment))
+        with patch('common.vector_index.create_vector_index') as mock_create:
+            assert maintain_vector_index(connection=connection) == "rebuilt"
+        mock_create.assert_called_once_with("ivfflat", connection=connection)
+
+    def test_keeps_ivfflat_within_growth_factor(self):
+        comment = json.dumps({"method": "ivfflat", "row_count": 4000, "lists": 4})
+        connection = make_connection(row_count=5000, index_row=("CREATE INDEX ... USING ivfflat ...", comment))
+        with patch('common.vector_index.create_vector_index') as mock_create:
+            assert maintain_vector_index(connection=connection) == "analyzed"
+        mock_create.assert_not_called()
+        assert "ANALYZE documents" in connection.executed
+
+    def test_hnsw_from_sql_script(self):
+        """Test reading an index created by sql/documents.sql, which has no recorded parameters"""
+        connection = make_connection(index_row=("CREATE INDEX documents_embedding_idx ON public.documents USING hnsw (embedding vector_cosine_ops)", None))
+
+        index = get_vector_index(connection)
+
+        assert index["method"] == "hnsw"
+        with patch('common.vector_index.create_vector_index') as mock_create:
+            assert maintain_vector_index(connection=connection) == "analyzed"
+        mock_create.assert_not_called()
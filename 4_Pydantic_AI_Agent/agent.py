@@ -6,8 +6,8 @@ from dataclasses import dataclass
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from httpx import AsyncClient
-from supabase import Client
-from typing import List
+from supabase import AsyncClient as AsyncSupabaseClient
+from typing import List, Optional
 import os
 
 from prompt import AGENT_SYSTEM_PROMPT
@@ -30,7 +30,7 @@ def get_model():
 # ========== Pydantic AI Agent ==========
 @dataclass
 class AgentDeps:
-    supabase: Client
+    supabase: AsyncSupabaseClient
     embedding_client: AsyncOpenAI
     http_client: AsyncClient
     brave_api_key: str | None
@@ -75,19 +75,51 @@ async def web_search(ctx: RunContext[AgentDeps], query: str) -> str:
     return await web_search_tool(query, ctx.deps.http_client, ctx.deps.brave_api_key, ctx.deps.searxng_base_url)    
 
 @agent.tool
-async def retrieve_relevant_documents(ctx: RunContext[AgentDeps], user_query: str) -> str:
+async def retrieve_relevant_documents(
+    ctx: RunContext[AgentDeps],
+    user_query: str,
+    file_ids: Optional[List[str]] = None,
+    mime_type: Optional[str] = None,
+    folder: Optional[str] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None,
+    match_count: Optional[int] = None,
+    search_mode: Optional[str] = None,
+    full_text_weight: Optional[float] = None,
+    semantic_weight: Optional[float] = None,
+    rrf_k: Optional[int] = None
+) -> str:
     """
     Retrieve relevant document chunks based on the query with RAG.
+    Use the optional filters to search only part of the knowledge base, leave them out to search everything.
+    Use search_mode "hybrid" when the query contains exact terms like names, codes or part numbers - it combines
+    a keyword search with the semantic search.
     
     Args:
         ctx: The context including the Supabase client and OpenAI client
         user_query: The user's question or query
+        file_ids: Only search these documents (IDs from list_documents)
+        mime_type: Only search documents of this mime type, e.g. "application/pdf"
+        folder: Only search documents in this folder or its subfolders (Google Drive folder ID or local directory path)
+        modified_after: Only search documents modified on or after this ISO 8601 date, e.g. "2024-01-31"
+        modified_before: Only search documents modified before this ISO 8601 date
+        match_count: Number of chunks to return (at most 20), defaults to the configured count
+        search_mode: "vector" (semantic search) or "hybrid" (keyword + semantic search), defaults to the configured mode
+        full_text_weight: Hybrid: weight of the keyword ranking (default 1.0)
+        semantic_weight: Hybrid: weight of the semantic ranking (default 1.0)
+        rrf_k: Hybrid: rank fusion constant (default 50), lower values favor the top results of each ranking more
         
     Returns:
-        A formatted string containing the top 4 most relevant documents chunks
+        A formatted string containing the most relevant document chunks (4 by default)
     """
     print("Calling retrieve_relevant_documents tool")
-    return await retrieve_relevant_documents_tool(ctx.deps.supabase, ctx.deps.embedding_client, user_query)
+    return await retrieve_relevant_documents_tool(
+        ctx.deps.supabase, ctx.deps.embedding_client, user_query,
+        file_ids=file_ids, mime_type=mime_type, folder=folder,
+        modified_after=modified_after, modified_before=modified_before,
+        match_count=match_count, search_mode=search_mode, rrf_k=rrf_k,
+        full_text_weight=full_text_weight, semantic_weight=semantic_weight
+    )
 
 @agent.tool
 async def list_documents(ctx: RunContext[AgentDeps]) -> List[str]:
@@ -101,19 +133,31 @@ async def list_documents(ctx: RunContext[AgentDeps]) -> List[str]:
     return await list_documents_tool(ctx.deps.supabase)
 
 @agent.tool
-async def get_document_content(ctx: RunContext[AgentDeps], document_id: str) -> str:
+async def get_document_content(
+    ctx: RunContext[AgentDeps],
+    document_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    max_tokens: Optional[int] = None
+) -> str:
     """
-    Retrieve the full content of a specific document by combining all its chunks.
+    Retrieve the content of a specific document, reading it in windows of chunks.
+    Long documents are returned one window at a time - the result then ends with the offset to pass
+    to read the next window.
     
     Args:
         ctx: The context including the Supabase client
         document_id: The ID (or file path) of the document to retrieve
+        offset: Position of the first chunk to read (0 for the start of the document)
+        limit: Maximum number of chunks to return
+        max_tokens: Approximate maximum number of tokens to return
         
     Returns:
-        str: The full content of the document with all chunks combined in order
+        str: The content of the document's chunks in order, with the offset to continue from if there is more
     """
     print("Calling get_document_content tool")
-    return await get_document_content_tool(ctx.deps.supabase, document_id)
+    return await get_document_content_tool(ctx.deps.supabase, document_id, offset=offset, limit=limit,
+                                           max_tokens=max_tokens)
 
 @agent.tool
 async def execute_sql_query(ctx: RunContext[AgentDeps], sql_query: str) -> str:
@@ -121,6 +165,8 @@ async def execute_sql_query(ctx: RunContext[AgentDeps], sql_query: str) -> str:
     Run a SQL query - use this to query from the document_rows table once you know the file ID you are querying. 
     dataset_id is the file_id and you are always using the row_data for filtering, which is a jsonb field that has 
     all the keys from the file schema given in the document_metadata table.
+    The schema maps each column to its type (integer, number, boolean, date, timestamp, timestamptz or text) - numbers and
+    booleans are stored as JSON values, so cast row_data->>'column' to the matching type (numeric, boolean, date, ...).
 
     Never use a placeholder file ID. Always use the list_documents tool first to get the file ID.
 
@@ -138,6 +184,17 @@ async def execute_sql_query(ctx: RunContext[AgentDeps], sql_query: str) -> str:
     FROM document_rows
     WHERE dataset_id = '123'
     GROUP BY row_data->>'category';
+
+    If the file has a typed table, query that instead - it has one natively typed column per column of the file,
+    so no casts are needed and it is much faster. Look it up by the file ID (don't guess the table name):
+
+    SELECT table_name, columns FROM dataset_tables WHERE dataset_id = '123';
+
+    columns maps each column of the file to its column in the typed table (usually the same name). Then:
+
+    SELECT category, SUM(sales) AS total_sales
+    FROM datasets.dataset_0123456789abcdef
+    GROUP BY category;
     
     Args:
         ctx: The context including the Supabase client
@@ -1,19 +1,20 @@
 from openai import AsyncOpenAI
-from supabase import Client
+from supabase import AsyncClient
 from mem0 import Memory
 import os
 
 def get_agent_clients():
+    # Both clients are async, create them on the event loop they'll be used on (not cached across loops)
     # Embedding client setup
     base_url = os.getenv('EMBEDDING_BASE_URL', 'https://api.openai.com/v1')
     api_key = os.getenv('EMBEDDING_API_KEY', 'no-api-key-provided')
     
     embedding_client = AsyncOpenAI(base_url=base_url, api_key=api_key)
 
-    # Supabase client setup
+    # Supabase client setup (async so the agent's database calls don't block the event loop)
     supabase_url = os.getenv("SUPABASE_URL")
     supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-    supabase = Client(supabase_url, supabase_key)
+    supabase = AsyncClient(supabase_url, supabase_key)
 
     return embedding_client, supabase
 
@@ -0,0 +1,198 @@
+-- Typed tables for tabular datasets
+-- Used by the RAG pipeline when tabular_storage is "typed": every dataset in document_rows also gets a
+-- materialized view in the datasets schema with one typed column per column of the file, so queries
+-- don't have to parse row_data and cast text for every row
+
+CREATE SCHEMA IF NOT EXISTS datasets;
+
+-- Typed table of each dataset, listed to the agent by list_documents, and the column of the typed table
+-- each column of the file became (see materialize_dataset)
+ALTER TABLE document_metadata ADD COLUMN IF NOT EXISTS dataset_table TEXT;
+ALTER TABLE document_metadata ADD COLUMN IF NOT EXISTS dataset_columns JSONB;
+
+-- Name of the typed table of a dataset (the file IDs are paths or Drive IDs, so they're hashed)
+CREATE OR REPLACE FUNCTION dataset_table_name (
+  p_dataset_id text
+) returns text
+language sql
+immutable
+as $$
+  select 'dataset_' || left(md5(p_dataset_id), 16);
+$$;
+
+-- Column name for a column of a file that is a valid, unused column of its typed table
+-- Postgres truncates identifiers to 63 bytes, so long names are cut first, and names that are taken
+-- (row_id, or two headers that are the same after truncation) get a _2, _3, ... suffix
+CREATE OR REPLACE FUNCTION dataset_column_name (
+  p_name text,
+  p_used text[]
+) returns text
+language plpgsql
+immutable
+as $$
+declare
+  v_base text := coalesce(nullif(p_name, ''), 'column');
+  v_name text;
+  v_suffix text := '';
+  v_n int := 1;
+begin
+  loop
+    v_name := v_base;
+    while octet_length(v_name || v_suffix) > 63 loop
+      v_name := left(v_name, length(v_name) - 1);
+    end loop;
+    v_name := v_name || v_suffix;
+    if not v_name = any(p_used) then
+      return v_name;
+    end if;
+    v_n := v_n + 1;
+    v_suffix := '_' || v_n;
+  end loop;
+end;
+$$;
+
+-- (Re)create the typed table of a dataset from its rows
+-- Returns the table name and the column each column of the file became:
+-- {"table": "datasets.dataset_...", "columns": {"<column of the file>": "<column of the table>", ...}}
+DROP FUNCTION IF EXISTS materialize_dataset(text, jsonb);
+CREATE OR REPLACE FUNCTION materialize_dataset (
+  p_dataset_id text,
+  p_columns jsonb -- [{"name": "price", "type": "double precision", "index": false}, ...]
+) returns jsonb
+language plpgsql
+security definer
+as $$
+declare
+  v_table text := dataset_table_name(p_dataset_id);
+  v_select text := '';
+  v_column jsonb;
+  v_name text;
+  v_used text[] := array['row_id'];
+  v_mapping jsonb := '{}';
+  v_index int := 0;
+begin
+  for v_column in select * from jsonb_array_elements(p_columns) loop
+    -- The type is spliced into the query, so only allow the types the pipeline infers
+    if v_column->>'type' not in ('bigint', 'double precision', 'boolean', 'date', 'timestamp', 'timestamptz', 'text') then
+      raise exception 'Unsupported column type: %', v_column->>'type';
+    end if;
+    v_name := dataset_column_name(v_column->>'name', v_used);
+    v_used := v_used || v_name;
+    v_mapping := v_mapping || jsonb_build_object(v_column->>'name', v_name);
+    v_select := v_select || format(
+      ', nullif(row_data->>%L, %L)::%s as %I',
+      v_column->>'name', '', v_column->>'type', v_name
+    );
+  end loop;
+
+  execute format('drop materialized view if exists datasets.%I', v_table);
+  execute format(
+    'create materialized view datasets.%I as select id as row_id%s from public.document_rows where dataset_id = %L',
+    v_table, v_select, p_dataset_id
+  );
+
+  -- Index the low-cardinality columns used for filtering and grouping
+  for v_column in select * from jsonb_array_elements(p_columns) loop
+    if coalesce((v_column->>'index')::boolean, false) then
+      v_index := v_index + 1;
+      execute format('create index %I on datasets.%I (%I)', v_table || '_' || v_index, v_table,
+                     v_mapping->>(v_column->>'name'));
+    end if;
+  end loop;
+
+  execute format('analyze datasets.%I', v_table);
+
+  update document_metadata
+  set dataset_table = 'datasets.' || v_table, dataset_columns = v_mapping
+  where id = p_dataset_id;
+  return jsonb_build_object('table', 'datasets.' || v_table, 'columns', v_mapping);
+end;
+$$;
+
+-- Typed table of each dataset by its dataset_id (the file ID), so queries don't depend on the table naming:
+-- SELECT table_name, columns FROM dataset_tables WHERE dataset_id = '<file ID>'
+CREATE OR REPLACE VIEW dataset_tables AS
+  SELECT id AS dataset_id, dataset_table AS table_name, dataset_columns AS columns
+  FROM document_metadata
+  WHERE dataset_table IS NOT NULL;
+
+-- Drop the typed table of a dataset when its metadata is deleted (the file was deleted or is being re-ingested)
+CREATE OR REPLACE FUNCTION drop_dataset_table () returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  execute format('drop materialized view if exists datasets.%I', dataset_table_name(old.id));
+  return old;
+end;
+$$;
+
+DROP TRIGGER IF EXISTS drop_dataset_table ON document_metadata;
+CREATE TRIGGER drop_dataset_table
+  AFTER DELETE ON document_metadata
+  FOR EACH ROW EXECUTE FUNCTION drop_dataset_table();
+
+-- Drop the typed table of a dataset, e.g. before its rows are reloaded (materialize_dataset recreates it
+-- afterwards, so the refresh triggers below don't rebuild it for every batch of the reload)
+CREATE OR REPLACE FUNCTION drop_dataset (
+  p_dataset_id text
+) returns void
+language plpgsql
+security definer
+as $$
+begin
+  execute format('drop materialized view if exists datasets.%I', dataset_table_name(p_dataset_id));
+  update document_metadata set dataset_table = null, dataset_columns = null
+  where id = p_dataset_id and dataset_table is not null;
+end;
+$$;
+
+-- Keep the typed tables in sync with document_rows: every statement that inserts, updates or deletes rows
+-- refreshes the typed tables of the datasets it touched (once per statement, not per row)
+CREATE OR REPLACE FUNCTION refresh_dataset_tables () returns trigger
+language plpgsql
+security definer
+as $$
+declare
+  v_dataset_ids text[];
+  v_dataset_id text;
+  v_table text;
+begin
+  if TG_OP = 'UPDATE' then
+    -- An update can move rows to another dataset (old_rows only exists for the update trigger)
+    select array_agg(dataset_id) into v_dataset_ids
+    from (select dataset_id from changed_rows union select dataset_id from old_rows) changed;
+  else
+    select array_agg(distinct dataset_id) into v_dataset_ids from changed_rows;
+  end if;
+
+  foreach v_dataset_id in array coalesce(v_dataset_ids, '{}') loop
+    v_table := format('datasets.%I', dataset_table_name(v_dataset_id));
+    if to_regclass(v_table) is not null then
+      execute format('refresh materialized view %s', v_table);
+    end if;
+  end loop;
+  return null;
+end;
+$$;
+
+DROP TRIGGER IF EXISTS refresh_dataset_tables_insert ON document_rows;
+CREATE TRIGGER refresh_dataset_tables_insert
+  AFTER INSERT ON document_rows
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION refresh_dataset_tables();
+
+DROP TRIGGER IF EXISTS refresh_dataset_tables_update ON document_rows;
+CREATE TRIGGER refresh_dataset_tables_update
+  AFTER UPDATE ON document_rows
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION refresh_dataset_tables();
+
+DROP TRIGGER IF EXISTS refresh_dataset_tables_delete ON document_rows;
+CREATE TRIGGER refresh_dataset_tables_delete
+  AFTER DELETE ON document_rows
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION refresh_dataset_tables();
+
+REVOKE EXECUTE ON FUNCTION materialize_dataset(text, jsonb) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION drop_dataset(text) FROM PUBLIC, anon, authenticated;
@@ -4,5 +4,7 @@ CREATE TABLE IF NOT EXISTS document_metadata (
     title TEXT,
     url TEXT,
     created_at TIMESTAMP DEFAULT NOW(),
-    schema TEXT
+    schema TEXT,
+    dataset_table TEXT, -- Typed table of a tabular file (see dataset_tables.sql)
+    dataset_columns JSONB -- Column of the typed table each column of the file became
 );
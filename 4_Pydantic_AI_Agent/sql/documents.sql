@@ -9,11 +9,134 @@ CREATE TABLE IF NOT EXISTS documents (
   embedding vector(1536) -- 1536 works for OpenAI embeddings, change if needed like 768 for nomic-embed-text (Ollama)
 );
 
+-- Approximate nearest neighbor index so searches don't compare the query against every row
+-- HNSW works on an empty table and needs no retraining as documents are added. To rebuild it with other
+-- parameters (or as an IVFFlat index), use RAG_Pipeline/common/vector_index.py
+CREATE INDEX IF NOT EXISTS documents_embedding_idx ON documents
+  USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- Metadata the agent can filter searches on, promoted to indexed columns so the planner can estimate
+-- how selective a filter is and narrow the candidates with an index instead of checking every row
+-- The pipeline writes modified_time in UTC with a Z suffix, which makes the cast safe to mark immutable
+CREATE OR REPLACE FUNCTION metadata_timestamp (
+  value text
+) returns timestamptz
+language sql
+immutable
+as $$
+  select value::timestamptz;
+$$;
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_id text GENERATED ALWAYS AS (metadata->>'file_id') STORED;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS mime_type text GENERATED ALWAYS AS (metadata->>'mime_type') STORED;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS folder text GENERATED ALWAYS AS (metadata->>'folder') STORED;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS modified_time timestamptz
+  GENERATED ALWAYS AS (metadata_timestamp(metadata->>'modified_time')) STORED;
+
+CREATE INDEX IF NOT EXISTS documents_file_id_idx ON documents (file_id);
+CREATE INDEX IF NOT EXISTS documents_mime_type_idx ON documents (mime_type);
+CREATE INDEX IF NOT EXISTS documents_folder_idx ON documents (folder);
+CREATE INDEX IF NOT EXISTS documents_modified_time_idx ON documents (modified_time);
+
+-- Containment filters (metadata @> filter) on any other metadata key
+CREATE INDEX IF NOT EXISTS documents_metadata_idx ON documents USING gin (metadata jsonb_path_ops);
+
+-- Full-text index over the chunk content for hybrid (lexical + vector) search
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS fts tsvector
+  GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+CREATE INDEX IF NOT EXISTS documents_fts_idx ON documents USING gin (fts);
+
+-- WHERE clause for the search filters, null arguments add no condition
+-- Only the filters that are set end up in the query, so the planner picks per call between a btree index
+-- on the filter (selective filters, exact ordering) and the vector index
+CREATE OR REPLACE FUNCTION documents_filter_sql (
+  filter jsonb DEFAULT '{}',
+  filter_file_ids text[] default null,
+  filter_mime_type text default null,
+  filter_folder text default null,
+  modified_after timestamptz default null,
+  modified_before timestamptz default null
+) returns text
+language plpgsql
+stable
+as $$
+declare
+  v_where text := format('metadata @> %L::jsonb', coalesce(filter, '{}'));
+begin
+  if filter_file_ids is not null then
+    v_where := v_where || format(' and file_id = any(%L::text[])', filter_file_ids);
+  end if;
+  if filter_mime_type is not null then
+    v_where := v_where || format(' and mime_type = %L', filter_mime_type);
+  end if;
+  if filter_folder is not null then
+    -- Any folder the file is in at any depth (metadata->'folders', GIN index), or the direct parent
+    -- for chunks ingested before folders was recorded
+    v_where := v_where || format(' and (metadata @> %L::jsonb or folder = %L)',
+      jsonb_build_object('folders', jsonb_build_array(filter_folder)), filter_folder);
+  end if;
+  if modified_after is not null then
+    v_where := v_where || format(' and modified_time >= %L::timestamptz', modified_after);
+  end if;
+  if modified_before is not null then
+    v_where := v_where || format(' and modified_time < %L::timestamptz', modified_before);
+  end if;
+  return v_where;
+end;
+$$;
+
+-- Per query vector index settings, local to the transaction of the search
+-- ef_search (HNSW) and probes (IVFFlat) trade recall for speed, null keeps the server defaults.
+-- ef_search is raised to at least candidate_count, the number of rows the search takes from the index
+-- (an HNSW scan returns at most ef_search rows, so the default of 40 would cut off larger searches).
+-- Filtered searches use iterative index scans (pgvector 0.8+), so the vector index keeps scanning until
+-- enough rows pass the filter instead of returning fewer than match_count rows
+DROP FUNCTION IF EXISTS set_vector_search_settings(int, int, boolean);
+CREATE OR REPLACE FUNCTION set_vector_search_settings (
+  ef_search int default null,
+  probes int default null,
+  filtered boolean default false,
+  candidate_count int default null
+) returns void
+language plpgsql
+as $$
+declare
+  v_ef_search int := coalesce(ef_search, nullif(current_setting('hnsw.ef_search', true), '')::int, 40);
+begin
+  if ef_search is not null or v_ef_search < candidate_count then
+    -- 1000 is the largest ef_search pgvector accepts
+    perform set_config('hnsw.ef_search', least(greatest(v_ef_search, candidate_count), 1000)::text, true);
+  end if;
+  if probes is not null then
+    perform set_config('ivfflat.probes', probes::text, true);
+  end if;
+
+  if filtered then
+    if current_setting('hnsw.iterative_scan', true) is not null then
+      perform set_config('hnsw.iterative_scan', 'strict_order', true);
+    end if;
+    if current_setting('ivfflat.iterative_scan', true) is not null then
+      perform set_config('ivfflat.iterative_scan', 'relaxed_order', true);
+    end if;
+  end if;
+end;
+$$;
+
 -- Create a function to search for documents
+-- The filter_* and modified_* arguments restrict the search to matching chunks (see documents_filter_sql)
+DROP FUNCTION IF EXISTS match_documents(vector, int, jsonb);
+DROP FUNCTION IF EXISTS match_documents(vector, int, jsonb, int, int);
 CREATE OR REPLACE FUNCTION match_documents (
   query_embedding vector(1536), -- 1536 works for OpenAI embeddings, change if needed like 768 for nomic-embed-text (Ollama)
   match_count int default null,
-  filter jsonb DEFAULT '{}'
+  filter jsonb DEFAULT '{}',
+  ef_search int default null,
+  probes int default null,
+  filter_file_ids text[] default null,
+  filter_mime_type text default null,
+  filter_folder text default null,
+  modified_after timestamptz default null,
+  modified_before timestamptz default null
 ) returns table (
   id bigint,
   content text,
@@ -22,17 +145,153 @@ CREATE OR REPLACE FUNCTION match_documents (
 )
 language plpgsql
 as $$
-#variable_conflict use_column
+declare
+  v_where text := documents_filter_sql(filter, filter_file_ids, filter_mime_type, filter_folder,
+                                       modified_after, modified_before);
+begin
+  perform set_vector_search_settings(ef_search, probes, v_where <> documents_filter_sql(), match_count);
+
+  -- Dynamic so each call is planned for the filters it actually uses, the outer sort puts
+  -- relaxed_order results back in order
+  return query execute format(
+    'select * from (
+       select id, content, metadata, 1 - (embedding <=> $1) as similarity
+       from documents
+       where %s
+       order by embedding <=> $1
+       limit $2
+     ) matches
+     order by similarity desc',
+    v_where
+  )
+  using query_embedding, match_count;
+end;
+$$;
+
+-- Hybrid search: full-text and vector search merged with reciprocal rank fusion in one round-trip
+-- Each side ranks its own candidates and every chunk scores weight / (rrf_k + rank) for each list it is in,
+-- so chunks matching the exact terms of the query (names, part numbers) surface even when their embedding
+-- isn't among the nearest ones. The query terms are OR-ed, chunks matching more of them rank higher.
+-- Takes the same filters and vector index settings as match_documents
+CREATE OR REPLACE FUNCTION hybrid_search_documents (
+  query_text text,
+  query_embedding vector(1536), -- 1536 works for OpenAI embeddings, change if needed like 768 for nomic-embed-text (Ollama)
+  match_count int default 4,
+  full_text_weight float default 1,
+  semantic_weight float default 1,
+  rrf_k int default 50,
+  filter jsonb DEFAULT '{}',
+  ef_search int default null,
+  probes int default null,
+  filter_file_ids text[] default null,
+  filter_mime_type text default null,
+  filter_folder text default null,
+  modified_after timestamptz default null,
+  modified_before timestamptz default null
+) returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float
+)
+language plpgsql
+as $$
+declare
+  v_where text := documents_filter_sql(filter, filter_file_ids, filter_mime_type, filter_folder,
+                                       modified_after, modified_before);
+  v_query tsquery := nullif(replace(plainto_tsquery('english', query_text)::text, ' & ', ' | '), '')::tsquery;
+  -- Candidates taken from each list before fusing
+  v_candidates int := greatest(match_count, 1) * 4;
 begin
-  return query
-  select
-    id,
-    content,
-    metadata,
-    1 - (documents.embedding <=> query_embedding) as similarity
+  perform set_vector_search_settings(ef_search, probes, v_where <> documents_filter_sql(), v_candidates);
+
+  return query execute format(
+    'with full_text as (
+       select id, row_number() over (order by ts_rank_cd(fts, $1) desc) as rank_ix
+       from documents
+       where fts @@ $1 and %1$s
+       order by ts_rank_cd(fts, $1) desc
+       limit $3
+     ),
+     semantic as (
+       select id, row_number() over (order by embedding <=> $2) as rank_ix
+       from (
+         select id, embedding
+         from documents
+         where %1$s
+         order by embedding <=> $2
+         limit $3
+       ) nearest
+     )
+     select documents.id, documents.content, documents.metadata,
+       1 - (documents.embedding <=> $2) as similarity,
+       coalesce($5 / ($7 + full_text.rank_ix), 0.0) + coalesce($6 / ($7 + semantic.rank_ix), 0.0) as score
+     from full_text
+     full outer join semantic on full_text.id = semantic.id
+     join documents on documents.id = coalesce(full_text.id, semantic.id)
+     order by score desc
+     limit $4',
+    v_where
+  )
+  using v_query, query_embedding, v_candidates, match_count, full_text_weight, semantic_weight, rrf_k;
+end;
+$$;
+
+-- Version of the stored chunks of one file: md5 of every chunk's "id:chunk_hash", ordered by id
+-- The RAG pipeline computes the same from the chunks it diffed against (see chunk_version in db_handler.py)
+CREATE OR REPLACE FUNCTION document_chunk_version (
+  p_file_id text
+) returns text
+language sql
+stable
+as $$
+  select md5(coalesce(string_agg(id::text || ':' || coalesce(metadata->>'chunk_hash', ''), E'\n' order by id), ''))
   from documents
-  where metadata @> filter
-  order by documents.embedding <=> query_embedding
-  limit match_count;
+  where metadata->>'file_id' = p_file_id;
+$$;
+
+-- Atomically apply an incremental update to the chunks of one file
+-- Used by the RAG pipeline when update_mode is "incremental" so readers never see a half-updated document.
+-- The diff is computed from a read of the stored chunks, so p_expected_version must match the chunks as
+-- they are now, otherwise another update got in between and the stale diff is rejected.
+-- (The tabular rows of the file in document_rows are loaded separately and aren't part of this transaction)
+DROP FUNCTION IF EXISTS apply_document_chunk_diff(text, bigint[], jsonb, jsonb, jsonb);
+CREATE OR REPLACE FUNCTION apply_document_chunk_diff (
+  p_file_id text,
+  p_delete_ids bigint[] DEFAULT '{}',
+  p_reindex jsonb DEFAULT '[]', -- [{"id": 1, "chunk_index": 3}, ...] for chunks that moved
+  p_new_chunks jsonb DEFAULT '[]', -- [{"content": ..., "metadata": {...}, "embedding": [...]}, ...]
+  p_metadata jsonb DEFAULT '{}', -- metadata to refresh on every chunk of the file (title, url, ...)
+  p_expected_version text DEFAULT null -- document_chunk_version the diff was computed against
+) returns void
+language plpgsql
+as $$
+begin
+  -- Serialize updates of the same file, then make sure the diff still applies
+  perform pg_advisory_xact_lock(hashtextextended(p_file_id, 0));
+  if p_expected_version is not null and document_chunk_version(p_file_id) <> p_expected_version then
+    raise exception 'Stale chunk diff for file %: the stored chunks changed since they were read', p_file_id
+      using errcode = '40001';
+  end if;
+
+  delete from documents
+  where id = any(p_delete_ids)
+    and metadata->>'file_id' = p_file_id;
+
+  update documents
+  set metadata = documents.metadata || jsonb_build_object('chunk_index', (r->>'chunk_index')::int)
+  from jsonb_array_elements(p_reindex) as r
+  where documents.id = (r->>'id')::bigint
+    and documents.metadata->>'file_id' = p_file_id;
+
+  update documents
+  set metadata = metadata || p_metadata
+  where metadata->>'file_id' = p_file_id
+    and not metadata @> p_metadata;
+
+  insert into documents (content, metadata, embedding)
+  select c->>'content', c->'metadata', (c->>'embedding')::vector
+  from jsonb_array_elements(p_new_chunks) as c;
 end;
 $$;
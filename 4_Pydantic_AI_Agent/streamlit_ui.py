@@ -14,10 +14,6 @@ from pydantic_ai.messages import (
     UserPromptPart, PartDeltaEvent, PartStartEvent, TextPartDelta
 )
 
-@st.cache_resource
-def get_agent_deps():
-    return get_agent_clients()
-
 @st.cache_resource
 def initialize_mem0():
     return get_mem0_client()
@@ -44,9 +40,11 @@ async def run_agent_with_streaming(user_input):
     memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"]) 
 
     # Set up the dependencies for the agent
-    embedding_client, supabase = get_agent_deps()
+    # The async clients are bound to the event loop they're first used on and every Streamlit rerun
+    # starts a new one with asyncio.run, so they're created per run instead of cached with st.cache_resource
+    embedding_client, supabase = get_agent_clients()
 
-    async with AsyncClient() as http_client:
+    async with AsyncClient() as http_client, embedding_client:
         agent_deps = AgentDeps(
             embedding_client=embedding_client, 
             supabase=supabase, 
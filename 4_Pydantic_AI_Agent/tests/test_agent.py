@@ -157,7 +157,9 @@ class TestAgentCore:
         mock_retrieve_docs_tool.assert_called_once_with(
             mock_deps.supabase,
             mock_deps.embedding_client,
-            "test query"
+            "test query",
+            file_ids=None, mime_type=None, folder=None, modified_after=None, modified_before=None,
+            match_count=None, search_mode=None, rrf_k=None, full_text_weight=None, semantic_weight=None
         )
         
         # Verify the result
@@ -208,7 +210,8 @@ class TestAgentCore:
         # Verify the get_document_content_tool was called with the right parameters
         mock_get_doc_content_tool.assert_called_once_with(
             mock_deps.supabase,
-            "doc1"
+            "doc1",
+            offset=0, limit=None, max_tokens=None
         )
         
         # Verify the result
@@ -11,7 +11,7 @@ from clients import get_agent_clients, get_mem0_client
 
 class TestGetAgentClients:
     @patch('clients.AsyncOpenAI')
-    @patch('clients.Client')
+    @patch('clients.AsyncClient')
     @patch('clients.os.getenv')
     def test_get_agent_clients(self, mock_getenv, mock_client, mock_async_openai):
         # Configure mock environment variables
@@ -47,7 +47,7 @@ class TestGetAgentClients:
             api_key='test-api-key'
         )
         
-        # Assert Client was called with the correct parameters
+        # Assert the async Supabase client was created with the correct parameters
         mock_client.assert_called_once_with(
             'https://test-supabase-url.com',
             'test-supabase-key'
@@ -3,6 +3,9 @@ import sys
 import os
 import json
 import base64
+import itertools
+import asyncio
+import sqlite3
 from unittest.mock import patch, MagicMock, AsyncMock, call
 
 # Mock environment variables before importing modules that use them
@@ -37,8 +40,9 @@ with patch.dict(os.environ, {
             
             # Import tools from their new locations
             from tools.web.search import brave_web_search, searxng_web_search, web_search_tool
-            from tools.common.embedding import get_embedding
+            from tools.common.embedding import get_embedding, QueryEmbeddingCache, normalize_query
             from tools.document.retrieval import retrieve_relevant_documents_tool, list_documents_tool, get_document_content_tool
+            from tools.document.reranking import rerank_chunks, rerank_documents, score_in_batches
             from tools.image.analysis import image_analysis_tool
             from tools.code.execution import execute_safe_code_tool
 
@@ -231,6 +235,13 @@ class TestWebSearchTools:
 openai_client_mock = mock_client
 
 class TestEmbeddingTools:
+    @pytest.fixture(autouse=True)
+    def query_cache(self):
+        # A fresh cache per test so earlier tests' queries don't turn into hits
+        cache = QueryEmbeddingCache(max_entries=16)
+        with patch('tools.common.embedding.get_query_embedding_cache', return_value=cache):
+            yield cache
+
     @pytest.mark.asyncio
     async def test_get_embedding_success(self):
         # Mock OpenAI client embeddings create method
@@ -274,6 +285,143 @@ class TestEmbeddingTools:
         # Verify the exception was raised
         assert "Test exception" in str(excinfo.value)
 
+    @pytest.mark.asyncio
+    async def test_get_embedding_cached(self, query_cache):
+        """Test that repeated and trivially different queries reuse the cached embedding"""
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.return_value = MagicMock(data=[MagicMock(embedding=[0.1, 0.2, 0.3])])
+        
+        first = await get_embedding("What is the revenue?", mock_client)
+        second = await get_embedding("  what is the\nREVENUE? ", mock_client)
+        
+        assert first == second == [0.1, 0.2, 0.3]
+        mock_client.embeddings.create.assert_called_once()
+        assert query_cache.stats()["hit_rate"] == 0.5
+
+
+class TestQueryEmbeddingCache:
+    def test_normalize_query(self):
+        assert normalize_query("  Hello\n  World ") == "hello world"
+
+    def test_keyed_by_model(self):
+        cache = QueryEmbeddingCache()
+        cache.put("query", "model-a", [1.0])
+        
+        assert cache.get("query", "model-a") == [1.0]
+        assert cache.get("query", "model-b") is None
+
+    def test_lru_eviction(self):
+        cache = QueryEmbeddingCache(max_entries=2)
+        cache.put("a", "m", [1.0])
+        cache.put("b", "m", [2.0])
+        cache.get("a", "m")
+        cache.put("c", "m", [3.0])
+        
+        assert cache.get("b", "m") is None
+        assert cache.get("a", "m") == [1.0]
+        assert cache.get("c", "m") == [3.0]
+
+    def test_ttl_expiry(self):
+        cache = QueryEmbeddingCache(ttl=60)
+        with patch('tools.common.embedding.time.time', return_value=1000):
+            cache.put("query", "m", [1.0])
+        with patch('tools.common.embedding.time.time', return_value=1059):
+            assert cache.get("query", "m") == [1.0]
+        with patch('tools.common.embedding.time.time', return_value=1061):
+            assert cache.get("query", "m") is None
+
+    def test_disk_tier_is_shared(self, tmp_path):
+        """Test that a cache opened on the same file (another process) gets hits from the disk tier"""
+        path = str(tmp_path / "queries.sqlite")
+        writer = QueryEmbeddingCache(disk_path=path)
+        writer.put("query", "m", [0.5, 0.25])
+        reader = QueryEmbeddingCache(disk_path=path)
+        
+        assert reader.get("query", "m") == [0.5, 0.25]
+        assert reader.get("query", "m") == [0.5, 0.25]
+        assert reader.stats() == {"memory_hits": 1, "disk_hits": 1, "misses": 0, "hit_rate": 1.0, "memory_entries": 1,
+                                  "disk_bytes": 16}
+        writer.close()
+        reader.close()
+
+    def test_disk_size_eviction(self, tmp_path):
+        """Test that the least recently used entries are evicted once the disk tier is over its size limit"""
+        # Room for two vectors of 4 doubles (32 bytes each)
+        cache = QueryEmbeddingCache(max_entries=0, ttl=0, disk_path=str(tmp_path / "queries.sqlite"), max_disk_bytes=64)
+        with patch('tools.common.embedding.time.time', side_effect=itertools.count(1)):
+            cache.put("a", "m", [1.0] * 4)
+            cache.put("b", "m", [2.0] * 4)
+            cache.get("a", "m")
+            cache.put("c", "m", [3.0] * 4)
+        
+        assert cache.get("b", "m") is None
+        assert cache.get("a", "m") == [1.0] * 4
+        assert cache.get("c", "m") == [3.0] * 4
+        cache.close()
+
+    def test_disk_size_is_tracked_without_scanning(self, tmp_path):
+        """Test that puts keep a running total of the disk tier instead of summing the table each time"""
+        path = str(tmp_path / "queries.sqlite")
+        cache = QueryEmbeddingCache(max_entries=0, disk_path=path, max_disk_bytes=1024)
+        with patch.object(cache, '_count_disk_bytes', wraps=cache._count_disk_bytes) as mock_count:
+            cache.put("a", "m", [1.0] * 4)
+            cache.put("a", "m", [1.0] * 2)
+            cache.put("b", "m", [2.0] * 4)
+        
+        mock_count.assert_not_called()
+        assert cache.stats()["disk_bytes"] == 48
+        # Reopening the file counts what's already stored
+        assert QueryEmbeddingCache(disk_path=path).stats()["disk_bytes"] == 48
+        cache.close()
+
+    @pytest.mark.asyncio
+    async def test_disk_errors_dont_break_lookups(self, tmp_path, capfd):
+        """Test that a locked or broken disk tier counts as a miss and skips the write instead of failing"""
+        cache = QueryEmbeddingCache(max_entries=0, disk_path=str(tmp_path / "queries.sqlite"))
+        cache._conn = MagicMock()
+        cache._conn.execute.side_effect = sqlite3.OperationalError("database is locked")
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.return_value = MagicMock(data=[MagicMock(embedding=[0.1])])
+        
+        with patch('tools.common.embedding.get_query_embedding_cache', return_value=cache):
+            assert await get_embedding("query", mock_client) == [0.1]
+        
+        out = capfd.readouterr().out
+        assert "Error reading query embedding cache: database is locked" in out
+        assert "Error writing query embedding cache: database is locked" in out
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["disk_bytes"] == 0
+
+    @pytest.mark.asyncio
+    async def test_async_disk_access_runs_in_thread(self, tmp_path):
+        """Test that the on-disk tier is read and written off the event loop, memory hits aren't"""
+        cache = QueryEmbeddingCache(disk_path=str(tmp_path / "queries.sqlite"))
+        with patch('tools.common.embedding.asyncio.to_thread', wraps=asyncio.to_thread) as mock_to_thread:
+            await cache.aput("query", "m", [0.5])
+            cache._entries.clear()
+            assert await cache.aget("query", "m") == [0.5]
+            assert await cache.aget("query", "m") == [0.5]
+        
+        assert mock_to_thread.call_count == 2
+        assert cache.stats()["disk_hits"] == 1
+        assert cache.stats()["memory_hits"] == 1
+        cache.close()
+
+    @pytest.mark.asyncio
+    async def test_get_embedding_logs_stats(self, capfd):
+        """Test that the hit rate is printed every QUERY_EMBEDDING_CACHE_LOG_EVERY lookups"""
+        cache = QueryEmbeddingCache()
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.return_value = MagicMock(data=[MagicMock(embedding=[0.1])])
+        
+        with patch('tools.common.embedding.get_query_embedding_cache', return_value=cache), \
+             patch('tools.common.embedding.QUERY_EMBEDDING_CACHE_LOG_EVERY', 2):
+            await get_embedding("query", mock_client)
+            assert "Query embedding cache" not in capfd.readouterr().out
+            await get_embedding("query", mock_client)
+        
+        assert "Query embedding cache: 1 memory hits, 0 disk hits, 1 misses (hit rate 50%)" in capfd.readouterr().out
+
 
 class TestDocumentTools:
     @pytest.mark.asyncio
@@ -289,7 +437,7 @@ class TestDocumentTools:
         
         # Configure the mock response for rpc
         mock_supabase.rpc.return_value = mock_rpc
-        mock_rpc.execute.return_value = mock_execute
+        mock_rpc.execute = AsyncMock(return_value=mock_execute)
         
         # The data structure that matches our expected format with valid JSON strings for metadata
         mock_execute.data = [
@@ -321,6 +469,93 @@ class TestDocumentTools:
         assert "Document 2: Document content 2" in result
         assert "Source: source2.txt" in result
 
+    @pytest.mark.asyncio
+    @patch('tools.document.retrieval.get_embedding')
+    async def test_retrieve_relevant_documents_tool_index_settings(self, mock_get_embedding):
+        """Test that the per query vector index settings are passed to match_documents"""
+        mock_get_embedding.return_value = [0.1, 0.2, 0.3]
+        mock_supabase = MagicMock()
+        mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+        
+        await retrieve_relevant_documents_tool(mock_supabase, MagicMock(), "test query", ef_search=100, probes=10)
+        
+        mock_supabase.rpc.assert_called_once_with(
+            'match_documents',
+            {'query_embedding': [0.1, 0.2, 0.3], 'match_count': 4, 'ef_search': 100, 'probes': 10}
+        )
+
+    @pytest.mark.asyncio
+    @patch('tools.document.retrieval.get_embedding')
+    async def test_retrieve_relevant_documents_tool_filters(self, mock_get_embedding):
+        """Test that only the filters that are set are passed to match_documents"""
+        mock_get_embedding.return_value = [0.1, 0.2, 0.3]
+        mock_supabase = MagicMock()
+        mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+        
+        await retrieve_relevant_documents_tool(mock_supabase, MagicMock(), "test query", file_ids=["file1", "file2"],
+                                               mime_type="application/pdf", modified_after="2024-01-01")
+        
+        mock_supabase.rpc.assert_called_once_with(
+            'match_documents',
+            {
+                'query_embedding': [0.1, 0.2, 0.3],
+                'match_count': 4,
+                'filter_file_ids': ["file1", "file2"],
+                'filter_mime_type': "application/pdf",
+                'modified_after': "2024-01-01"
+            }
+        )
+
+    @pytest.mark.asyncio
+    @patch('tools.document.retrieval.get_embedding')
+    async def test_retrieve_relevant_documents_tool_hybrid(self, mock_get_embedding):
+        """Test that hybrid mode sends the query text and fusion settings to hybrid_search_documents"""
+        mock_get_embedding.return_value = [0.1, 0.2, 0.3]
+        mock_supabase = MagicMock()
+        mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+            {'content': 'Part XJ-200 specs', 'metadata': None}
+        ]))
+        
+        result = await retrieve_relevant_documents_tool(mock_supabase, MagicMock(), "XJ-200", search_mode="hybrid",
+                                                        match_count=50, full_text_weight=2.0, semantic_weight=0)
+        
+        mock_supabase.rpc.assert_called_once_with(
+            'hybrid_search_documents',
+            {
+                'query_embedding': [0.1, 0.2, 0.3],
+                'match_count': 20,
+                'query_text': "XJ-200",
+                'rrf_k': 50,
+                'full_text_weight': 2.0,
+                'semantic_weight': 0
+            }
+        )
+        assert "Document 1: Part XJ-200 specs" in result
+
+    @pytest.mark.asyncio
+    @patch('tools.document.retrieval.get_embedding')
+    async def test_retrieve_relevant_documents_tool_rerank(self, mock_get_embedding):
+        """Test that reranking over-fetches candidates and returns the best match_count of them"""
+        mock_get_embedding.return_value = [0.1, 0.2, 0.3]
+        mock_supabase = MagicMock()
+        mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+            {'content': 'Shipping policy overview', 'metadata': None},
+            {'content': 'Warranty terms', 'metadata': None},
+            {'content': 'The XJ-200 pump warranty lasts two years', 'metadata': None}
+        ]))
+        
+        with patch('tools.document.retrieval.RERANK_CANDIDATES', 12):
+            result = await retrieve_relevant_documents_tool(mock_supabase, MagicMock(), "XJ-200 warranty",
+                                                            match_count=1, rerank="lexical")
+        
+        assert mock_supabase.rpc.call_args[0][1]['match_count'] == 12
+        assert result == "Document 1: The XJ-200 pump warranty lasts two years\n"
+
+    @pytest.mark.asyncio
+    async def test_retrieve_relevant_documents_tool_unknown_mode(self):
+        result = await retrieve_relevant_documents_tool(MagicMock(), MagicMock(), "test query", search_mode="keyword")
+        assert result.startswith("Unknown search mode: keyword")
+
     @pytest.mark.asyncio
     @patch('tools.document.retrieval.get_embedding')
     async def test_retrieve_relevant_documents_tool_no_results(self, mock_get_embedding):
@@ -332,7 +567,7 @@ class TestDocumentTools:
         mock_rpc = MagicMock()
         mock_execute = MagicMock()
         mock_supabase.rpc.return_value = mock_rpc
-        mock_rpc.execute.return_value = mock_execute
+        mock_rpc.execute = AsyncMock(return_value=mock_execute)
         mock_execute.data = []
         
         # Test the function
@@ -365,7 +600,7 @@ class TestDocumentTools:
         
         # Configure the mock response
         mock_supabase.table.return_value = mock_table
-        mock_table.select.return_value.execute.return_value = mock_execute
+        mock_table.select.return_value.execute = AsyncMock(return_value=mock_execute)
         
         # Mock data with document metadata
         mock_execute.data = [
@@ -398,6 +633,45 @@ class TestDocumentTools:
         assert "ID: doc1 - Document 1 from Source 1 (pdf)" in result[0]
         assert "ID: doc2 - Document 2 from Source 2 (csv) (Schema: {\"column1\": \"string\", \"column2\": \"number\"})" in result[1]
 
+    @pytest.mark.asyncio
+    async def test_list_documents_tool_typed_table(self):
+        # Mock Supabase client with a tabular document that has a typed table
+        mock_supabase = MagicMock()
+        mock_supabase.table.return_value.select.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+            {
+                'id': 'doc1',
+                'title': 'Sales',
+                'source': 'Source 1',
+                'file_type': 'csv',
+                'schema': '{"region": "text", "sales": "number"}',
+                'dataset_table': 'datasets.dataset_0123456789abcdef'
+            }
+        ]))
+        
+        # Test the function
+        result = await list_documents_tool(mock_supabase)
+        
+        # Verify the typed table is listed for the SQL tool
+        assert result[0].endswith("(Typed table: datasets.dataset_0123456789abcdef)")
+
+    @pytest.mark.asyncio
+    async def test_list_documents_tool_renamed_typed_columns(self):
+        # Columns that clashed with row_id (or each other) are renamed in the typed table
+        mock_supabase = MagicMock()
+        mock_supabase.table.return_value.select.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+            {
+                'id': 'doc1',
+                'title': 'Sales',
+                'schema': '{"row_id": "integer", "sales": "number"}',
+                'dataset_table': 'datasets.dataset_0123456789abcdef',
+                'dataset_columns': {'row_id': 'row_id_2', 'sales': 'sales'}
+            }
+        ]))
+        
+        result = await list_documents_tool(mock_supabase)
+        
+        assert result[0].endswith('(Typed table: datasets.dataset_0123456789abcdef) (Renamed typed table columns: {"row_id": "row_id_2"})')
+
     @pytest.mark.asyncio
     async def test_list_documents_tool_exception(self):
         # Mock Supabase client that raises an exception
@@ -424,11 +698,11 @@ class TestDocumentTools:
         
         # Configure the first call to check if document exists
         mock_supabase.table.return_value = mock_table
-        mock_table.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[{'id': 'doc1'}])
+        mock_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[{'id': 'doc1'}]))
         
         # Need to reset the mock for the second call to get chunks
         mock_table.reset_mock()
-        mock_table.select.return_value.eq.return_value.order.return_value.execute.return_value = mock_execute
+        mock_table.select.return_value.eq.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=mock_execute)
         
         # Mock chunks data
         mock_execute.data = [
@@ -439,6 +713,7 @@ class TestDocumentTools:
                 'content': 'Document content part 2',
             }
         ]
+        mock_execute.count = 2
         
         # Test the function
         result = await get_document_content_tool(mock_supabase, 'doc1')
@@ -459,12 +734,13 @@ class TestDocumentTools:
         
         # Configure the first call to check if document exists
         mock_supabase.table.return_value = mock_table
-        mock_table.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[{'id': 'doc1'}])
+        mock_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[{'id': 'doc1'}]))
         
         # Need to reset the mock for the second call to get chunks
         mock_table.reset_mock()
-        mock_table.select.return_value.eq.return_value.order.return_value.execute.return_value = mock_execute
+        mock_table.select.return_value.eq.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=mock_execute)
         mock_execute.data = []
+        mock_execute.count = 0
         
         # Test the function
         result = await get_document_content_tool(mock_supabase, 'doc1')
@@ -472,6 +748,53 @@ class TestDocumentTools:
         # Verify the result for no content
         assert result == "No content chunks found for document with ID doc1."
 
+    @pytest.mark.asyncio
+    async def test_get_document_content_tool_pages(self):
+        """Test reading a window of a long document page by page, selecting only the chunk content"""
+        chunks = [f"chunk {i} " + "x" * 36 for i in range(100)]  # about 12 tokens each
+        pages = []
+        
+        def documents_table():
+            table = MagicMock()
+            query = table.select.return_value.eq.return_value.order.return_value
+            def range_(start, end):
+                pages.append((start, end))
+                response = MagicMock(data=[{'content': chunk} for chunk in chunks[start:end + 1]], count=len(chunks))
+                return MagicMock(execute=AsyncMock(return_value=response))
+            query.range.side_effect = range_
+            return table
+        
+        metadata_table = MagicMock()
+        metadata_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[{'id': 'doc1'}]))
+        tables = {'document_metadata': metadata_table, 'documents': documents_table()}
+        mock_supabase = MagicMock()
+        mock_supabase.table.side_effect = lambda name: tables[name]
+        
+        result = await get_document_content_tool(mock_supabase, 'doc1', offset=10, max_tokens=300)
+        
+        assert tables['documents'].select.call_args_list == [call('content', count='exact'), call('content')]
+        tables['documents'].select.return_value.eq.assert_called_with('file_id', 'doc1')
+        assert result.startswith(chunks[10])
+        assert chunks[34] in result and chunks[35] not in result
+        assert result.endswith("[Showing chunks 10-34 of 100. Call get_document_content with offset=35 to continue reading.]")
+        # Only the pages needed for the window were fetched
+        assert pages == [(10, 29), (30, 49)]
+
+    @pytest.mark.asyncio
+    async def test_get_document_content_tool_limit(self):
+        mock_supabase = MagicMock()
+        mock_table = MagicMock()
+        mock_supabase.table.return_value = mock_table
+        mock_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[{'id': 'doc1'}]))
+        mock_table.select.return_value.eq.return_value.order.return_value.range.return_value.execute = AsyncMock(
+            return_value=MagicMock(data=[{'content': 'a'}, {'content': 'b'}], count=2)
+        )
+        
+        result = await get_document_content_tool(mock_supabase, 'doc1', limit=2)
+        
+        assert result == "a\nb"
+        mock_table.select.return_value.eq.return_value.order.return_value.range.assert_called_once_with(0, 1)
+
     @pytest.mark.asyncio
     async def test_get_document_content_tool_exception(self):
         # Mock Supabase client that raises an exception
@@ -487,6 +810,60 @@ class TestDocumentTools:
         assert "Error retrieving document content: Test exception" in result
 
 
+class TestReranking:
+    def test_lexical_rerank(self):
+        """Test that chunks sharing more (and rarer) query terms move to the top"""
+        chunks = [
+            {'content': 'General product catalog'},
+            {'content': 'Pump maintenance schedule'},
+            {'content': 'XJ-200 pump maintenance schedule'}
+        ]
+        
+        result = rerank_chunks("XJ-200 pump maintenance", chunks, top_k=2)
+        
+        assert [chunk['content'] for chunk in result] == ['XJ-200 pump maintenance schedule', 'Pump maintenance schedule']
+
+    def test_ties_keep_retrieval_order(self):
+        chunks = [{'content': 'first'}, {'content': 'second'}, {'content': 'third'}]
+        assert rerank_chunks("unrelated", chunks, top_k=3) == chunks
+
+    def test_latency_budget(self):
+        """Test that no new batch starts after the deadline and unscored chunks keep their order after the scored ones"""
+        calls = []
+        def score_batch(batch):
+            calls.append(list(batch))
+            return [len(text) for text in batch]
+        
+        scores = score_in_batches(score_batch, ["a", "bb", "ccc", "dddd"], batch_size=2, deadline=0)
+        
+        assert scores == [1.0, 2.0]
+        assert calls == [["a", "bb"]]
+
+    @pytest.mark.asyncio
+    async def test_cross_encoder_falls_back_to_lexical(self):
+        """Test that the lexical scorer is used when the cross-encoder model can't be loaded"""
+        chunks = [{'content': 'unrelated'}, {'content': 'pump manual'}]
+        
+        with patch('tools.document.reranking.get_cross_encoder', side_effect=ImportError("no sentence-transformers")), \
+             patch('builtins.print') as mock_print:
+            result = await rerank_documents("pump", chunks, top_k=1, method="cross-encoder")
+        
+        assert result == [{'content': 'pump manual'}]
+        assert "using lexical reranking" in mock_print.call_args[0][0]
+
+    @pytest.mark.asyncio
+    async def test_cross_encoder(self):
+        mock_model = MagicMock()
+        mock_model.predict.side_effect = lambda pairs, batch_size: [0.1 if 'a' in text else 0.9 for _, text in pairs]
+        chunks = [{'content': 'a'}, {'content': 'b'}]
+        
+        with patch('tools.document.reranking.get_cross_encoder', return_value=mock_model):
+            result = await rerank_documents("query", chunks, top_k=2, method="cross-encoder")
+        
+        assert result == [{'content': 'b'}, {'content': 'a'}]
+        mock_model.predict.assert_called_once_with([("query", "a"), ("query", "b")], batch_size=16)
+
+
 class TestImageAnalysisTool:
     @pytest.mark.asyncio
     async def test_image_analysis_tool_success(self):
@@ -525,13 +902,13 @@ class TestImageAnalysisTool:
             metadata_response = MagicMock()
             metadata_response.data = [{'file_type': 'jpg'}]
             metadata_table = MagicMock()
-            metadata_table.select.return_value.eq.return_value.execute.return_value = metadata_response
+            metadata_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=metadata_response)
             
             # Setup binary response
             binary_response = MagicMock()
             binary_response.data = [{'binary_data': 'dGVzdCBiYXNlNjQgZGF0YQ==', 'mime_type': 'image/jpeg'}]
             binary_table = MagicMock()
-            binary_table.select.return_value.eq.return_value.execute.return_value = binary_response
+            binary_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=binary_response)
             
             # Configure table method to return different mocks based on the table name
             def mock_table(table_name):
@@ -562,7 +939,7 @@ class TestImageAnalysisTool:
         mock_execute = MagicMock()
         
         mock_supabase.table.return_value = mock_table
-        mock_table.select.return_value.eq.return_value.execute.return_value = mock_execute
+        mock_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=mock_execute)
         
         # Configure the mock to return empty data
         mock_execute.data = []
@@ -582,13 +959,13 @@ class TestImageAnalysisTool:
         metadata_response = MagicMock()
         metadata_response.data = [{'file_type': 'jpg'}]
         metadata_table = MagicMock()
-        metadata_table.select.return_value.eq.return_value.execute.return_value = metadata_response
+        metadata_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=metadata_response)
         
         # Setup empty binary response
         binary_response = MagicMock()
         binary_response.data = []
         binary_table = MagicMock()
-        binary_table.select.return_value.eq.return_value.execute.return_value = binary_response
+        binary_table.select.return_value.eq.return_value.execute = AsyncMock(return_value=binary_response)
         
         # Configure table method
         def mock_table(table_name):
@@ -612,7 +989,7 @@ class TestImageAnalysisTool:
         # Mock Supabase client to raise an exception
         mock_supabase = MagicMock()
         mock_table = MagicMock()
-        mock_table.select.return_value.eq.return_value.execute.side_effect = Exception("Database error")
+        mock_table.select.return_value.eq.return_value.execute = AsyncMock(side_effect=Exception("Database error"))
         mock_supabase.table.return_value = mock_table
         
         # Test the function
@@ -219,6 +219,8 @@ async def execute_sql_query_tool(supabase: Client, sql_query: str) -> str:
     Run a SQL query - use this to query from the document_rows table once you know the file ID you are querying. 
     dataset_id is the file_id and you are always using the row_data for filtering, which is a jsonb field that has 
     all the keys from the file schema given in the document_metadata table.
+    The schema maps each column to its type (integer, number, boolean, date, timestamp or text) - numbers and
+    booleans are stored as JSON values, so cast row_data->>'column' to the matching type (numeric, boolean, date, ...).
 
     Example query:
 
@@ -5,28 +5,346 @@ This module provides functions for generating and working with embeddings.
 """
 
 from openai import AsyncOpenAI
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+from array import array
+import threading
+import asyncio
+import hashlib
+import sqlite3
+import time
 import os
 
 # Default embedding model if not specified in environment
 embedding_model = os.getenv('EMBEDDING_MODEL') or 'text-embedding-3-small'
 
+# Query embedding cache settings
+# Repeated queries (including the agent retrying a tool call) reuse the cached vector instead of calling the API.
+# QUERY_EMBEDDING_CACHE_PATH adds an on-disk tier shared by every process using the same file.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv('QUERY_EMBEDDING_CACHE_TTL', '86400'))
+QUERY_EMBEDDING_CACHE_PATH = os.getenv('QUERY_EMBEDDING_CACHE_PATH')
+QUERY_EMBEDDING_CACHE_MAX_MB = float(os.getenv('QUERY_EMBEDDING_CACHE_MAX_MB', '100'))
+# Print the cache hit rate every QUERY_EMBEDDING_CACHE_LOG_EVERY lookups (0 disables it)
+QUERY_EMBEDDING_CACHE_LOG_EVERY = int(os.getenv('QUERY_EMBEDDING_CACHE_LOG_EVERY', '100'))
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query for the embedding cache so trivially different queries share an entry.
+
+    Args:
+        text: The query text
+
+    Returns:
+        str: The text with whitespace collapsed, trimmed and case folded
+    """
+    return " ".join(text.split()).casefold()
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by the normalized query and embedding model.
+
+    An in-process LRU holds the most recent queries. The optional SQLite tier is shared between
+    processes and evicts the least recently used entries once it grows past its size limit.
+    Entries of both tiers expire after the TTL.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400, disk_path: Optional[str] = None,
+                 max_disk_bytes: int = 100 * 1024 * 1024):
+        """
+        Create the cache.
+
+        Args:
+            max_entries: Number of queries kept in memory (0 disables the memory tier)
+            ttl: Seconds an entry stays valid (0 means entries never expire)
+            disk_path: Optional path of the SQLite file for the shared on-disk tier
+            max_disk_bytes: Size of the stored vectors the on-disk tier is trimmed to
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        self._disk_bytes = 0
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+            self._conn.commit()
+            self._disk_bytes = self._count_disk_bytes()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\n{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def _get_memory(self, key: str, now: float) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created_at, embedding = entry
+            if self._expired(created_at, now):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return embedding
+
+    def _get_disk(self, key: str, now: float) -> Optional[List[float]]:
+        with self._lock:
+            if self._conn is not None:
+                # The file is shared between processes, so a busy or broken file is counted as a miss
+                try:
+                    row = self._conn.execute(
+                        "SELECT embedding, created_at FROM query_embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None and not self._expired(row[1], now):
+                        self._conn.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        embedding = array('d', row[0]).tolist()
+                        self._remember(key, row[1], embedding)
+                        self.disk_hits += 1
+                        return embedding
+                except sqlite3.Error as e:
+                    print(f"Error reading query embedding cache: {e}")
+                    self._rollback()
+
+            self.misses += 1
+            return None
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        """
+        Look up the embedding of a query.
+
+        Args:
+            text: The query text
+            model: The embedding model name
+
+        Returns:
+            The cached embedding vector, or None on a miss
+        """
+        key = self.make_key(text, model)
+        now = time.time()
+        embedding = self._get_memory(key, now)
+        if embedding is None:
+            embedding = self._get_disk(key, now)
+        return embedding
+
+    async def aget(self, text: str, model: str) -> Optional[List[float]]:
+        """
+        Look up the embedding of a query without blocking the event loop on the on-disk tier.
+
+        Memory hits return right away, only the SQLite lookup runs in a worker thread.
+
+        Args:
+            text: The query text
+            model: The embedding model name
+
+        Returns:
+            The cached embedding vector, or None on a miss
+        """
+        key = self.make_key(text, model)
+        now = time.time()
+        embedding = self._get_memory(key, now)
+        if embedding is None:
+            if self._conn is not None:
+                embedding = await asyncio.to_thread(self._get_disk, key, now)
+            else:
+                embedding = self._get_disk(key, now)
+        return embedding
+
+    def put(self, text: str, model: str, embedding: List[float]) -> None:
+        """
+        Store the embedding of a query.
+
+        Args:
+            text: The query text
+            model: The embedding model name
+            embedding: The embedding vector
+        """
+        key = self.make_key(text, model)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, embedding)
+
+            if self._conn is not None:
+                # Skip the on-disk tier when the shared file is busy, the entry is still in memory
+                try:
+                    blob = array('d', embedding).tobytes()
+                    old = self._conn.execute("SELECT length(embedding) FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, embedding, created_at, last_used) VALUES (?, ?, ?, ?)",
+                        (key, blob, now, now)
+                    )
+                    disk_bytes = self._disk_bytes + len(blob) - (old[0] if old else 0)
+                    if disk_bytes > self.max_disk_bytes:
+                        disk_bytes = self._evict_disk()
+                    self._conn.commit()
+                    self._disk_bytes = disk_bytes
+                except sqlite3.Error as e:
+                    print(f"Error writing query embedding cache: {e}")
+                    self._rollback()
+
+    def _rollback(self) -> None:
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    async def aput(self, text: str, model: str, embedding: List[float]) -> None:
+        """
+        Store the embedding of a query, writing the on-disk tier in a worker thread.
+
+        Args:
+            text: The query text
+            model: The embedding model name
+            embedding: The embedding vector
+        """
+        if self._conn is not None:
+            await asyncio.to_thread(self.put, text, model, embedding)
+        else:
+            self.put(text, model, embedding)
+
+    def _remember(self, key: str, created_at: float, embedding: List[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (created_at, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _count_disk_bytes(self) -> int:
+        return self._conn.execute("SELECT coalesce(sum(length(embedding)), 0) FROM query_embeddings").fetchone()[0]
+
+    def _evict_disk(self) -> int:
+        # Only runs once the running total is over the limit. Other processes share the file, so the
+        # total is recounted before evicting. Expired entries go first, then the least recently used
+        # ones until the vectors fit the size limit. Returns the size left after evicting
+        if self.ttl:
+            self._conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl,))
+        total = self._count_disk_bytes()
+
+        freed = 0
+        evict = []
+        if total > self.max_disk_bytes:
+            for key, size in self._conn.execute("SELECT key, length(embedding) FROM query_embeddings ORDER BY last_used"):
+                if total - freed <= self.max_disk_bytes:
+                    break
+                evict.append((key,))
+                freed += size
+            self._conn.executemany("DELETE FROM query_embeddings WHERE key = ?", evict)
+        return total - freed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the hit rate metrics of the cache.
+
+        Returns:
+            Dict with the memory/disk hits, misses, hit rate, number of entries in memory and size of the on-disk tier
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "disk_bytes": self._disk_bytes
+            }
+
+    def log_stats(self) -> None:
+        """
+        Print the hit rate metrics of the cache.
+        """
+        stats = self.stats()
+        print(f"Query embedding cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+              f"{stats['misses']} misses (hit rate {stats['hit_rate']:.0%}), {stats['memory_entries']} queries in memory")
+
+    def close(self) -> None:
+        """
+        Close the on-disk tier.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """
+    Get the shared query embedding cache, creating it on first use from the QUERY_EMBEDDING_CACHE_* settings.
+
+    Returns:
+        The shared QueryEmbeddingCache, or None if both tiers are disabled
+    """
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        if QUERY_EMBEDDING_CACHE_SIZE <= 0 and not QUERY_EMBEDDING_CACHE_PATH:
+            return None
+        try:
+            _query_embedding_cache = QueryEmbeddingCache(
+                QUERY_EMBEDDING_CACHE_SIZE,
+                QUERY_EMBEDDING_CACHE_TTL,
+                QUERY_EMBEDDING_CACHE_PATH,
+                int(QUERY_EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+            )
+        except Exception as e:
+            print(f"Error opening query embedding cache at {QUERY_EMBEDDING_CACHE_PATH}: {e}")
+            _query_embedding_cache = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+    return _query_embedding_cache
+
+def _maybe_log_cache_stats(cache: QueryEmbeddingCache) -> None:
+    # Print the hit rate every QUERY_EMBEDDING_CACHE_LOG_EVERY lookups
+    stats = cache.stats()
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    if QUERY_EMBEDDING_CACHE_LOG_EVERY > 0 and lookups % QUERY_EMBEDDING_CACHE_LOG_EVERY == 0:
+        cache.log_stats()
+
 async def get_embedding(text: str, embedding_client: AsyncOpenAI) -> list[float]:
     """
-    Get embedding vector from OpenAI.
-    
+    Get embedding vector from OpenAI, or from the query embedding cache for repeated queries.
+
     Args:
         text: The text to embed
         embedding_client: The OpenAI client to use for embedding
-        
+
     Returns:
         list[float]: The embedding vector
     """
-    try:
-        text = text.replace("\n", " ")
-        result = await embedding_client.embeddings.create(
-            input=[text], 
-            model=embedding_model
-        )
-        return result.data[0].embedding
-    except Exception as e:
-        raise e
+    cache = get_query_embedding_cache()
+    if cache is not None:
+        embedding = await cache.aget(text, embedding_model)
+        _maybe_log_cache_stats(cache)
+        if embedding is not None:
+            return embedding
+
+    result = await embedding_client.embeddings.create(
+        input=[text.replace("\n", " ")],
+        model=embedding_model
+    )
+    embedding = result.data[0].embedding
+
+    if cache is not None:
+        await cache.aput(text, embedding_model, embedding)
+    return embedding
@@ -0,0 +1,185 @@
+"""
+Reranking of retrieved document chunks.
+
+Retrieval over-fetches candidate chunks and a reranker orders them by relevance to the query,
+so the agent gets the best few chunks without extra tool calls.
+"""
+
+from typing import List, Dict, Any, Callable, Optional, Sequence
+from collections import Counter
+from functools import lru_cache
+import asyncio
+import math
+import time
+import re
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Only needed for the cross-encoder reranker
+    CrossEncoder = None
+
+RERANK_METHODS = ("none", "lexical", "cross-encoder")
+DEFAULT_CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase word tokens for lexical scoring.
+
+    Args:
+        text: The text to tokenize
+
+    Returns:
+        List[str]: The tokens
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def bm25_scorer(query: str, texts: Sequence[str], k1: float = 1.2, b: float = 0.75) -> Callable[[Sequence[str]], List[float]]:
+    """
+    Build a BM25 scorer for a query, with term statistics taken from the candidate texts.
+
+    Args:
+        query: The search query
+        texts: All the candidate texts (for the document frequencies and average length)
+        k1: Term frequency saturation
+        b: Length normalization
+
+    Returns:
+        Function scoring a batch of texts against the query
+    """
+    query_terms = set(tokenize(query))
+    documents = [Counter(tokenize(text)) for text in texts]
+    average_length = sum(sum(document.values()) for document in documents) / max(len(documents), 1) or 1
+    idf = {}
+    for term in query_terms:
+        frequency = sum(1 for document in documents if term in document)
+        idf[term] = math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def score(batch: Sequence[str]) -> List[float]:
+        scores = []
+        for text in batch:
+            counts = Counter(tokenize(text))
+            length = sum(counts.values())
+            total = 0.0
+            for term in query_terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    total += idf[term] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+            scores.append(total)
+        return scores
+
+    return score
+
+@lru_cache(maxsize=2)
+def get_cross_encoder(model_name: str = DEFAULT_CROSS_ENCODER_MODEL):
+    """
+    Load a cross-encoder model on the CPU (once per model name).
+
+    Args:
+        model_name: Hugging Face name or local path of the model
+
+    Returns:
+        The sentence-transformers CrossEncoder
+    """
+    if CrossEncoder is None:
+        raise ImportError("sentence-transformers is required for the cross-encoder reranker (pip install sentence-transformers)")
+    return CrossEncoder(model_name, device="cpu")
+
+def score_in_batches(score_batch: Callable[[Sequence[str]], List[float]], texts: Sequence[str],
+                     batch_size: int, deadline: Optional[float] = None) -> List[float]:
+    """
+    Score texts batch by batch, stopping early once the deadline has passed.
+
+    Args:
+        score_batch: Function scoring a batch of texts
+        texts: The texts to score, best retrieval rank first
+        batch_size: Number of texts per batch
+        deadline: Optional time.perf_counter() value after which no new batch is started
+
+    Returns:
+        List[float]: Scores of the first texts (all of them unless the deadline passed)
+    """
+    scores = []
+    for start in range(0, len(texts), batch_size):
+        # Always score the first batch, otherwise a tight budget would disable reranking entirely
+        if scores and deadline is not None and time.perf_counter() >= deadline:
+            break
+        scores.extend(float(score) for score in score_batch(texts[start:start + batch_size]))
+    return scores
+
+def rerank_chunks(query: str, chunks: List[Dict[str, Any]], top_k: int, method: str = "lexical",
+                  batch_size: int = 16, latency_budget_ms: Optional[float] = None,
+                  model_name: str = DEFAULT_CROSS_ENCODER_MODEL) -> List[Dict[str, Any]]:
+    """
+    Order retrieved chunks by relevance to the query and keep the top ones.
+
+    Chunks are scored in batches in their retrieval order. When the latency budget runs out, the
+    chunks that weren't scored keep their retrieval order after the reranked ones.
+
+    Args:
+        query: The search query
+        chunks: Retrieved chunks (rows with a content field), best retrieval rank first
+        top_k: Number of chunks to return
+        method: "lexical" (BM25 over the candidates) or "cross-encoder" (local model, needs sentence-transformers)
+        batch_size: Number of chunks scored per batch
+        latency_budget_ms: Optional time budget for the scoring (model loading isn't counted)
+        model_name: Cross-encoder model to use
+
+    Returns:
+        List of the top_k chunks in their new order
+    """
+    if method == "none" or not chunks:
+        return chunks[:top_k]
+
+    texts = [chunk.get('content') or '' for chunk in chunks]
+    if method == "lexical":
+        score_batch = bm25_scorer(query, texts)
+    elif method == "cross-encoder":
+        model = get_cross_encoder(model_name)
+        score_batch = lambda batch: model.predict([(query, text) for text in batch], batch_size=batch_size)
+    else:
+        raise ValueError(f"Unknown rerank method: {method} (use one of {', '.join(RERANK_METHODS)})")
+
+    deadline = time.perf_counter() + latency_budget_ms / 1000 if latency_budget_ms else None
+    scores = score_in_batches(score_batch, texts, batch_size, deadline)
+
+    # sorted is stable, so equal scores keep their retrieval order
+    order = sorted(range(len(scores)), key=lambda i: -scores[i]) + list(range(len(scores), len(chunks)))
+    return [chunks[i] for i in order[:top_k]]
+
+async def rerank_documents(query: str, chunks: List[Dict[str, Any]], top_k: int, method: str = "lexical",
+                           batch_size: int = 16, latency_budget_ms: Optional[float] = None,
+                           model_name: str = DEFAULT_CROSS_ENCODER_MODEL) -> List[Dict[str, Any]]:
+    """
+    Rerank retrieved chunks without blocking the event loop.
+
+    The cross-encoder runs in a worker thread. If it can't be loaded the lexical scorer is used
+    instead, and if reranking fails the chunks keep their retrieval order.
+
+    Args:
+        query: The search query
+        chunks: Retrieved chunks, best retrieval rank first
+        top_k: Number of chunks to return
+        method: "none", "lexical" or "cross-encoder"
+        batch_size: Number of chunks scored per batch
+        latency_budget_ms: Optional time budget for the scoring
+        model_name: Cross-encoder model to use
+
+    Returns:
+        List of the top_k chunks
+    """
+    try:
+        if method == "cross-encoder":
+            try:
+                await asyncio.to_thread(get_cross_encoder, model_name)
+            except Exception as e:
+                print(f"Error loading reranker model {model_name}, using lexical reranking: {e}")
+                method = "lexical"
+            else:
+                return await asyncio.to_thread(rerank_chunks, query, chunks, top_k, method,
+                                               batch_size, latency_budget_ms, model_name)
+        return rerank_chunks(query, chunks, top_k, method, batch_size, latency_budget_ms, model_name)
+    except Exception as e:
+        print(f"Error reranking documents: {e}")
+        return chunks[:top_k]
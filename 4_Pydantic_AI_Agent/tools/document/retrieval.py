@@ -5,44 +5,148 @@ This module provides functions for retrieving documents from the knowledge base.
 """
 
 from openai import AsyncOpenAI
-from supabase import Client
-from typing import List
+from supabase import AsyncClient
+from typing import List, Optional, AsyncIterator, Tuple
 import json
+import os
 
 from ..common.embedding import get_embedding
+from .reranking import rerank_documents, RERANK_METHODS, DEFAULT_CROSS_ENCODER_MODEL
+
+# Optional per query search settings for the vector index on documents.embedding (see sql/documents.sql)
+# Higher values raise recall at the cost of latency, unset keeps the database defaults
+VECTOR_EF_SEARCH = int(os.getenv('VECTOR_EF_SEARCH')) if os.getenv('VECTOR_EF_SEARCH') else None
+VECTOR_PROBES = int(os.getenv('VECTOR_PROBES')) if os.getenv('VECTOR_PROBES') else None
+
+# Retrieval mode: "vector" searches the embeddings only, "hybrid" also runs a full-text search over the chunk
+# content and fuses both rankings with reciprocal rank fusion (hybrid_search_documents in sql/documents.sql)
+RETRIEVAL_SEARCH_MODE = os.getenv('RETRIEVAL_SEARCH_MODE') or 'vector'
+RETRIEVAL_MATCH_COUNT = int(os.getenv('RETRIEVAL_MATCH_COUNT', '4'))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '50'))
+HYBRID_FULL_TEXT_WEIGHT = float(os.getenv('HYBRID_FULL_TEXT_WEIGHT', '1.0'))
+HYBRID_SEMANTIC_WEIGHT = float(os.getenv('HYBRID_SEMANTIC_WEIGHT', '1.0'))
+
+# Upper bound on the chunks returned by one search, so a single call can't flood the LLM context
+MAX_MATCH_COUNT = 20
+SEARCH_MODES = ("vector", "hybrid")
+
+# Optional reranking: RERANK_CANDIDATES chunks are fetched and reranked ("lexical" or "cross-encoder"),
+# then the top ones returned. Scoring stops after RERANK_LATENCY_BUDGET_MS, unscored chunks keep their order
+RERANK_METHOD = os.getenv('RERANK_METHOD') or 'none'
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', '16'))
+RERANK_LATENCY_BUDGET_MS = float(os.getenv('RERANK_LATENCY_BUDGET_MS', '300'))
+RERANK_MODEL = os.getenv('RERANK_MODEL') or DEFAULT_CROSS_ENCODER_MODEL
+MAX_RERANK_CANDIDATES = 100
+
+# get_document_content returns a window of at most DOCUMENT_CONTENT_MAX_CHUNKS chunks / DOCUMENT_CONTENT_MAX_TOKENS
+# (estimated) tokens, read DOCUMENT_CONTENT_PAGE_SIZE chunks per request
+DOCUMENT_CONTENT_MAX_CHUNKS = int(os.getenv('DOCUMENT_CONTENT_MAX_CHUNKS', '50'))
+DOCUMENT_CONTENT_MAX_TOKENS = int(os.getenv('DOCUMENT_CONTENT_MAX_TOKENS', '4000'))
+DOCUMENT_CONTENT_PAGE_SIZE = 20
 
 async def retrieve_relevant_documents_tool(
-    supabase: Client, 
+    supabase: AsyncClient, 
     embedding_client: AsyncOpenAI, 
-    user_query: str
+    user_query: str,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    file_ids: Optional[List[str]] = None,
+    mime_type: Optional[str] = None,
+    folder: Optional[str] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None,
+    match_count: Optional[int] = None,
+    search_mode: Optional[str] = None,
+    rrf_k: Optional[int] = None,
+    full_text_weight: Optional[float] = None,
+    semantic_weight: Optional[float] = None,
+    rerank: Optional[str] = None
 ) -> str:
     """
     Function to retrieve relevant document chunks with RAG.
     This is called by the retrieve_relevant_documents tool for the agent.
     
     Args:
-        supabase: The Supabase client
+        supabase: The async Supabase client
         embedding_client: The OpenAI client for generating embeddings
         user_query: The user's question or query
+        ef_search: HNSW candidate list size for this search (defaults to VECTOR_EF_SEARCH)
+        probes: Number of IVFFlat lists to probe for this search (defaults to VECTOR_PROBES)
+        file_ids: Only search the chunks of these documents
+        mime_type: Only search documents of this mime type
+        folder: Only search documents in this folder or its subfolders (Google Drive folder ID or local directory)
+        modified_after: Only search documents modified at or after this ISO 8601 date/time
+        modified_before: Only search documents modified before this ISO 8601 date/time
+        match_count: Number of chunks to return (defaults to RETRIEVAL_MATCH_COUNT, at most MAX_MATCH_COUNT)
+        search_mode: "vector" or "hybrid" (defaults to RETRIEVAL_SEARCH_MODE)
+        rrf_k: Hybrid: rank constant of the fusion, higher values flatten the difference between ranks
+        full_text_weight: Hybrid: weight of the full-text ranking
+        semantic_weight: Hybrid: weight of the vector ranking
+        rerank: "none", "lexical" or "cross-encoder" (defaults to RERANK_METHOD)
         
     Returns:
         str: Formatted string containing relevant document chunks with metadata
     """
     try:
+        search_mode = search_mode or RETRIEVAL_SEARCH_MODE
+        if search_mode not in SEARCH_MODES:
+            return f"Unknown search mode: {search_mode} (use one of {', '.join(SEARCH_MODES)})"
+        rerank = rerank or RERANK_METHOD
+        if rerank not in RERANK_METHODS:
+            return f"Unknown rerank method: {rerank} (use one of {', '.join(RERANK_METHODS)})"
+        
         # Generate embedding for the query
         embedding = await get_embedding(user_query, embedding_client)
         
         # Query Supabase for similar documents
-        response = supabase.rpc(
-            'match_documents',
-            {'query_embedding': embedding, 'match_count': 4}
-        ).execute()
+        match_count = max(1, min(match_count or RETRIEVAL_MATCH_COUNT, MAX_MATCH_COUNT))
+        # Over-fetch candidates for the reranker
+        fetch_count = match_count
+        if rerank != 'none':
+            fetch_count = min(max(RERANK_CANDIDATES, match_count), MAX_RERANK_CANDIDATES)
+        params = {'query_embedding': embedding, 'match_count': fetch_count}
+        
+        # Only sent when set so older match_documents functions keep working
+        ef_search = ef_search or VECTOR_EF_SEARCH
+        probes = probes or VECTOR_PROBES
+        if ef_search:
+            params['ef_search'] = ef_search
+        if probes:
+            params['probes'] = probes
+        
+        # Filters are applied inside the search (see sql/documents.sql), not to the top results afterwards
+        filters = {
+            'filter_file_ids': file_ids,
+            'filter_mime_type': mime_type,
+            'filter_folder': folder,
+            'modified_after': modified_after,
+            'modified_before': modified_before
+        }
+        params.update({name: value for name, value in filters.items() if value})
+        
+        if search_mode == 'hybrid':
+            # Both searches and the fusion run in one database call
+            params.update({
+                'query_text': user_query,
+                'rrf_k': rrf_k if rrf_k is not None else HYBRID_RRF_K,
+                'full_text_weight': full_text_weight if full_text_weight is not None else HYBRID_FULL_TEXT_WEIGHT,
+                'semantic_weight': semantic_weight if semantic_weight is not None else HYBRID_SEMANTIC_WEIGHT
+            })
+            response = await supabase.rpc('hybrid_search_documents', params).execute()
+        else:
+            response = await supabase.rpc('match_documents', params).execute()
         
         if len(response.data) == 0:
             return "No relevant documents found for the query."
+        
+        results = response.data
+        if rerank != 'none':
+            results = await rerank_documents(user_query, results, match_count, rerank, RERANK_BATCH_SIZE,
+                                             RERANK_LATENCY_BUDGET_MS, RERANK_MODEL)
             
         chunks = []
-        for i, item in enumerate(response.data, 1):
+        for i, item in enumerate(results, 1):
             # Extract metadata
             metadata = json.loads(item['metadata']) if item.get('metadata') else {}
             source_info = f" (Source: {metadata.get('source', 'Unknown')})" if metadata.get('source') else ""
@@ -56,20 +160,20 @@ async def retrieve_relevant_documents_tool(
         print(f"Error retrieving documents: {e}")
         return f"Error retrieving documents: {str(e)}"
 
-async def list_documents_tool(supabase: Client) -> List[str]:
+async def list_documents_tool(supabase: AsyncClient) -> List[str]:
     """
     Function to retrieve a list of all available documents.
     This is called by the list_documents tool for the agent.
     
     Args:
-        supabase: The Supabase client
+        supabase: The async Supabase client
         
     Returns:
         List[str]: List of documents including their metadata (URL/path, schema if applicable, etc.)
     """
     try:
         # Query all documents from document_metadata table
-        response = supabase.table('document_metadata').select('*').execute()
+        response = await supabase.table('document_metadata').select('*').execute()
         
         if len(response.data) == 0:
             return ["No documents available in the knowledge base."]
@@ -86,6 +190,13 @@ async def list_documents_tool(supabase: Client) -> List[str]:
             schema_info = ""
             if doc.get('schema'):
                 schema_info = f" (Schema: {doc['schema']})"
+            
+            # Typed table the SQL tool can query instead of document_rows
+            if doc.get('dataset_table'):
+                schema_info += f" (Typed table: {doc['dataset_table']})"
+                renamed = {column: name for column, name in (doc.get('dataset_columns') or {}).items() if column != name}
+                if renamed:
+                    schema_info += f" (Renamed typed table columns: {json.dumps(renamed)})"
                 
             documents.append(f"ID: {doc_id} - {title} from {source} ({file_type}){schema_info}")
             
@@ -94,37 +205,107 @@ async def list_documents_tool(supabase: Client) -> List[str]:
         print(f"Error listing documents: {e}")
         return [f"Error listing documents: {str(e)}"]
 
-async def get_document_content_tool(supabase: Client, document_id: str) -> str:
+async def iter_document_chunks(
+    supabase: AsyncClient,
+    document_id: str,
+    offset: int = 0,
+    page_size: int = DOCUMENT_CONTENT_PAGE_SIZE
+) -> AsyncIterator[Tuple[str, Optional[int]]]:
+    """
+    Stream the content of a document's chunks in order, one page of chunks per request.
+    Only the content column is selected, never the metadata (which holds the whole file for images).
+    
+    Args:
+        supabase: The async Supabase client
+        document_id: The ID (or file path) of the document
+        offset: Position of the first chunk to read
+        page_size: Number of chunks fetched per request
+        
+    Yields:
+        Tuple of the chunk content and the total number of chunks of the document
     """
-    Retrieve the full content of a specific document by combining all its chunks.
+    start = offset
+    total = None
+    while True:
+        # The chunk count is only needed once
+        select = supabase.table('documents').select('content', count='exact') if total is None \
+            else supabase.table('documents').select('content')
+        response = await select \
+            .eq('file_id', document_id) \
+            .order('metadata->chunk_index') \
+            .range(start, start + page_size - 1) \
+            .execute()
+        if total is None:
+            total = response.count
+        
+        for row in response.data:
+            yield row.get('content') or '', total
+        
+        if len(response.data) < page_size:
+            return
+        start += page_size
+
+async def get_document_content_tool(
+    supabase: AsyncClient,
+    document_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    max_tokens: Optional[int] = None
+) -> str:
+    """
+    Retrieve the content of a specific document, one window of chunks at a time.
     This is called by the get_document_content tool for the agent.
     
+    Chunks are read in order from the offset until the limit or the token budget is reached
+    (at least one chunk is always returned). When more of the document is left, the result ends
+    with the offset to continue from.
+    
     Args:
-        supabase: The Supabase client
+        supabase: The async Supabase client
         document_id: The ID (or file path) of the document to retrieve
+        offset: Position of the first chunk to return
+        limit: Maximum number of chunks to return (defaults to DOCUMENT_CONTENT_MAX_CHUNKS)
+        max_tokens: Approximate token budget of the returned content (defaults to DOCUMENT_CONTENT_MAX_TOKENS)
         
     Returns:
-        str: The complete content of the document with all chunks combined in order
+        str: The content of the chunks in order
     """
     try:
+        offset = max(0, offset or 0)
+        limit = max(1, limit or DOCUMENT_CONTENT_MAX_CHUNKS)
+        max_tokens = max_tokens or DOCUMENT_CONTENT_MAX_TOKENS
+        
         # First check if the document exists
-        metadata_response = supabase.table('document_metadata').select('*').eq('id', document_id).execute()
+        metadata_response = await supabase.table('document_metadata').select('id').eq('id', document_id).execute()
         
         if len(metadata_response.data) == 0:
             return f"Document with ID {document_id} not found."
-            
-        # Get document chunks ordered by chunk_index
-        chunks_response = supabase.table('documents').select('*').eq('metadata->>document_id', document_id).order('metadata->>chunk_index').execute()
         
-        if len(chunks_response.data) == 0:
-            return f"No content chunks found for document with ID {document_id}."
-            
-        # Combine all chunks
         content_chunks = []
-        for chunk in chunks_response.data:
-            content_chunks.append(chunk.get('content', ''))
-            
-        return "\n".join(content_chunks)
+        tokens = 0
+        total = None
+        async for content, total in iter_document_chunks(supabase, document_id, offset,
+                                                         min(limit, DOCUMENT_CONTENT_PAGE_SIZE)):
+            # Rough estimate of 4 characters per token
+            chunk_tokens = len(content) // 4 + 1
+            if content_chunks and tokens + chunk_tokens > max_tokens:
+                break
+            content_chunks.append(content)
+            tokens += chunk_tokens
+            if len(content_chunks) >= limit:
+                break
+        
+        if not content_chunks:
+            if offset and total:
+                return f"Document with ID {document_id} has {total} chunks, there is no chunk at offset {offset}."
+            return f"No content chunks found for document with ID {document_id}."
+        
+        content = "\n".join(content_chunks)
+        end = offset + len(content_chunks)
+        if total is not None and end < total:
+            content += (f"\n\n[Showing chunks {offset}-{end - 1} of {total}. "
+                        f"Call get_document_content with offset={end} to continue reading.]")
+        return content
     except Exception as e:
         print(f"Error retrieving document content: {e}")
         return f"Error retrieving document content: {str(e)}"
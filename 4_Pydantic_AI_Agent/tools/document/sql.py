@@ -4,15 +4,17 @@ SQL query tools for tabular document data.
 This module provides SQL query functionality for tabular data stored in the database.
 """
 
-from supabase import Client
+from supabase import AsyncClient
 import re
 import json
 
-async def execute_sql_query_tool(supabase: Client, sql_query: str) -> str:
+async def execute_sql_query_tool(supabase: AsyncClient, sql_query: str) -> str:
     """
     Run a SQL query - use this to query from the document_rows table once you know the file ID you are querying. 
     dataset_id is the file_id and you are always using the row_data for filtering, which is a jsonb field that has 
     all the keys from the file schema given in the document_metadata table.
+    The schema maps each column to its type (integer, number, boolean, date, timestamp, timestamptz or text) - numbers and
+    booleans are stored as JSON values, so cast row_data->>'column' to the matching type (numeric, boolean, date, ...).
 
     Never use a placeholder file ID. Always use the list_documents tool first to get the file ID.
 
@@ -30,9 +32,20 @@ async def execute_sql_query_tool(supabase: Client, sql_query: str) -> str:
     FROM document_rows
     WHERE dataset_id = '123'
     GROUP BY row_data->>'category';
+
+    If the file has a typed table, query that instead - it has one natively typed column per column of the file,
+    so no casts are needed and it is much faster. Look it up by the file ID (don't guess the table name):
+
+    SELECT table_name, columns FROM dataset_tables WHERE dataset_id = '123';
+
+    columns maps each column of the file to its column in the typed table (usually the same name). Then:
+
+    SELECT category, SUM(sales) AS total_sales
+    FROM datasets.dataset_0123456789abcdef
+    GROUP BY category;
     
     Args:
-        supabase: The Supabase client
+        supabase: The async Supabase client
         sql_query: The SQL query to execute (must be read-only)
         
     Returns:
@@ -44,7 +57,7 @@ async def execute_sql_query_tool(supabase: Client, sql_query: str) -> str:
             return "Only SELECT queries are allowed for security reasons."
         
         # Execute the query on Supabase
-        response = supabase.rpc('execute_sql', {'query_text': sql_query}).execute()
+        response = await supabase.rpc('execute_sql', {'query_text': sql_query}).execute()
         
         if 'error' in response:
             return f"SQL Error: {response['error']['message']}"
@@ -7,18 +7,18 @@ This module provides image analysis functionality using vision AI models.
 from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai.models.openai import OpenAIModel
 from pydantic_ai import Agent, BinaryContent
-from supabase import Client
+from supabase import AsyncClient
 import base64
 import os
 
-async def image_analysis_tool(supabase: Client, document_id: str, query: str) -> str:
+async def image_analysis_tool(supabase: AsyncClient, document_id: str, query: str) -> str:
     """
     Analyzes an image based on the document ID of the image provided.
     This function pulls the binary of the image from the knowledge base
     and passes that into a subagent with a vision LLM.
     
     Args:
-        supabase: The Supabase client
+        supabase: The async Supabase client
         document_id: The ID (or file path) of the image to analyze
         query: What to extract from the image analysis
         
@@ -27,7 +27,7 @@ async def image_analysis_tool(supabase: Client, document_id: str, query: str) ->
     """
     try:
         # First, get the document metadata to ensure it's an image
-        metadata_response = supabase.table('document_metadata').select('*').eq('id', document_id).execute()
+        metadata_response = await supabase.table('document_metadata').select('*').eq('id', document_id).execute()
         
         if len(metadata_response.data) == 0:
             return f"Image with ID {document_id} not found."
@@ -42,7 +42,7 @@ async def image_analysis_tool(supabase: Client, document_id: str, query: str) ->
             return f"Document with ID {document_id} is not an image (type: {file_type})."
             
         # Get the image binary data
-        binary_response = supabase.table('document_binary').select('*').eq('document_id', document_id).execute()
+        binary_response = await supabase.table('document_binary').select('*').eq('document_id', document_id).execute()
         
         if len(binary_response.data) == 0:
             return f"Binary data for image with ID {document_id} not found."